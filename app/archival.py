@@ -0,0 +1,345 @@
+"""
+Tiered Archival for AI Marketing Agent.
+Moves old email history, generations and website analyses out of the hot
+collections so the working set and sorted queries stay small.
+
+Archived documents are stored compressed, either:
+- "collection": zlib-compressed BSON inside `<collection>_archive`
+- "file": gzip NDJSON files under ARCHIVE_DIR, with a small locator
+  document per archived ID in `<collection>_archive`
+
+Either way, `read_archived()` finds a document by its original ID, and the
+locator keeps the fields rollups need, so all-time counts stay correct.
+
+Generated content is archived as plain text (blob references resolved), so
+archives are self-contained; the hot documents' blob references are then
+released and unreferenced blobs garbage-collected (app/content_store.py).
+"""
+
+import asyncio
+import gzip
+import os
+import zlib
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional, List, Dict, Any
+
+import bson
+from bson import ObjectId, Binary, json_util
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.database import get_database
+from app import content_store
+
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_TARGET = os.getenv("ARCHIVE_TARGET", "collection")  # "collection" or "file"
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+
+# Archivable collection -> (timestamp field, fields kept on the locator for rollups)
+ARCHIVED_COLLECTIONS = {
+    "email_history": ("sent_at", ["success", "lead_id"]),
+    "generations": ("created_at", ["type"]),
+    "website_analyses": ("created_at", []),
+}
+
+
+def archive_collection_name(collection_name: str) -> str:
+    return f"{collection_name}_archive"
+
+
+def _locator(collection_name: str, document: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    """Build the archive document that survives in Mongo for an archived document."""
+    time_field, kept_fields = ARCHIVED_COLLECTIONS[collection_name]
+    locator = {
+        "_id": document["_id"],
+        time_field: document.get(time_field),
+        "archived_at": now,
+    }
+    for field in kept_fields:
+        locator[field] = document.get(field)
+    return locator
+
+
+def _write_file_batch(collection_name: str, documents: List[Dict[str, Any]], now: datetime) -> Dict[str, Any]:
+    """
+    Append a batch to this month's archive file as one gzip member.
+
+    Concatenated gzip members are still a valid gzip file, so archives can
+    be read with standard tools (`zcat archive/generations/2026-01.ndjson.gz`).
+    """
+    directory = os.path.join(ARCHIVE_DIR, collection_name)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{now:%Y-%m}.ndjson.gz")
+
+    payload = "\n".join(json_util.dumps(document) for document in documents).encode("utf-8")
+    member = gzip.compress(payload)
+
+    with open(path, "ab") as f:
+        offset = f.tell()
+        f.write(member)
+        f.flush()
+        os.fsync(f.fileno())
+
+    return {"file": path, "offset": offset, "length": len(member)}
+
+
+async def archive_collection(
+    collection_name: str,
+    older_than_days: int = ARCHIVE_AFTER_DAYS,
+    target: str = ARCHIVE_TARGET,
+    batch_size: int = ARCHIVE_BATCH_SIZE
+) -> int:
+    """
+    Archive documents older than `older_than_days` from one collection.
+
+    Each batch is written to the archive before it is deleted from the hot
+    collection, and archive writes ignore duplicate IDs, so an interrupted
+    run can simply be repeated.
+
+    Returns the number of documents archived.
+    """
+    if collection_name not in ARCHIVED_COLLECTIONS:
+        raise ValueError(f"Collection {collection_name} is not archivable")
+    if target not in ("collection", "file"):
+        raise ValueError("Archive target must be 'collection' or 'file'")
+
+    db = get_database()
+    time_field, _ = ARCHIVED_COLLECTIONS[collection_name]
+    archive = db[archive_collection_name(collection_name)]
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    packed_field = content_store.PACKED_FIELDS.get(collection_name)
+    archived = 0
+    released = 0
+
+    while True:
+        documents = await db[collection_name].find(
+            {time_field: {"$lt": cutoff}}
+        ).sort(time_field, 1).limit(batch_size).to_list(batch_size)
+
+        if not documents:
+            break
+
+        now = datetime.utcnow()
+        locators = [_locator(collection_name, document, now) for document in documents]
+        # Blob references held by the hot copies, released once they are deleted
+        packed = [{packed_field: document.get(packed_field)} for document in documents] if packed_field else []
+        if packed_field:
+            await content_store.unpack_documents(db, collection_name, documents)
+
+        if target == "file":
+            location = await asyncio.to_thread(_write_file_batch, collection_name, documents, now)
+            for line, locator in enumerate(locators):
+                locator.update({"storage": "file", "line": line, **location})
+        else:
+            for document, locator in zip(documents, locators):
+                locator.update({
+                    "storage": "collection",
+                    "codec": "zlib",
+                    "payload": Binary(zlib.compress(bson.encode(document), 6))
+                })
+
+        try:
+            await archive.insert_many(locators, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+        await db[collection_name].delete_many({"_id": {"$in": [d["_id"] for d in documents]}})
+        if packed:
+            released += await content_store.release_documents(db, collection_name, packed)
+        archived += len(documents)
+
+    if released:
+        collected = await content_store.collect_garbage(db)
+        print(f"[Archive] Released {released} content blob references, collected {collected} unreferenced blobs")
+    if archived:
+        print(f"[Archive] Archived {archived} {collection_name} documents older than {older_than_days} days")
+    return archived
+
+
+async def run_archival(older_than_days: int = ARCHIVE_AFTER_DAYS, target: str = ARCHIVE_TARGET) -> Dict[str, int]:
+    """Archive all archivable collections. Returns counts per collection."""
+    return {
+        collection_name: await archive_collection(collection_name, older_than_days, target)
+        for collection_name in ARCHIVED_COLLECTIONS
+    }
+
+
+def _with_locator_fields(collection_name: str, locator: Dict[str, Any], document: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Apply the locator's kept fields to a file-archived document: archive
+    files are append-only, so fields reassigned later (see
+    `reassign_archived`) are only updated on the locator.
+    """
+    _, kept_fields = ARCHIVED_COLLECTIONS[collection_name]
+    for field in kept_fields:
+        if field in locator:
+            document[field] = locator[field]
+    return document
+
+
+def _read_file_document(locator: Dict[str, Any]) -> Dict[str, Any]:
+    with open(locator["file"], "rb") as f:
+        f.seek(locator["offset"])
+        member = f.read(locator["length"])
+    lines = gzip.decompress(member).decode("utf-8").split("\n")
+    return json_util.loads(lines[locator["line"]])
+
+
+async def read_archived(collection_name: str, document_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Read an archived document by its original ID.
+
+    Returns the document as it was in the hot collection (generated content
+    as plain text), or None.
+    """
+    if collection_name not in ARCHIVED_COLLECTIONS or not ObjectId.is_valid(document_id):
+        return None
+
+    db = get_database()
+    locator = await db[archive_collection_name(collection_name)].find_one({"_id": ObjectId(document_id)})
+    if not locator:
+        return None
+
+    if locator.get("storage") == "file":
+        return _with_locator_fields(collection_name, locator, await asyncio.to_thread(_read_file_document, locator))
+    return bson.decode(zlib.decompress(locator["payload"]))
+
+
+def _read_file_documents(locators: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Decode file-archived documents, reading each gzip member once."""
+    members: Dict[tuple, List[str]] = {}
+    documents = []
+    for locator in locators:
+        key = (locator["file"], locator["offset"], locator["length"])
+        if key not in members:
+            with open(locator["file"], "rb") as f:
+                f.seek(locator["offset"])
+                members[key] = gzip.decompress(f.read(locator["length"])).decode("utf-8").split("\n")
+        documents.append(json_util.loads(members[key][locator["line"]]))
+    return documents
+
+
+async def iter_archived(
+    collection_name: str,
+    query: Optional[Dict[str, Any]] = None,
+    batch_size: int = ARCHIVE_BATCH_SIZE
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield archived documents of a collection, oldest first, as they were in
+    the hot collection.
+
+    `query` runs against the locators, so it may only use the timestamp
+    field and the fields kept on the locator for rollups.
+    """
+    db = get_database()
+    time_field, _ = ARCHIVED_COLLECTIONS[collection_name]
+    cursor = db[archive_collection_name(collection_name)].find(query or {}).sort(time_field, 1).batch_size(batch_size)
+
+    batch: List[Dict[str, Any]] = []
+    async for locator in cursor:
+        batch.append(locator)
+        if len(batch) >= batch_size:
+            for document in await _decode_locators(collection_name, batch):
+                yield document
+            batch = []
+    if batch:
+        for document in await _decode_locators(collection_name, batch):
+            yield document
+
+
+async def _decode_locators(collection_name: str, locators: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    in_files = [locator for locator in locators if locator.get("storage") == "file"]
+    from_files = iter(await asyncio.to_thread(_read_file_documents, in_files)) if in_files else iter(())
+    return [
+        _with_locator_fields(collection_name, locator, next(from_files)) if locator.get("storage") == "file"
+        else bson.decode(zlib.decompress(locator["payload"]))
+        for locator in locators
+    ]
+
+
+async def reassign_archived(collection_name: str, field: str, mapping: Dict[Any, Any]) -> int:
+    """
+    Change a kept field (e.g. email history `lead_id`) on archived documents,
+    from each key of `mapping` to its value.
+
+    The locator is updated, and so is the compressed payload of documents
+    archived to a collection; file archives are append-only, so reads apply
+    the locator's value instead.
+
+    Returns the number of archived documents changed.
+    """
+    if field not in ARCHIVED_COLLECTIONS.get(collection_name, (None, []))[1]:
+        raise ValueError(f"{field} is not kept on {collection_name} archive locators")
+    if not mapping:
+        return 0
+
+    archive = get_database()[archive_collection_name(collection_name)]
+    operations = []
+    changed = 0
+    async for locator in archive.find({field: {"$in": list(mapping)}}):
+        update = {field: mapping[locator[field]]}
+        if locator.get("storage") != "file":
+            document = bson.decode(zlib.decompress(locator["payload"]))
+            document[field] = update[field]
+            update["payload"] = Binary(zlib.compress(bson.encode(document), 6))
+        operations.append(UpdateOne({"_id": locator["_id"]}, {"$set": update}))
+        if len(operations) >= ARCHIVE_BATCH_SIZE:
+            changed += (await archive.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+    if operations:
+        changed += (await archive.bulk_write(operations, ordered=False)).modified_count
+    return changed
+
+
+async def get_archive_status() -> Dict[str, Any]:
+    """Count hot vs archived documents per archivable collection."""
+    db = get_database()
+    status = {}
+    for collection_name in ARCHIVED_COLLECTIONS:
+        status[collection_name] = {
+            "hot": await db[collection_name].estimated_document_count(),
+            "archived": await db[archive_collection_name(collection_name)].estimated_document_count(),
+        }
+    return {
+        "older_than_days": ARCHIVE_AFTER_DAYS,
+        "target": ARCHIVE_TARGET,
+        "collections": status,
+    }
+
+
+async def ensure_archive_indexes() -> None:
+    """Index the timestamp fields archival scans and archive exports sort on."""
+    db = get_database()
+    for collection_name, (time_field, _) in ARCHIVED_COLLECTIONS.items():
+        await db[collection_name].create_index(time_field)
+        await db[archive_collection_name(collection_name)].create_index(time_field)
+    # Lead merges reassign archived history by lead_id
+    await db[archive_collection_name("email_history")].create_index("lead_id")
+
+
+# ============================================
+# Periodic Archival
+# ============================================
+
+_archiver_task: Optional[asyncio.Task] = None
+
+
+async def _archive_periodically(interval_hours: float) -> None:
+    while True:
+        try:
+            await run_archival()
+        except Exception as e:
+            print(f"[Archive] Run failed: {e}")
+        await asyncio.sleep(interval_hours * 3600)
+
+
+def start_archiver() -> None:
+    """Start periodic archival if ARCHIVE_INTERVAL_HOURS is set."""
+    global _archiver_task
+    interval = os.getenv("ARCHIVE_INTERVAL_HOURS")
+    if interval and (_archiver_task is None or _archiver_task.done()):
+        _archiver_task = asyncio.create_task(_archive_periodically(float(interval)))
+        print(f"[Archive] Periodic archival every {interval}h (older than {ARCHIVE_AFTER_DAYS} days)")
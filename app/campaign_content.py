@@ -0,0 +1,408 @@
+"""
+Campaign Email Content for AI Marketing Agent.
+Builds the subject and body of a campaign email for one lead, either from
+subject/body templates or with an AI-personalized draft. Shared by the
+campaign endpoints and the background campaign runner.
+
+AI emails can be generated per lead (one LLM call each) or per segment:
+one draft per (score tier, industry) with {name}/{company} placeholders,
+filled in locally for every lead of the segment. High-value leads
+(score >= AI_BESPOKE_MIN_SCORE or deal value >= AI_BESPOKE_MIN_VALUE)
+still get a bespoke per-lead email.
+
+Per-lead emails can also be batched: up to AI_MAX_LEADS_PER_PROMPT leads in
+one prompt (the instructions and business context sent once) that returns a
+JSON array of {lead_id, subject, body}. Items are validated one by one and
+only the leads whose items are missing or invalid are retried, in smaller
+prompts, up to AI_BATCH_MAX_RETRIES times.
+"""
+
+import asyncio
+import json
+import os
+import re
+from typing import Optional, List, Dict, Any, Tuple
+
+
+AI_BESPOKE_MIN_SCORE = int(os.getenv("AI_BESPOKE_MIN_SCORE") or "90")
+AI_BESPOKE_MIN_VALUE = int(os.getenv("AI_BESPOKE_MIN_VALUE") or "50000")
+AI_MAX_LEADS_PER_PROMPT = int(os.getenv("AI_MAX_LEADS_PER_PROMPT") or "20")
+AI_BATCH_MAX_RETRIES = int(os.getenv("AI_BATCH_MAX_RETRIES") or "2")
+MAX_SUBJECT_LENGTH = 150
+
+TIER_DESCRIPTIONS = {
+    "hot": "hot leads - very interested, ready to talk",
+    "warm": "warm leads - interested, need a reason to act",
+    "medium": "engaged leads - aware of us, still evaluating",
+    "cool": "cool leads - little engagement so far",
+    "cold": "cold leads - need nurturing",
+}
+
+
+def render_template_email(lead: Dict[str, Any], subject_template: str, body_template: str) -> Tuple[str, str]:
+    """
+    Fill the templates with the lead's fields.
+
+    Subject placeholders: {name}, {company}, {score}; the body also gets {email}.
+    Raises KeyError/ValueError for templates with unknown placeholders.
+    """
+    lead_name = lead.get("name", "Valued Customer")
+    lead_company = lead.get("company", "")
+    lead_score = lead.get("score", 50)
+
+    subject = subject_template.format(
+        name=lead_name,
+        company=lead_company,
+        score=lead_score
+    )
+    body = body_template.format(
+        name=lead_name,
+        email=lead.get("email"),
+        company=lead_company,
+        score=lead_score
+    )
+    return subject, body
+
+
+def build_ai_email_prompt(lead: Dict[str, Any], business_context: str) -> str:
+    """Prompt asking the LLM for a personalized email for one lead."""
+    lead_name = lead.get("name", "Valued Customer")
+    lead_company = lead.get("company", "")
+    lead_score = lead.get("score", 50)
+
+    return f"""Generate a personalized marketing email for this lead:
+
+Lead Name: {lead_name}
+Company: {lead_company}
+Lead Score: {lead_score}/100 ({"hot lead - very interested" if lead_score >= 80 else "warm lead" if lead_score >= 50 else "needs nurturing"})
+
+Business Context: {business_context}
+
+Requirements:
+1. Create a compelling subject line (under 50 characters)
+2. Write a personalized email body (150-200 words)
+3. Include a clear call-to-action
+4. Reference their company name naturally
+5. Be professional but friendly
+
+Format your response exactly as:
+SUBJECT: [your subject line]
+---
+[email body]"""
+
+
+def parse_ai_email(email_content: str, lead: Dict[str, Any]) -> Tuple[str, str]:
+    """Split an LLM response into (subject, body), with a fallback subject."""
+    if "SUBJECT:" in email_content and "---" in email_content:
+        parts = email_content.split("---", 1)
+        subject = parts[0].replace("SUBJECT:", "").strip()
+        body = parts[1].strip()
+    else:
+        subject = f"Exclusive Opportunity for {lead.get('company', '')}"
+        body = email_content
+    return subject, body
+
+
+async def generate_ai_email(llm, lead: Dict[str, Any], business_context: str) -> Tuple[str, str]:
+    """Generate a personalized (subject, body) for one lead without blocking the event loop."""
+    response = await llm.ainvoke(build_ai_email_prompt(lead, business_context))
+    return parse_ai_email(response.content, lead)
+
+
+# ============================================
+# Segment Drafts
+# ============================================
+
+def lead_tier(lead: Dict[str, Any]) -> str:
+    """Score tier of a lead (same bands as the email campaign priority)."""
+    if lead.get("priority") in TIER_DESCRIPTIONS:
+        return lead["priority"]
+    score = lead.get("score", 50)
+    return "hot" if score >= 90 else "warm" if score >= 70 else "medium" if score >= 50 else "cool" if score >= 30 else "cold"
+
+
+def segment_key(lead: Dict[str, Any]) -> str:
+    """
+    Draft segment of a lead: "tier|industry". Leads without an industry
+    share the tier's "general" draft. Safe to use as a MongoDB field name.
+    """
+    industry = re.sub(r"[.$|\s]+", "_", str(lead.get("industry") or "").strip().lower()) or "general"
+    return f"{lead_tier(lead)}|{industry}"
+
+
+def is_high_value(lead: Dict[str, Any], min_score: int = AI_BESPOKE_MIN_SCORE, min_value: int = AI_BESPOKE_MIN_VALUE) -> bool:
+    """Whether a lead warrants its own LLM-written email."""
+    try:
+        value = float(lead.get("value") or 0)
+    except (TypeError, ValueError):
+        value = 0.0
+    return lead.get("score", 50) >= min_score or value >= min_value
+
+
+def build_segment_email_prompt(key: str, business_context: str) -> str:
+    """Prompt asking the LLM for one email draft for a whole segment."""
+    tier, _, industry = key.partition("|")
+    audience = "companies in any industry" if industry == "general" else f"companies in the {industry.replace('_', ' ')} industry"
+
+    return f"""Generate a marketing email template for a group of leads:
+
+Audience: {audience}
+Lead Tier: {TIER_DESCRIPTIONS.get(tier, tier)}
+
+Business Context: {business_context}
+
+Requirements:
+1. Create a compelling subject line (under 50 characters)
+2. Write an email body (150-200 words)
+3. Include a clear call-to-action
+4. Write {{name}} wherever the recipient's name goes and {{company}} wherever their company name goes; reference the company naturally
+5. Do not use any other placeholders or brackets
+6. Be professional but friendly
+
+Format your response exactly as:
+SUBJECT: [your subject line]
+---
+[email body]"""
+
+
+def personalize_draft(lead: Dict[str, Any], subject: str, body: str) -> Tuple[str, str]:
+    """Fill a segment draft's {name}/{company} placeholders for one lead."""
+    values = {"{name}": lead.get("name") or "there", "{company}": lead.get("company") or "your company"}
+    for placeholder, value in values.items():
+        subject = subject.replace(placeholder, value)
+        body = body.replace(placeholder, value)
+    return subject, body
+
+
+async def generate_segment_draft(llm, key: str, business_context: str) -> Tuple[str, str]:
+    """Generate the (subject, body) draft of one segment."""
+    response = await llm.ainvoke(build_segment_email_prompt(key, business_context))
+    return parse_ai_email(response.content, {"company": "{company}"})
+
+
+# ============================================
+# Batched Generation
+# ============================================
+
+def build_batch_email_prompt(leads: List[Dict[str, Any]], business_context: str) -> str:
+    """
+    Prompt asking the LLM for personalized emails for several leads at once.
+    Leads are referenced by their position ("1", "2", ...) as `lead_id`.
+    """
+    lines = []
+    for ref, lead in enumerate(leads, start=1):
+        lead_score = lead.get("score", 50)
+        lines.append(json.dumps({
+            "lead_id": str(ref),
+            "name": lead.get("name", "Valued Customer"),
+            "company": lead.get("company", ""),
+            "score": lead_score,
+            "tier": "hot lead - very interested" if lead_score >= 80 else "warm lead" if lead_score >= 50 else "needs nurturing",
+        }))
+    leads_block = "\n".join(lines)
+
+    return f"""Generate a personalized marketing email for each of these {len(leads)} leads:
+
+{leads_block}
+
+Business Context: {business_context}
+
+Requirements for every email:
+1. Create a compelling subject line (under 50 characters)
+2. Write a personalized email body (150-200 words)
+3. Include a clear call-to-action
+4. Reference the lead's company name naturally
+5. Be professional but friendly
+
+Respond with only a JSON array, one object per lead, in this exact format:
+[{{"lead_id": "1", "subject": "...", "body": "..."}}]"""
+
+
+def parse_batch_emails(content: str, count: int) -> Tuple[Dict[int, Tuple[str, str]], Dict[int, str]]:
+    """
+    Validate a batch response for `count` leads.
+
+    Returns ({position: (subject, body)} for the valid items,
+    {position: reason} for the leads without one). Positions are 0-based.
+    """
+    emails: Dict[int, Tuple[str, str]] = {}
+    reasons: Dict[int, str] = {}
+
+    text = content.strip()
+    start, end = text.find("["), text.rfind("]")
+    try:
+        if start < 0 or end < start:
+            raise ValueError("no JSON array in the response")
+        items = json.loads(text[start:end + 1])
+        if not isinstance(items, list):
+            raise ValueError("response is not a JSON array")
+    except ValueError as e:
+        return emails, {position: f"Invalid batch response: {e}" for position in range(count)}
+
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            position = int(str(item.get("lead_id")).strip()) - 1
+        except ValueError:
+            continue
+        if not 0 <= position < count or position in emails:
+            continue
+        subject, body = item.get("subject"), item.get("body")
+        if not isinstance(subject, str) or not subject.strip() or len(subject) > MAX_SUBJECT_LENGTH:
+            reasons[position] = "Invalid subject in batch response"
+        elif not isinstance(body, str) or not body.strip():
+            reasons[position] = "Empty body in batch response"
+        else:
+            emails[position] = (subject.strip(), body.strip())
+            reasons.pop(position, None)
+
+    for position in range(count):
+        if position not in emails:
+            reasons.setdefault(position, "Missing from batch response")
+    return emails, reasons
+
+
+async def generate_ai_emails_batched(
+    llm,
+    leads: List[Dict[str, Any]],
+    business_context: str,
+    leads_per_prompt: int,
+    concurrency: int = 4,
+    max_retries: int = AI_BATCH_MAX_RETRIES,
+    usage: Optional[Dict[str, int]] = None
+) -> List[Tuple[Dict[str, Any], Optional[str], Optional[str], Optional[str]]]:
+    """
+    (lead, subject, body, error) for each lead, in order, generated
+    `leads_per_prompt` leads per LLM call.
+
+    Leads missing or invalid in a response are retried, and only those:
+    each retry round halves the prompt size, and single leads fall back to
+    the per-lead prompt. LLM calls are counted in usage["llm_calls"].
+    """
+    usage = {} if usage is None else usage
+    semaphore = asyncio.Semaphore(concurrency)
+    size = max(1, min(leads_per_prompt, AI_MAX_LEADS_PER_PROMPT))
+    emails: Dict[int, Tuple[str, str]] = {}
+    reasons: Dict[int, str] = {}
+
+    async def generate(positions: List[int]) -> Tuple[Dict[int, Tuple[str, str]], Dict[int, str]]:
+        async with semaphore:
+            usage["llm_calls"] = usage.get("llm_calls", 0) + 1
+            try:
+                if len(positions) == 1:
+                    return {positions[0]: await generate_ai_email(llm, leads[positions[0]], business_context)}, {}
+                response = await llm.ainvoke(build_batch_email_prompt([leads[p] for p in positions], business_context))
+            except Exception as e:
+                return {}, {position: f"Failed to generate email: {str(e)}" for position in positions}
+        generated, failed = parse_batch_emails(response.content, len(positions))
+        return (
+            {positions[index]: email for index, email in generated.items()},
+            {positions[index]: reason for index, reason in failed.items()}
+        )
+
+    pending = list(range(len(leads)))
+    for attempt in range(max_retries + 1):
+        if not pending:
+            break
+        chunks = [pending[i:i + size] for i in range(0, len(pending), size)]
+        pending = []
+        for generated, failed in await asyncio.gather(*(generate(chunk) for chunk in chunks)):
+            emails.update(generated)
+            reasons.update(failed)
+            pending.extend(failed)
+        pending.sort()
+        size = max(1, size // 2)
+
+    return [
+        (lead, *emails[position], None) if position in emails else (lead, None, None, reasons[position])
+        for position, lead in enumerate(leads)
+    ]
+
+
+# ============================================
+# Generating Campaign Emails
+# ============================================
+
+async def generate_ai_emails(
+    llm,
+    leads: List[Dict[str, Any]],
+    business_context: str,
+    segment_drafts: bool = False,
+    drafts: Optional[Dict[str, Dict[str, str]]] = None,
+    concurrency: int = 4,
+    min_score: int = AI_BESPOKE_MIN_SCORE,
+    min_value: int = AI_BESPOKE_MIN_VALUE,
+    leads_per_prompt: int = 1,
+    usage: Optional[Dict[str, int]] = None
+) -> List[Tuple[Dict[str, Any], Optional[str], Optional[str], Optional[str]]]:
+    """
+    (lead, subject, body, error) for each lead, in order.
+
+    Without segment_drafts every lead gets its own email from the LLM. With
+    it, only high-value leads do; the others get their segment's draft,
+    personalized locally. `drafts` (segment key -> {"subject", "body"}) is
+    reused and extended with the drafts generated here, so a caller can
+    keep it across batches. With leads_per_prompt > 1, the per-lead emails
+    are generated that many leads per LLM call. LLM calls are counted in
+    usage["llm_calls"].
+    """
+    drafts = {} if drafts is None else drafts
+    usage = {} if usage is None else usage
+    usage.setdefault("llm_calls", 0)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bespoke(lead):
+        async with semaphore:
+            usage["llm_calls"] += 1
+            try:
+                subject, body = await generate_ai_email(llm, lead, business_context)
+                return lead, subject, body, None
+            except Exception as e:
+                return lead, None, None, f"Failed to generate email: {str(e)}"
+
+    async def bespoke_emails(bespoke_leads):
+        if leads_per_prompt > 1:
+            return await generate_ai_emails_batched(
+                llm, bespoke_leads, business_context, leads_per_prompt, concurrency, usage=usage
+            )
+        return list(await asyncio.gather(*(bespoke(lead) for lead in bespoke_leads)))
+
+    if not segment_drafts:
+        return await bespoke_emails(leads)
+
+    bespoke_leads = [lead for lead in leads if is_high_value(lead, min_score, min_value)]
+    missing = sorted({segment_key(lead) for lead in leads if not is_high_value(lead, min_score, min_value)} - drafts.keys())
+
+    async def draft(key):
+        async with semaphore:
+            usage["llm_calls"] += 1
+            try:
+                subject, body = await generate_segment_draft(llm, key, business_context)
+                return key, {"subject": subject, "body": body}, None
+            except Exception as e:
+                return key, None, str(e)
+
+    results = await asyncio.gather(
+        bespoke_emails(bespoke_leads),
+        asyncio.gather(*(draft(key) for key in missing))
+    )
+    by_lead = {id(row[0]): row for row in results[0]}
+    errors = {}
+    for key, generated, error in results[1]:
+        if generated:
+            drafts[key] = generated
+        else:
+            errors[key] = error
+
+    rendered = []
+    for lead in leads:
+        if id(lead) in by_lead:
+            rendered.append(by_lead[id(lead)])
+            continue
+        key = segment_key(lead)
+        if key in drafts:
+            rendered.append((lead, *personalize_draft(lead, drafts[key]["subject"], drafts[key]["body"]), None))
+        else:
+            rendered.append((lead, None, None, f"Failed to generate segment draft: {errors.get(key)}"))
+    return rendered
@@ -0,0 +1,536 @@
+"""
+Background Campaign Runner for AI Marketing Agent.
+Runs email campaigns outside the HTTP request, with progress persisted so a
+client disconnect or a worker restart never loses track of who was emailed.
+
+- `campaigns`: one document per campaign (parameters, status, counters,
+  checkpoint time and the lease of the worker running it)
+- `campaign_leads`: one document per targeted lead, snapshotted when the
+  campaign is created, with its state:
+  pending -> sending -> sent / failed / skipped
+
+Leads are processed in snapshot order, CAMPAIGN_BATCH_SIZE at a time. A
+batch is claimed (pending -> sending), rendered, delivered concurrently
+(app/email_delivery.py) and then checkpointed: lead states, email history
+and campaign counters are written before the next batch is claimed.
+
+Only the worker holding a campaign's lease runs it; the lease is renewed
+while it works. When a worker dies its lease expires and any live worker
+resumes the campaign (on startup and every CAMPAIGN_RESUME_INTERVAL_SECONDS),
+putting the interrupted batch's "sending" leads back to pending, so at most
+that one batch can be sent twice.
+
+Delivery is paced (app/send_pacing.py). When the daily send limit is
+reached, the unsent leads go back to pending and the campaign is parked
+until the budget resets (`deferred_until`), when the resume check picks it
+up again.
+"""
+
+import asyncio
+import os
+import socket
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+
+from app.database import get_database, get_leads_for_email_campaign
+from app.campaign_content import render_template_email, generate_ai_emails
+from app.email_delivery import deliver_emails
+from app.history_writer import get_history_writer
+
+
+CAMPAIGNS_COLLECTION = "campaigns"
+CAMPAIGN_LEADS_COLLECTION = "campaign_leads"
+
+CAMPAIGN_BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH_SIZE") or "100")
+CAMPAIGN_LEASE_SECONDS = int(os.getenv("CAMPAIGN_LEASE_SECONDS") or "120")
+CAMPAIGN_RESUME_INTERVAL_SECONDS = int(os.getenv("CAMPAIGN_RESUME_INTERVAL_SECONDS") or "60")
+CAMPAIGN_AI_CONCURRENCY = int(os.getenv("CAMPAIGN_AI_CONCURRENCY") or "4")
+CAMPAIGN_SHUTDOWN_GRACE_SECONDS = float(os.getenv("CAMPAIGN_SHUTDOWN_GRACE_SECONDS") or "20")
+
+CAMPAIGN_KINDS = ["template", "ai"]
+LEAD_STATES = ["pending", "sending", "sent", "failed", "skipped"]
+
+# Identifies this process as a lease owner
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_tasks: Dict[str, asyncio.Task] = {}
+_resume_task: Optional[asyncio.Task] = None
+_stopping = False
+# Set on shutdown: deliveries in progress return unstarted emails as deferred
+_stop_delivery = asyncio.Event()
+
+
+async def ensure_campaign_indexes(db) -> None:
+    """Create the indexes batch claiming and resume scans rely on."""
+    await db[CAMPAIGN_LEADS_COLLECTION].create_index([("campaign_id", 1), ("state", 1), ("position", 1)])
+    await db[CAMPAIGN_LEADS_COLLECTION].create_index("claim")
+    await db[CAMPAIGNS_COLLECTION].create_index([("status", 1), ("lease_expires_at", 1)])
+    await db[CAMPAIGNS_COLLECTION].create_index([("created_at", -1)])
+
+
+def _format_campaign(doc: Dict[str, Any]) -> Dict[str, Any]:
+    doc["id"] = str(doc.pop("_id"))
+    for field, value in list(doc.items()):
+        if isinstance(value, datetime):
+            doc[field] = value.isoformat()
+    counts = doc.get("counts") or {}
+    processed = doc.get("total", 0) - counts.get("pending", 0)
+    doc["progress"] = round(100 * processed / doc["total"], 1) if doc.get("total") else 100.0
+    return doc
+
+
+# ============================================
+# Creating & Controlling Campaigns
+# ============================================
+
+async def create_campaign(kind: str, params: Dict[str, Any], query: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Snapshot the eligible leads (optionally within a segment filter) and
+    start the campaign in the background.
+
+    Args:
+        kind: "template" (subject_template/body_template) or "ai" (business_context)
+        params: Campaign parameters, including max_emails
+        query: Lead filter from app/segments.py
+
+    Raises ValueError for invalid parameters.
+    """
+    if kind not in CAMPAIGN_KINDS:
+        raise ValueError(f"Invalid campaign kind '{kind}'. Use: {', '.join(CAMPAIGN_KINDS)}")
+    if kind == "template":
+        try:
+            render_template_email({}, params["subject_template"], params["body_template"])
+        except (KeyError, IndexError, ValueError) as e:
+            raise ValueError(f"Invalid template placeholder: {e}")
+
+    db = get_database()
+    now = datetime.utcnow()
+    campaign_id = ObjectId()
+    leads = (await get_leads_for_email_campaign(query))[:params["max_emails"]]
+
+    # Leads first: a crash here leaves only orphaned lead rows, never a campaign without its leads
+    entries = [
+        {
+            "_id": f"{campaign_id}:{lead['id']}",
+            "campaign_id": campaign_id,
+            "position": position,
+            "lead_id": lead["id"],
+            "email": lead.get("email"),
+            "name": lead.get("name", "Valued Customer"),
+            "company": lead.get("company", ""),
+            "score": lead.get("score", 50),
+            "priority": lead.get("priority", "medium"),
+            "value": lead.get("value", 0),
+            "industry": lead.get("industry"),
+            "state": "pending",
+            "attempts": 0,
+        }
+        for position, lead in enumerate(leads)
+    ]
+    for start in range(0, len(entries), 1000):
+        await db[CAMPAIGN_LEADS_COLLECTION].insert_many(entries[start:start + 1000], ordered=False)
+
+    campaign = {
+        "_id": campaign_id,
+        "kind": kind,
+        "params": params,
+        "status": "running" if entries else "completed",
+        "total": len(entries),
+        "counts": {"pending": len(entries), "sent": 0, "failed": 0, "skipped": 0},
+        "batches": 0,
+        "requeued": 0,
+        "created_at": now,
+        "updated_at": now,
+        "completed_at": None if entries else now,
+        "last_checkpoint_at": None,
+        "lease_owner": None,
+        "lease_expires_at": None,
+        "deferred_until": None,
+        "error": None,
+    }
+    await db[CAMPAIGNS_COLLECTION].insert_one(campaign)
+    print(f"[Campaigns] Created {kind} campaign {campaign_id} for {len(entries)} leads")
+
+    if entries:
+        start_campaign(str(campaign_id))
+    return _format_campaign(campaign)
+
+
+def start_campaign(campaign_id: str) -> bool:
+    """Run a campaign in this process unless it is already running here."""
+    for finished in [key for key, task in _tasks.items() if task.done()]:
+        del _tasks[finished]
+    task = _tasks.get(campaign_id)
+    if _stopping or (task is not None and not task.done()):
+        return False
+    _tasks[campaign_id] = asyncio.create_task(_run_campaign(ObjectId(campaign_id)))
+    return True
+
+
+async def set_campaign_status(campaign_id: str, status: str) -> Optional[Dict[str, Any]]:
+    """
+    Pause, cancel or resume a campaign.
+
+    Pausing and cancelling take effect at the next checkpoint. Paused and
+    failed campaigns can be resumed; cancelled and completed ones cannot.
+    """
+    allowed_from = {
+        "paused": ["running"],
+        "cancelled": ["running", "paused", "failed"],
+        "running": ["paused", "failed"],
+    }[status]
+    doc = await get_database()[CAMPAIGNS_COLLECTION].find_one_and_update(
+        {"_id": ObjectId(campaign_id), "status": {"$in": allowed_from}},
+        {"$set": {"status": status, "updated_at": datetime.utcnow(), "error": None}},
+        return_document=ReturnDocument.AFTER
+    )
+    if doc and status == "running":
+        start_campaign(campaign_id)
+    return _format_campaign(doc) if doc else None
+
+
+async def get_campaign(campaign_id: str) -> Optional[Dict[str, Any]]:
+    doc = await get_database()[CAMPAIGNS_COLLECTION].find_one({"_id": ObjectId(campaign_id)})
+    return _format_campaign(doc) if doc else None
+
+
+async def list_campaigns(limit: int = 20, status: Optional[str] = None) -> List[Dict[str, Any]]:
+    query = {"status": status} if status else {}
+    cursor = get_database()[CAMPAIGNS_COLLECTION].find(query, {"params.body_template": 0}).sort("created_at", -1).limit(limit)
+    return [_format_campaign(doc) async for doc in cursor]
+
+
+async def get_campaign_leads(
+    campaign_id: str,
+    state: Optional[str] = None,
+    limit: int = 100,
+    skip: int = 0
+) -> List[Dict[str, Any]]:
+    """Per-lead state of a campaign, in send order."""
+    query: Dict[str, Any] = {"campaign_id": ObjectId(campaign_id)}
+    if state:
+        query["state"] = state
+    cursor = get_database()[CAMPAIGN_LEADS_COLLECTION].find(query, {"campaign_id": 0, "claim": 0}) \
+        .sort("position", 1).skip(skip).limit(limit)
+
+    results = []
+    async for doc in cursor:
+        del doc["_id"]
+        for field in ("claimed_at", "updated_at"):
+            if isinstance(doc.get(field), datetime):
+                doc[field] = doc[field].isoformat()
+        results.append(doc)
+    return results
+
+
+# ============================================
+# Running
+# ============================================
+
+def _not_deferred(now: datetime) -> Dict[str, Any]:
+    return {"$or": [{"deferred_until": None}, {"deferred_until": {"$lte": now}}]}
+
+
+async def _acquire_lease(db, campaign_id: ObjectId) -> Optional[Dict[str, Any]]:
+    now = datetime.utcnow()
+    return await db[CAMPAIGNS_COLLECTION].find_one_and_update(
+        {
+            "_id": campaign_id,
+            "status": "running",
+            "$and": [
+                {"$or": [
+                    {"lease_owner": None},
+                    {"lease_owner": WORKER_ID},
+                    {"lease_expires_at": {"$lt": now}},
+                ]},
+                _not_deferred(now),
+            ],
+        },
+        {"$set": {"lease_owner": WORKER_ID, "lease_expires_at": now + timedelta(seconds=CAMPAIGN_LEASE_SECONDS)}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _renew_lease_periodically(db, campaign_id: ObjectId) -> None:
+    while True:
+        await asyncio.sleep(CAMPAIGN_LEASE_SECONDS / 3)
+        try:
+            await db[CAMPAIGNS_COLLECTION].update_one(
+                {"_id": campaign_id, "lease_owner": WORKER_ID},
+                {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=CAMPAIGN_LEASE_SECONDS)}}
+            )
+        except Exception as e:
+            print(f"[Campaigns] Lease renewal failed for {campaign_id}: {e}")
+
+
+async def _run_campaign(campaign_id: ObjectId) -> None:
+    db = get_database()
+    campaign = await _acquire_lease(db, campaign_id)
+    if not campaign:
+        return  # Not running, or another worker holds the lease
+
+    heartbeat = asyncio.create_task(_renew_lease_periodically(db, campaign_id))
+    try:
+        # Leads claimed by a batch that never checkpointed go back to pending
+        requeued = await db[CAMPAIGN_LEADS_COLLECTION].update_many(
+            {"campaign_id": campaign_id, "state": "sending"},
+            {"$set": {"state": "pending"}, "$unset": {"claim": ""}}
+        )
+        if requeued.modified_count:
+            await db[CAMPAIGNS_COLLECTION].update_one({"_id": campaign_id}, {"$inc": {"requeued": requeued.modified_count}})
+            print(f"[Campaigns] Resuming {campaign_id}: {requeued.modified_count} interrupted sends requeued")
+
+        llm = None
+        if campaign["kind"] == "ai":
+            from app.config import get_llm
+            llm = get_llm()
+
+        while not _stopping:
+            batch = await _claim_batch(db, campaign_id)
+            if not batch:
+                await db[CAMPAIGNS_COLLECTION].update_one(
+                    {"_id": campaign_id, "status": "running", "lease_owner": WORKER_ID},
+                    {"$set": {"status": "completed", "completed_at": datetime.utcnow(), "updated_at": datetime.utcnow()}}
+                )
+                print(f"[Campaigns] Campaign {campaign_id} completed")
+                break
+            if not await _process_batch(db, campaign, batch, llm):
+                break  # Paused, cancelled, deferred or lease lost
+
+    except Exception as e:
+        print(f"[Campaigns] Campaign {campaign_id} failed: {e}")
+        await db[CAMPAIGNS_COLLECTION].update_one(
+            {"_id": campaign_id, "lease_owner": WORKER_ID},
+            {"$set": {"status": "failed", "error": str(e), "updated_at": datetime.utcnow()}}
+        )
+    finally:
+        heartbeat.cancel()
+        await db[CAMPAIGNS_COLLECTION].update_one(
+            {"_id": campaign_id, "lease_owner": WORKER_ID},
+            {"$set": {"lease_owner": None, "lease_expires_at": None}}
+        )
+
+
+async def _claim_batch(db, campaign_id: ObjectId) -> List[Dict[str, Any]]:
+    """Move the next batch of pending leads to "sending" and return them."""
+    candidates = await db[CAMPAIGN_LEADS_COLLECTION].find(
+        {"campaign_id": campaign_id, "state": "pending"}, {"_id": 1}
+    ).sort("position", 1).limit(CAMPAIGN_BATCH_SIZE).to_list(CAMPAIGN_BATCH_SIZE)
+    if not candidates:
+        return []
+
+    # A claim token makes sure we only send what this call actually claimed
+    claim = ObjectId()
+    await db[CAMPAIGN_LEADS_COLLECTION].update_many(
+        {"_id": {"$in": [c["_id"] for c in candidates]}, "state": "pending"},
+        {"$set": {"state": "sending", "claim": claim, "claimed_at": datetime.utcnow()}, "$inc": {"attempts": 1}}
+    )
+    return await db[CAMPAIGN_LEADS_COLLECTION].find({"claim": claim}).sort("position", 1).to_list(None)
+
+
+async def _render(campaign: Dict[str, Any], entries: List[Dict[str, Any]], llm) -> List[Tuple[Dict[str, Any], Optional[str], Optional[str], Optional[str]]]:
+    """(entry, subject, body, error) for each lead."""
+    params = campaign["params"]
+    if campaign["kind"] == "template":
+        rendered = []
+        for entry in entries:
+            try:
+                subject, body = render_template_email(entry, params["subject_template"], params["body_template"])
+                rendered.append((entry, subject, body, None))
+            except (KeyError, IndexError, ValueError) as e:
+                rendered.append((entry, None, None, f"Failed to render email: {e}"))
+        return rendered
+
+    # Segment drafts live on the campaign, so later batches and resumes reuse them
+    drafts = campaign.setdefault("drafts", {})
+    known = set(drafts)
+    rendered = await generate_ai_emails(
+        llm, entries, params["business_context"],
+        segment_drafts=params.get("segment_drafts", False),
+        drafts=drafts,
+        concurrency=CAMPAIGN_AI_CONCURRENCY,
+        leads_per_prompt=params.get("leads_per_prompt", 1)
+    )
+    new_drafts = {f"drafts.{key}": draft for key, draft in drafts.items() if key not in known}
+    if new_drafts:
+        await get_database()[CAMPAIGNS_COLLECTION].update_one({"_id": campaign["_id"]}, {"$set": new_drafts})
+    return rendered
+
+
+async def _process_batch(db, campaign: Dict[str, Any], batch: List[Dict[str, Any]], llm) -> bool:
+    """
+    Render, deliver and checkpoint one claimed batch.
+
+    Returns whether the campaign should continue (still running, leased
+    by this worker and not deferred by the daily send limit).
+    """
+    campaign_id = campaign["_id"]
+    by_id = {entry["_id"]: entry for entry in batch}
+    outcomes: Dict[str, Dict[str, Any]] = {}
+
+    # Leads emailed by anything else since the campaign started are skipped
+    lead_ids = [ObjectId(e["lead_id"]) for e in batch if ObjectId.is_valid(e["lead_id"])]
+    emailed_since = {
+        str(doc["_id"])
+        async for doc in db.leads.find(
+            {"_id": {"$in": lead_ids}, "last_emailed_at": {"$gt": campaign["created_at"]}}, {"_id": 1}
+        )
+    }
+    to_render = []
+    for entry in batch:
+        if entry["lead_id"] in emailed_since:
+            outcomes[entry["_id"]] = {"state": "skipped", "message": "Emailed since the campaign started"}
+        else:
+            to_render.append(entry)
+
+    outgoing = []
+    for entry, subject, body, error in await _render(campaign, to_render, llm):
+        if error:
+            outcomes[entry["_id"]] = {"state": "failed", "message": error}
+        else:
+            outgoing.append({
+                "key": entry["_id"], "to": entry["email"], "subject": subject, "body": body,
+                "score": entry.get("score", 50), "lead_id": entry["lead_id"], "campaign": str(campaign_id)
+            })
+
+    history_writer = get_history_writer()
+    deferred_until = None
+    deferred_reason = None
+    async for result in deliver_emails(outgoing, stop=_stop_delivery):
+        entry = by_id[result["key"]]
+        if result["deferred"]:
+            # Not attempted: back to pending for when the daily budget resets
+            # (or, when stopped for shutdown, for whichever worker resumes)
+            outcomes[entry["_id"]] = {"state": "pending", "message": result["message"]}
+            if result["retry_at"]:
+                deferred_until = result["retry_at"]
+                deferred_reason = result["message"]
+            continue
+        if result.get("suppressed"):
+            outcomes[entry["_id"]] = {"state": "skipped", "message": result["message"]}
+            continue
+        outcomes[entry["_id"]] = {
+            "state": "sent" if result["success"] else "failed",
+            "subject": result["subject"],
+            "message": result["message"],
+        }
+        await history_writer.add(
+            lead_id=entry["lead_id"],
+            lead_email=result["to"],
+            subject=result["subject"],
+            success=result["success"],
+            message=result["message"]
+        )
+
+    # Checkpoint: lead states, then history, then counters
+    now = datetime.utcnow()
+    await db[CAMPAIGN_LEADS_COLLECTION].bulk_write(
+        [
+            UpdateOne({"_id": entry_id}, {"$set": {**outcome, "updated_at": now}, "$unset": {"claim": ""}})
+            for entry_id, outcome in outcomes.items()
+        ],
+        ordered=False
+    )
+    await history_writer.flush()
+
+    states = Counter(outcome["state"] for outcome in outcomes.values())
+    updated = await db[CAMPAIGNS_COLLECTION].find_one_and_update(
+        {"_id": campaign_id},
+        {
+            "$inc": {
+                "counts.pending": states["pending"] - len(outcomes),
+                "counts.sent": states["sent"],
+                "counts.failed": states["failed"],
+                "counts.skipped": states["skipped"],
+                "batches": 1,
+            },
+            "$set": {"updated_at": now, "last_checkpoint_at": now, "deferred_until": deferred_until},
+        },
+        projection={"status": 1, "lease_owner": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if deferred_until:
+        print(f"[Campaigns] Campaign {campaign_id} deferred until {deferred_until.isoformat()}: {deferred_reason}")
+        return False
+    return bool(updated) and updated["status"] == "running" and updated["lease_owner"] == WORKER_ID
+
+
+# ============================================
+# Resuming
+# ============================================
+
+async def resume_campaigns() -> int:
+    """
+    Start every running campaign whose lease is free or expired and whose
+    send deferral (if any) is over. Returns how many were started.
+    """
+    now = datetime.utcnow()
+    cursor = get_database()[CAMPAIGNS_COLLECTION].find(
+        {
+            "status": "running",
+            "$and": [
+                {"$or": [{"lease_owner": None}, {"lease_expires_at": {"$lt": now}}]},
+                _not_deferred(now),
+            ],
+        },
+        {"_id": 1}
+    )
+    started = 0
+    async for doc in cursor:
+        started += start_campaign(str(doc["_id"]))
+    if started:
+        print(f"[Campaigns] Resumed {started} campaigns")
+    return started
+
+
+async def _resume_periodically(interval_seconds: int) -> None:
+    while True:
+        try:
+            await resume_campaigns()
+        except Exception as e:
+            print(f"[Campaigns] Resume check failed: {e}")
+        await asyncio.sleep(interval_seconds)
+
+
+def start_campaign_runner() -> None:
+    """
+    Resume interrupted campaigns now and every CAMPAIGN_RESUME_INTERVAL_SECONDS
+    (0 disables the periodic check).
+    """
+    global _resume_task, _stopping
+    _stopping = False
+    _stop_delivery.clear()
+    if _resume_task is None or _resume_task.done():
+        if CAMPAIGN_RESUME_INTERVAL_SECONDS > 0:
+            _resume_task = asyncio.create_task(_resume_periodically(CAMPAIGN_RESUME_INTERVAL_SECONDS))
+        else:
+            _resume_task = asyncio.create_task(resume_campaigns())
+
+
+async def stop_campaign_runner() -> None:
+    """
+    Stop after the current batches checkpoint (up to
+    CAMPAIGN_SHUTDOWN_GRACE_SECONDS), then release the leases so another
+    worker can resume right away.
+
+    Deliveries in progress finish the emails already being sent and return
+    the rest as deferred, so a long paced batch still checkpoints within
+    the grace period instead of being cancelled mid-send.
+    """
+    global _stopping
+    _stopping = True
+    _stop_delivery.set()
+    if _resume_task is not None:
+        _resume_task.cancel()
+
+    running = [task for task in _tasks.values() if not task.done()]
+    if running:
+        _, pending = await asyncio.wait(running, timeout=CAMPAIGN_SHUTDOWN_GRACE_SECONDS)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,406 @@
+"""
+Compressed, Deduplicated Content Storage for AI Marketing Agent.
+Transparently compresses generated text fields on write and decompresses
+them only when a document is read back.
+
+- Codec: zstd with a dictionary trained on our own generations (falls
+  back to zlib when the `zstandard` package is not installed)
+- Small values (< CONTENT_COMPRESS_MIN_BYTES) stay as plain strings
+- Medium values are compressed inline
+- Large values (>= CONTENT_DEDUPE_MIN_BYTES) go to the content-addressed
+  `content_blobs` collection, keyed by SHA-256 with a reference count, so
+  byte-identical generations (common with caching) are stored once
+
+A packed value looks like:
+    {"_packed": 1, "codec": "zstd", "dict": <dict id or None>, "data": Binary(...)}
+or, as a blob reference:
+    {"_packed": 1, "blob": "<sha256 hex>"}
+"""
+
+import hashlib
+import os
+import zlib
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any
+
+from bson import Binary, ObjectId
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency
+    zstandard = None
+
+
+CONTENT_COMPRESS_MIN_BYTES = int(os.getenv("CONTENT_COMPRESS_MIN_BYTES", "256"))
+CONTENT_DEDUPE_MIN_BYTES = int(os.getenv("CONTENT_DEDUPE_MIN_BYTES", "1024"))
+ZSTD_LEVEL = int(os.getenv("CONTENT_ZSTD_LEVEL", "9"))
+# Unreferenced blobs are kept this long before garbage collection, so a
+# concurrent write that is re-referencing one never loses it
+CONTENT_BLOB_GC_GRACE_SECONDS = int(os.getenv("CONTENT_BLOB_GC_GRACE_SECONDS", "3600"))
+
+BLOBS_COLLECTION = "content_blobs"
+DICTS_COLLECTION = "compression_dicts"
+
+# Which fields hold generated text, per collection
+PACKED_FIELDS = {
+    "generations": "content",   # dict of {content type: text}
+    "social_posts": "content",  # text
+}
+
+# In-memory dictionary cache: dict id -> zstandard.ZstdCompressionDict
+_dicts: Dict[str, Any] = {}
+_active_dict_id: Optional[str] = None
+_dicts_loaded = False
+
+# Process-local dedupe counters, exposed via get_store_stats()
+_stats = {"blob_refs_added": 0, "blobs_created": 0, "bytes_deduplicated": 0}
+
+
+def is_packed(value: Any) -> bool:
+    return isinstance(value, dict) and value.get("_packed") == 1
+
+
+# ============================================
+# Codecs
+# ============================================
+
+def _compress(raw: bytes) -> Dict[str, Any]:
+    if zstandard is None:
+        return {"codec": "zlib", "dict": None, "data": Binary(zlib.compress(raw, 6))}
+
+    dict_data = _dicts.get(_active_dict_id) if _active_dict_id else None
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dict_data)
+    return {
+        "codec": "zstd",
+        "dict": _active_dict_id if dict_data else None,
+        "data": Binary(compressor.compress(raw))
+    }
+
+
+def _decompress(codec: str, data: bytes, dict_id: Optional[str]) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard package is required to read zstd-compressed content")
+        dict_data = _dicts.get(dict_id) if dict_id else None
+        if dict_id and dict_data is None:
+            raise RuntimeError(f"Compression dictionary {dict_id} is not loaded")
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(data)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+# ============================================
+# Pack / Unpack
+# ============================================
+
+def _pack_value(text: Any, blobs: Dict[str, Dict[str, Any]]) -> Any:
+    """
+    Pack one value. Large values become blob references; their bytes and
+    reference counts are collected in `blobs` and stored by `_store_blobs`.
+    """
+    if not isinstance(text, str):
+        return text
+
+    raw = text.encode("utf-8")
+    if len(raw) < CONTENT_COMPRESS_MIN_BYTES:
+        return text
+
+    if len(raw) < CONTENT_DEDUPE_MIN_BYTES:
+        return {"_packed": 1, **_compress(raw)}
+
+    sha = hashlib.sha256(raw).hexdigest()
+    entry = blobs.setdefault(sha, {"raw": raw, "refs": 0})
+    entry["refs"] += 1
+    return {"_packed": 1, "blob": sha}
+
+
+async def _store_blobs(db, blobs: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Add references for a batch of blobs in one bulk_write.
+
+    Blobs that already exist only get `$inc refs`, so repeated content is
+    neither recompressed nor rewritten. Unreferenced blobs (awaiting garbage
+    collection) are upserted like new ones. Reference counts can overshoot
+    after a failed document write (which only delays garbage collection)
+    but never undershoot.
+    """
+    from pymongo import UpdateOne
+
+    if not blobs:
+        return
+
+    existing = set()
+    async for doc in db[BLOBS_COLLECTION].find({"_id": {"$in": list(blobs)}, "refs": {"$gt": 0}}, {"_id": 1}):
+        existing.add(doc["_id"])
+
+    now = datetime.utcnow()
+    operations = []
+    for sha, entry in blobs.items():
+        if sha in existing:
+            operations.append(UpdateOne({"_id": sha}, {"$inc": {"refs": entry["refs"]}}))
+            _stats["bytes_deduplicated"] += len(entry["raw"]) * entry["refs"]
+        else:
+            operations.append(UpdateOne(
+                {"_id": sha},
+                {
+                    "$inc": {"refs": entry["refs"]},
+                    "$setOnInsert": {**_compress(entry["raw"]), "size": len(entry["raw"]), "created_at": now}
+                },
+                upsert=True
+            ))
+            _stats["blobs_created"] += 1
+            _stats["bytes_deduplicated"] += len(entry["raw"]) * (entry["refs"] - 1)
+        _stats["blob_refs_added"] += entry["refs"]
+
+    await db[BLOBS_COLLECTION].bulk_write(operations, ordered=False)
+
+
+def _dict_refs(value: Any, blobs: Dict[Any, Dict[str, Any]]) -> List[str]:
+    """Compression dictionaries needed to unpack a value."""
+    if is_packed(value):
+        if "blob" in value:
+            value = blobs.get(value["blob"]) or {}
+        return [value["dict"]] if value.get("dict") else []
+    if isinstance(value, dict):
+        return [dict_id for v in value.values() for dict_id in _dict_refs(v, blobs)]
+    return []
+
+
+def _unpack_value(value: Any, blobs: Dict[Any, Dict[str, Any]]) -> Any:
+    """Restore a packed value to text using pre-fetched blobs. Plain values are returned unchanged."""
+    if not is_packed(value):
+        return value
+
+    if "blob" in value:
+        blob = blobs.get(value["blob"])
+        if blob is None:
+            raise RuntimeError(f"Content blob {value['blob']} is missing")
+        value = blob
+
+    return _decompress(value["codec"], bytes(value["data"]), value.get("dict")).decode("utf-8")
+
+
+async def pack_documents(db, collection_name: str, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Pack the generated-content field of a batch of documents in place before
+    they are stored. Already-packed values are left alone.
+    """
+    field = PACKED_FIELDS.get(collection_name)
+    if not field:
+        return documents
+
+    await load_dictionaries(db)
+
+    blobs: Dict[str, Dict[str, Any]] = {}
+    for document in documents:
+        value = document.get(field)
+        if value is None or is_packed(value):
+            continue
+        if isinstance(value, dict):
+            document[field] = {key: _pack_value(text, blobs) for key, text in value.items()}
+        else:
+            document[field] = _pack_value(value, blobs)
+
+    await _store_blobs(db, blobs)
+    return documents
+
+
+async def unpack_documents(db, collection_name: str, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Decompress the generated-content field of a batch of documents in place.
+    All referenced blobs are fetched with a single query.
+    """
+    field = PACKED_FIELDS.get(collection_name)
+    if not field:
+        return documents
+
+    refs = {ref for document in documents for ref in _blob_refs(document.get(field))}
+    blobs = {}
+    if refs:
+        async for blob in db[BLOBS_COLLECTION].find({"_id": {"$in": list(refs)}}):
+            blobs[blob["_id"]] = blob
+
+    # A dictionary trained by another worker is loaded on first sight
+    dict_ids = {dict_id for document in documents for dict_id in _dict_refs(document.get(field), blobs)}
+    await load_dictionaries(db, force=bool(dict_ids - set(_dicts)))
+
+    for document in documents:
+        value = document.get(field)
+        if isinstance(value, dict) and not is_packed(value):
+            document[field] = {key: _unpack_value(text, blobs) for key, text in value.items()}
+        elif value is not None:
+            document[field] = _unpack_value(value, blobs)
+    return documents
+
+
+async def unpack_document(db, collection_name: str, document: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Decompress a single document's generated-content field in place (no-op for plain documents)."""
+    if document:
+        await unpack_documents(db, collection_name, [document])
+    return document
+
+
+# ============================================
+# Dictionary Training
+# ============================================
+
+async def load_dictionaries(db, force: bool = False) -> None:
+    """
+    Load compression dictionaries from Mongo into memory (once per process,
+    or again with force, e.g. when another worker trained a new one).
+    """
+    global _dicts_loaded, _active_dict_id
+
+    if (_dicts_loaded and not force) or zstandard is None:
+        return
+
+    async for doc in db[DICTS_COLLECTION].find().sort("created_at", 1):
+        _dicts[str(doc["_id"])] = zstandard.ZstdCompressionDict(bytes(doc["data"]))
+        if doc.get("active"):
+            _active_dict_id = str(doc["_id"])
+    _dicts_loaded = True
+
+
+async def train_dictionary(db, sample_limit: int = 5000, dict_size: int = 112640) -> Dict[str, Any]:
+    """
+    Train a zstd dictionary on recent generated content and make it active.
+
+    Generated marketing copy shares a lot of structure (headings, CTAs,
+    hashtags, emoji), so a trained dictionary compresses short values far
+    better than plain zstd. Old dictionaries are kept so existing documents
+    remain readable.
+    """
+    global _active_dict_id
+
+    if zstandard is None:
+        raise RuntimeError("Install the zstandard package to train compression dictionaries")
+
+    await load_dictionaries(db)
+
+    samples: List[bytes] = []
+    for collection_name in PACKED_FIELDS:
+        cursor = db[collection_name].find({}, {"content": 1}).sort("created_at", -1).limit(sample_limit)
+        async for doc in cursor:
+            await unpack_document(db, collection_name, doc)
+            content = doc.get("content")
+            texts = content.values() if isinstance(content, dict) else [content]
+            samples.extend(t.encode("utf-8") for t in texts if isinstance(t, str) and t)
+
+    if len(samples) < 100:
+        raise ValueError(f"Need at least 100 content samples to train a dictionary, found {len(samples)}")
+
+    trained = zstandard.train_dictionary(dict_size, samples)
+    dict_id = ObjectId()
+    await db[DICTS_COLLECTION].update_many({"active": True}, {"$set": {"active": False}})
+    await db[DICTS_COLLECTION].insert_one({
+        "_id": dict_id,
+        "data": Binary(trained.as_bytes()),
+        "samples": len(samples),
+        "active": True,
+        "created_at": datetime.utcnow()
+    })
+
+    _dicts[str(dict_id)] = trained
+    _active_dict_id = str(dict_id)
+
+    print(f"[ContentStore] Trained dictionary {dict_id} on {len(samples)} samples")
+    return {"dict_id": str(dict_id), "samples": len(samples), "size": len(trained.as_bytes())}
+
+
+async def compress_existing(db, collection_name: str, batch_size: int = 500) -> int:
+    """
+    Compress and deduplicate content of documents written before
+    compression was enabled.
+
+    Returns the number of documents rewritten.
+    """
+    from pymongo import UpdateOne
+
+    field = PACKED_FIELDS[collection_name]
+    rewritten = 0
+    last_id = None
+
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id else {}
+        batch = await db[collection_name].find(query, {field: 1}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+
+        originals = [doc.get(field) for doc in batch]
+        await pack_documents(db, collection_name, batch)
+
+        operations = [
+            UpdateOne({"_id": doc["_id"]}, {"$set": {field: doc[field]}})
+            for doc, original in zip(batch, originals)
+            if doc.get(field) != original
+        ]
+
+        if operations:
+            await db[collection_name].bulk_write(operations, ordered=False)
+            rewritten += len(operations)
+
+    return rewritten
+
+
+# ============================================
+# Reference Counting
+# ============================================
+
+def _blob_refs(value: Any) -> List[Any]:
+    if is_packed(value):
+        return [value["blob"]] if "blob" in value else []
+    if isinstance(value, dict):
+        return [ref for v in value.values() for ref in _blob_refs(v)]
+    return []
+
+
+async def release_documents(db, collection_name: str, documents: List[Dict[str, Any]]) -> int:
+    """
+    Drop the blob references held by documents that were deleted (call it
+    after the delete). Returns the number of references released.
+    """
+    from pymongo import UpdateOne
+
+    field = PACKED_FIELDS.get(collection_name)
+    counts: Dict[Any, int] = {}
+    for document in documents:
+        for ref in _blob_refs(document.get(field) if field else None):
+            counts[ref] = counts.get(ref, 0) + 1
+
+    if counts:
+        now = datetime.utcnow()
+        await db[BLOBS_COLLECTION].bulk_write(
+            [
+                UpdateOne({"_id": ref}, {"$inc": {"refs": -n}, "$set": {"released_at": now}})
+                for ref, n in counts.items()
+            ],
+            ordered=False
+        )
+    return sum(counts.values())
+
+
+async def collect_garbage(db, grace_seconds: int = CONTENT_BLOB_GC_GRACE_SECONDS) -> int:
+    """
+    Delete blobs that have been unreferenced for at least `grace_seconds`.
+    Returns the number deleted.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    result = await db[BLOBS_COLLECTION].delete_many({"refs": {"$lte": 0}, "released_at": {"$lt": cutoff}})
+    return result.deleted_count
+
+
+async def get_store_stats(db) -> Dict[str, Any]:
+    """Blob store size: distinct blobs, references, stored vs logical bytes."""
+    pipeline = [{"$group": {
+        "_id": None,
+        "blobs": {"$sum": 1},
+        "references": {"$sum": "$refs"},
+        "unique_bytes": {"$sum": "$size"},
+        "logical_bytes": {"$sum": {"$multiply": ["$size", "$refs"]}},
+    }}]
+    totals = await db[BLOBS_COLLECTION].aggregate(pipeline).to_list(1)
+    summary = totals[0] if totals else {"blobs": 0, "references": 0, "unique_bytes": 0, "logical_bytes": 0}
+    summary.pop("_id", None)
+    return {**summary, "process": dict(_stats)}
@@ -8,36 +8,196 @@ import os
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
 from bson import ObjectId
-# from dotenv import load_dotenv
+from dotenv import load_dotenv
+from app import rollups, content_store, search, query_profiler, lead_dedupe
+from app.schemas import LeadCreate
 
-# # Load environment variables from .env file
-# load_dotenv()
+# Load environment variables from .env file
+load_dotenv()
 
 
 # MongoDB Client (initialized on first use)
 _client: Optional[AsyncIOMotorClient] = None
 _db = None
+_analytics_db = None
+
+_READ_PREFERENCES = {
+    "primary": Primary,
+    "primarypreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondarypreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def _read_preference(mode: str, max_staleness: Optional[int] = None):
+    """Build a pymongo read preference from a mode name like "secondaryPreferred"."""
+    mode_class = _READ_PREFERENCES.get(mode.replace("_", "").lower())
+    if mode_class is None:
+        raise ValueError(f"Unknown read preference: {mode}")
+    if mode_class is Primary:
+        return Primary()
+    return mode_class(max_staleness=max_staleness or -1)
+
+
+def get_client_options() -> Dict[str, Any]:
+    """
+    Build Motor client options from environment variables.
+    
+    Pool:         MONGODB_MAX_POOL_SIZE (100), MONGODB_MIN_POOL_SIZE (0),
+                  MONGODB_MAX_IDLE_TIME_MS, MONGODB_WAIT_QUEUE_TIMEOUT_MS
+    Timeouts:     MONGODB_CONNECT_TIMEOUT_MS (10000),
+                  MONGODB_SERVER_SELECTION_TIMEOUT_MS (10000), MONGODB_SOCKET_TIMEOUT_MS
+    Compression:  MONGODB_COMPRESSORS (e.g. "zstd,snappy,zlib"; zstd needs the
+                  `zstandard` package, snappy needs `python-snappy`)
+    Write:        MONGODB_WRITE_CONCERN ("majority" or a number), MONGODB_WRITE_JOURNAL
+    Read:         MONGODB_READ_PREFERENCE (primary)
+    """
+    options: Dict[str, Any] = {
+        "maxPoolSize": _env_int("MONGODB_MAX_POOL_SIZE") or 100,
+        "minPoolSize": _env_int("MONGODB_MIN_POOL_SIZE") or 0,
+        "connectTimeoutMS": _env_int("MONGODB_CONNECT_TIMEOUT_MS") or 10000,
+        "serverSelectionTimeoutMS": _env_int("MONGODB_SERVER_SELECTION_TIMEOUT_MS") or 10000,
+        "appname": os.getenv("MONGODB_APP_NAME") or "ai-marketing-agent",
+        "readPreference": os.getenv("MONGODB_READ_PREFERENCE") or "primary",
+    }
+    
+    for env_name, option in [
+        ("MONGODB_MAX_IDLE_TIME_MS", "maxIdleTimeMS"),
+        ("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "waitQueueTimeoutMS"),
+        ("MONGODB_SOCKET_TIMEOUT_MS", "socketTimeoutMS"),
+    ]:
+        value = _env_int(env_name)
+        if value is not None:
+            options[option] = value
+    
+    compressors = os.getenv("MONGODB_COMPRESSORS")
+    if compressors:
+        options["compressors"] = compressors
+    
+    write_concern = os.getenv("MONGODB_WRITE_CONCERN")
+    if write_concern:
+        options["w"] = int(write_concern) if write_concern.isdigit() else write_concern
+    journal = os.getenv("MONGODB_WRITE_JOURNAL")
+    if journal:
+        options["journal"] = journal.lower() in ("1", "true", "yes")
+    
+    return options
 
 
 def get_database():
-    """Get the MongoDB database instance."""
+    """
+    Get the MongoDB database instance (primary reads, used for all writes).
+    
+    Operations are timed by app/query_profiler.py unless QUERY_PROFILING=false.
+    """
     global _client, _db
     
     if _db is None:
-        mongodb_uri =  "mongodb://localhost:27017"
-        database_name = "marketing_agent"
-        # mongodb_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-        # database_name = os.getenv("MONGODB_DATABASE", "marketing_agent")
+        mongodb_uri = os.getenv("MONGODB_URI") or "mongodb://localhost:27017"
+        database_name = os.getenv("MONGODB_DATABASE") or "marketing_agent"
+        options = get_client_options()
         
         # Log which database we're connecting to (masked URI for security)
         uri_display = mongodb_uri[:30] + "..." if len(mongodb_uri) > 30 else mongodb_uri
         print(f"[MongoDB] Connecting to: {uri_display} / database: {database_name}")
+        print(f"[MongoDB] Pool: {options['minPoolSize']}-{options['maxPoolSize']}, "
+              f"compressors: {options.get('compressors', 'none')}, w: {options.get('w', 'default')}")
         
-        _client = AsyncIOMotorClient(mongodb_uri)
+        _client = AsyncIOMotorClient(mongodb_uri, **options)
         _db = _client[database_name]
         
-    return _db
+    return query_profiler.wrap(_db)
+
+
+def get_analytics_database():
+    """
+    Get a database handle for analytics and dashboard reads.
+    
+    Shares the connection pool with `get_database()` but uses
+    MONGODB_ANALYTICS_READ_PREFERENCE (default "secondaryPreferred"), so on a
+    replica set these reads go to secondaries while campaign writes and
+    reads that must see them stay on the primary. Optionally bounded by
+    MONGODB_ANALYTICS_MAX_STALENESS_SECONDS (minimum 90).
+    """
+    global _analytics_db
+    
+    if _analytics_db is None:
+        get_database()
+        read_preference = _read_preference(
+            os.getenv("MONGODB_ANALYTICS_READ_PREFERENCE") or "secondaryPreferred",
+            _env_int("MONGODB_ANALYTICS_MAX_STALENESS_SECONDS")
+        )
+        _analytics_db = _client.get_database(_db.name, read_preference=read_preference)
+    
+    return query_profiler.wrap(_analytics_db)
+
+
+async def insert_documents(
+    collection_name: str,
+    documents: List[Dict[str, Any]],
+    search_texts: Optional[List[str]] = None
+) -> List[str]:
+    """
+    Insert history documents in one unordered batch and update their rollups.
+    
+    Large generated-content fields are compressed and deduplicated in place
+    first (see app/content_store.py), after their text is extracted for the
+    search index (see app/search.py).
+    
+    IDs are assigned client-side, so re-inserting a batch after a partial
+    failure only collides with rows that already landed and is treated as
+    success. Callers that retry should extract `search_texts` once before
+    the first attempt, since a retried batch is already packed.
+    
+    Returns list of inserted document IDs.
+    """
+    db = get_database()
+    
+    if not documents:
+        return []
+    
+    for document in documents:
+        document.setdefault("_id", ObjectId())
+    if search_texts is None and collection_name in search.SEARCH_SOURCES:
+        search_texts = [search.extract_text(collection_name, document) for document in documents]
+    await content_store.pack_documents(db, collection_name, documents)
+    
+    try:
+        await db[collection_name].insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+    await rollups.record_inserts(db, collection_name, documents)
+    
+    if search_texts is not None:
+        try:
+            await search.index_documents(db, collection_name, documents, search_texts)
+        except Exception as e:
+            print(f"[Search] Failed to index {collection_name}: {e}")
+    
+    return [str(document["_id"]) for document in documents]
+
+
+async def _save_document(collection_name: str, document: Dict[str, Any], background: bool) -> str:
+    """Insert now, or hand off to the write-behind queue and return the pre-assigned ID."""
+    if background:
+        from app.write_behind import get_write_behind_queue
+        document["_id"] = ObjectId()
+        get_write_behind_queue().enqueue(collection_name, document)
+        return str(document["_id"])
+    
+    ids = await insert_documents(collection_name, [document])
+    return ids[0]
 
 
 async def save_generation(
@@ -47,15 +207,17 @@ async def save_generation(
     target_audience: str,
     content: Dict[str, Any],
     image_url: Optional[str] = None,
-    goal: Optional[str] = None
+    goal: Optional[str] = None,
+    background: bool = False
 ) -> str:
     """
     Save a content generation to the database.
     
+    With background=True the write is queued (write-behind) and this
+    returns immediately; the document becomes visible after the next flush.
+    
     Returns the inserted document ID as a string.
     """
-    db = get_database()
-    
     document = {
         "type": generation_type,  # "seo", "social", "email", "whatsapp", "full"
         "business_name": business_name,
@@ -67,8 +229,7 @@ async def save_generation(
         "created_at": datetime.utcnow()
     }
     
-    result = await db.generations.insert_one(document)
-    return str(result.inserted_id)
+    return await _save_document("generations", document, background)
 
 
 async def save_website_analysis(
@@ -76,15 +237,16 @@ async def save_website_analysis(
     title: Optional[str],
     description: Optional[str],
     content_summary: Optional[str],
-    seo_analysis: str
+    seo_analysis: str,
+    background: bool = False
 ) -> str:
     """
     Save a website SEO analysis to the database.
     
+    With background=True the write is queued (write-behind).
+    
     Returns the inserted document ID as a string.
     """
-    db = get_database()
-    
     document = {
         "website_url": website_url,
         "title": title,
@@ -94,13 +256,13 @@ async def save_website_analysis(
         "created_at": datetime.utcnow()
     }
     
-    result = await db.website_analyses.insert_one(document)
-    return str(result.inserted_id)
+    return await _save_document("website_analyses", document, background)
 
 
 async def get_generations(
     limit: int = 50,
-    generation_type: Optional[str] = None
+    generation_type: Optional[str] = None,
+    include_content: bool = True
 ) -> List[Dict[str, Any]]:
     """
     Retrieve generation history.
@@ -108,20 +270,25 @@ async def get_generations(
     Args:
         limit: Maximum number of records to return
         generation_type: Filter by type (optional)
+        include_content: If False, skip fetching and decompressing `content`
     
     Returns:
         List of generation documents
     """
-    db = get_database()
+    db = get_analytics_database()
     
     query = {}
     if generation_type:
         query["type"] = generation_type
     
-    cursor = db.generations.find(query).sort("created_at", -1).limit(limit)
+    projection = None if include_content else {"content": 0}
+    cursor = db.generations.find(query, projection).sort("created_at", -1).limit(limit)
+    
+    docs = await cursor.to_list(limit)
+    await content_store.unpack_documents(db, "generations", docs)
     
     results = []
-    async for doc in cursor:
+    for doc in docs:
         doc["_id"] = str(doc["_id"])
         doc["created_at"] = doc["created_at"].isoformat()
         results.append(doc)
@@ -136,7 +303,7 @@ async def get_website_analyses(limit: int = 50) -> List[Dict[str, Any]]:
     Returns:
         List of website analysis documents
     """
-    db = get_database()
+    db = get_analytics_database()
     
     cursor = db.website_analyses.find().sort("created_at", -1).limit(limit)
     
@@ -153,14 +320,36 @@ async def get_generation_by_id(generation_id: str) -> Optional[Dict[str, Any]]:
     """
     Get a specific generation by ID.
     
+    Falls back to the archive for generations moved out by app/archival.py.
+    
     Returns:
         The generation document or None if not found
     """
+    return await _get_history_document("generations", generation_id)
+
+
+async def get_website_analysis_by_id(analysis_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get a specific website analysis by ID (including archived analyses).
+    
+    Returns:
+        The analysis document or None if not found
+    """
+    return await _get_history_document("website_analyses", analysis_id)
+
+
+async def _get_history_document(collection_name: str, document_id: str) -> Optional[Dict[str, Any]]:
+    """Find a history document by ID in the hot collection, then in the archive."""
+    from app.archival import read_archived
+    
     db = get_database()
     
     try:
-        doc = await db.generations.find_one({"_id": ObjectId(generation_id)})
+        doc = await db[collection_name].find_one({"_id": ObjectId(document_id)})
+        if doc is None:
+            doc = await read_archived(collection_name, document_id)
         if doc:
+            await content_store.unpack_document(db, collection_name, doc)
             doc["_id"] = str(doc["_id"])
             doc["created_at"] = doc["created_at"].isoformat()
         return doc
@@ -172,26 +361,21 @@ async def get_stats() -> Dict[str, Any]:
     """
     Get statistics about stored generations.
     
+    Reads pre-aggregated counters from the rollups collection, so the cost
+    does not grow with the number of stored generations.
+    
     Returns:
         Stats including counts by type
     """
-    db = get_database()
-    
-    pipeline = [
-        {"$group": {"_id": "$type", "count": {"$sum": 1}}},
-    ]
-    
-    type_counts = {}
-    async for doc in db.generations.aggregate(pipeline):
-        type_counts[doc["_id"]] = doc["count"]
+    db = get_analytics_database()
     
-    total_generations = await db.generations.count_documents({})
-    total_analyses = await db.website_analyses.count_documents({})
+    generation_rollups = await rollups.get_rollups(db, "generations")
+    analysis_rollups = await rollups.get_rollups(db, "website_analyses")
     
     return {
-        "total_generations": total_generations,
-        "total_website_analyses": total_analyses,
-        "by_type": type_counts
+        "total_generations": rollups.rollup_total(generation_rollups),
+        "total_website_analyses": rollups.rollup_total(analysis_rollups),
+        "by_type": rollups.rollup_counts(generation_rollups, "type")
     }
 
 
@@ -207,18 +391,18 @@ async def save_social_post(
     content: str,
     image_url: Optional[str] = None,
     scheduled_for: Optional[datetime] = None,
-    status: str = "draft"  # draft, scheduled, published
+    status: str = "draft",  # draft, scheduled, published
+    background: bool = False
 ) -> str:
     """
     Save a social media post with optional scheduling.
     
     Args:
         status: "draft" (not scheduled), "scheduled" (has reminder), "published" (posted)
+        background: Queue the write (write-behind) instead of waiting for it
     
     Returns the inserted document ID.
     """
-    db = get_database()
-    
     document = {
         "business_name": business_name,
         "product_description": product_description,
@@ -231,8 +415,7 @@ async def save_social_post(
         "created_at": datetime.utcnow()
     }
     
-    result = await db.social_posts.insert_one(document)
-    return str(result.inserted_id)
+    return await _save_document("social_posts", document, background)
 
 
 async def get_social_posts(
@@ -253,8 +436,11 @@ async def get_social_posts(
     
     cursor = db.social_posts.find(query).sort("created_at", -1).limit(limit)
     
+    docs = await cursor.to_list(limit)
+    await content_store.unpack_documents(db, "social_posts", docs)
+    
     results = []
-    async for doc in cursor:
+    for doc in docs:
         doc["_id"] = str(doc["_id"])
         doc["created_at"] = doc["created_at"].isoformat()
         if doc.get("scheduled_for"):
@@ -273,8 +459,11 @@ async def get_scheduled_posts() -> List[Dict[str, Any]]:
     query = {"status": "scheduled", "scheduled_for": {"$ne": None}}
     cursor = db.social_posts.find(query).sort("scheduled_for", 1)
     
+    docs = await cursor.to_list(None)
+    await content_store.unpack_documents(db, "social_posts", docs)
+    
     results = []
-    async for doc in cursor:
+    for doc in docs:
         doc["_id"] = str(doc["_id"])
         doc["created_at"] = doc["created_at"].isoformat()
         if doc.get("scheduled_for"):
@@ -291,13 +480,20 @@ async def update_post_status(post_id: str, new_status: str) -> bool:
     db = get_database()
     
     try:
-        result = await db.social_posts.update_one(
+        before = await db.social_posts.find_one_and_update(
             {"_id": ObjectId(post_id)},
-            {"$set": {"status": new_status}}
+            {"$set": {"status": new_status}},
+            projection={"status": 1, "platform": 1},
+            return_document=ReturnDocument.BEFORE
         )
-        return result.modified_count > 0
     except Exception:
         return False
+    
+    if not before or before.get("status") == new_status:
+        return False
+    
+    await rollups.record_change(db, "social_posts", before, {**before, "status": new_status})
+    return True
 
 
 async def update_post_schedule(post_id: str, scheduled_for: datetime) -> bool:
@@ -307,13 +503,22 @@ async def update_post_schedule(post_id: str, scheduled_for: datetime) -> bool:
     db = get_database()
     
     try:
-        result = await db.social_posts.update_one(
+        before = await db.social_posts.find_one_and_update(
             {"_id": ObjectId(post_id)},
-            {"$set": {"scheduled_for": scheduled_for, "status": "scheduled"}}
+            {"$set": {"scheduled_for": scheduled_for, "status": "scheduled"}},
+            projection={"status": 1, "platform": 1, "scheduled_for": 1},
+            return_document=ReturnDocument.BEFORE
         )
-        return result.modified_count > 0
     except Exception:
         return False
+    
+    if not before:
+        return False
+    
+    if before.get("status") != "scheduled":
+        await rollups.record_change(db, "social_posts", before, {**before, "status": "scheduled"})
+    
+    return before.get("status") != "scheduled" or before.get("scheduled_for") != scheduled_for
 
 
 # ============================================
@@ -367,18 +572,23 @@ async def _get_next_default_slot(now: datetime) -> datetime:
         "scheduled_for": {"$gte": now, "$lte": week_ahead}
     }).to_list(100)
     
+    return pick_default_slot(now, [post.get("scheduled_for") for post in scheduled])
+
+
+def pick_default_slot(now: datetime, scheduled_for: List[Optional[datetime]]) -> datetime:
+    """
+    Pick the first free default slot (7am-10pm, 30-min intervals) in the
+    next 7 days, given the times already scheduled.
+    """
     scheduled_times = set()
-    for post in scheduled:
-        if post.get("scheduled_for"):
+    for st in scheduled_for:
+        if st:
             # Round to 30-min slot
-            st = post["scheduled_for"]
             slot = st.replace(minute=(st.minute // 30) * 30, second=0, microsecond=0)
             scheduled_times.add(slot)
     
     # Generate available slots starting from now
     # Hours: 7am to 10pm (7-22), 30-min intervals
-    current = now.replace(minute=(now.minute // 30) * 30 + 30, second=0, microsecond=0)
-    
     for day_offset in range(7):  # Check next 7 days
         check_date = now + timedelta(days=day_offset)
         
@@ -475,8 +685,6 @@ async def auto_schedule_post(post_id: str) -> Optional[datetime]:
     Also creates a Google Calendar event for the scheduled time.
     Returns the scheduled datetime.
     """
-    from app.integrations.google_calendar import create_calendar_event
-    
     optimal_time = await get_next_available_slot()
     
     success = await update_post_schedule(post_id, optimal_time)
@@ -486,28 +694,16 @@ async def auto_schedule_post(post_id: str) -> Optional[datetime]:
         db = get_database()
         try:
             post = await db.social_posts.find_one({"_id": ObjectId(post_id)})
+            await content_store.unpack_document(db, "social_posts", post)
             if post:
-                # Create Google Calendar event
-                calendar_result = create_calendar_event(
-                    title=f"{post.get('platform', 'Social')} Post - {post.get('business_name', 'Marketing')}",
-                    description=post.get('content', 'Scheduled social media post'),
-                    start_time=optimal_time,
-                    platform=post.get('platform', 'Social Media'),
-                    image_url=post.get('image_url')
-                )
+                event_fields = create_post_calendar_event(post, optimal_time)
                 
                 # Store calendar event ID in the post document
-                if calendar_result.get("success") and calendar_result.get("event_id"):
+                if event_fields:
                     await db.social_posts.update_one(
                         {"_id": ObjectId(post_id)},
-                        {"$set": {
-                            "calendar_event_id": calendar_result.get("event_id"),
-                            "calendar_event_link": calendar_result.get("event_link")
-                        }}
+                        {"$set": event_fields}
                     )
-                    print(f"[Calendar] Event created: {calendar_result.get('event_link')}")
-                else:
-                    print(f"[Calendar] Skipped: {calendar_result.get('message')}")
         except Exception as e:
             print(f"[Calendar] Error creating event: {e}")
         
@@ -515,45 +711,238 @@ async def auto_schedule_post(post_id: str) -> Optional[datetime]:
     return None
 
 
+def create_post_calendar_event(post: Dict[str, Any], start_time: datetime) -> Dict[str, Any]:
+    """
+    Create the Google Calendar reminder for a scheduled post.
+    
+    Returns the calendar fields to store on the post, or {} if skipped.
+    """
+    from app.integrations.google_calendar import create_calendar_event
+    
+    calendar_result = create_calendar_event(
+        title=f"{post.get('platform', 'Social')} Post - {post.get('business_name', 'Marketing')}",
+        description=post.get('content', 'Scheduled social media post'),
+        start_time=start_time,
+        platform=post.get('platform', 'Social Media'),
+        image_url=post.get('image_url')
+    )
+    
+    if calendar_result.get("success") and calendar_result.get("event_id"):
+        print(f"[Calendar] Event created: {calendar_result.get('event_link')}")
+        return {
+            "calendar_event_id": calendar_result.get("event_id"),
+            "calendar_event_link": calendar_result.get("event_link")
+        }
+    
+    print(f"[Calendar] Skipped: {calendar_result.get('message')}")
+    return {}
+
+
 # ============================================
 # Lead Management
 # ============================================
 
-async def save_lead(lead_data: Dict[str, Any]) -> str:
+def normalize_email(email: Optional[str]) -> str:
+    """Normalize an email address for matching (trimmed, lowercased)."""
+    return (email or "").strip().lower()
+
+
+# Schema defaults, written only when an upsert creates the lead
+LEAD_DEFAULTS = {
+    name: field.default for name, field in LeadCreate.model_fields.items() if not field.is_required()
+}
+
+
+def lead_insert_defaults(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Defaults for the fields a new lead's import row did not supply."""
+    defaults = {k: v for k, v in LEAD_DEFAULTS.items() if k not in fields}
+    if "base_score" not in fields:
+        defaults["base_score"] = fields.get("score", LEAD_DEFAULTS["score"])
+    return defaults
+
+
+async def ensure_lead_indexes() -> None:
     """
-    Save a single lead to the database.
+    Create the unique index on normalized email used for upserts.
     
-    Returns the inserted document ID as a string.
+    The index is partial (only documents that have `email_normalized`), so
+    legacy leads without the field never collide. Missing values are then
+    backfilled; leads whose email is already taken by another lead are left
+    without the field and reported.
     """
     db = get_database()
     
-    document = {
-        **lead_data,
-        "created_at": datetime.utcnow()
-    }
-    
-    result = await db.leads.insert_one(document)
-    return str(result.inserted_id)
+    await db.leads.create_index(
+        "email_normalized",
+        unique=True,
+        partialFilterExpression={"email_normalized": {"$type": "string"}},
+        name="email_normalized_unique"
+    )
+    await db.leads.create_index("dedupe_keys")
+    
+    operations = []
+    conflicts = 0
+    cursor = db.leads.find({"email_normalized": {"$exists": False}}, {"email": 1})
+    async for lead in cursor:
+        key = normalize_email(lead.get("email"))
+        if key:
+            operations.append(UpdateOne({"_id": lead["_id"]}, {"$set": {"email_normalized": key}}))
+        if len(operations) >= 1000:
+            conflicts += await _backfill_normalized(db, operations)
+            operations = []
+    if operations:
+        conflicts += await _backfill_normalized(db, operations)
+    
+    if conflicts:
+        print(f"[MongoDB] {conflicts} leads share a normalized email and were not indexed")
 
 
-async def save_leads_bulk(leads: List[Dict[str, Any]]) -> List[str]:
+async def _backfill_normalized(db, operations: List[UpdateOne]) -> int:
+    """Apply a backfill batch, returning how many updates hit duplicate emails."""
+    try:
+        await db.leads.bulk_write(operations, ordered=False)
+        return 0
+    except BulkWriteError as e:
+        return len(e.details.get("writeErrors", []))
+
+
+async def upsert_leads(leads: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
-    Save multiple leads to the database using bulk insert.
+    Insert or update leads keyed by normalized email, in one unordered bulk_write.
     
-    Returns list of inserted document IDs.
+    Rows in the same batch that share an email are merged (later rows win).
+    Only the fields a row supplies are written to an existing lead, so rows
+    should be built with `model_dump(exclude_unset=True)`; schema defaults
+    (LEAD_DEFAULTS) apply only when the lead is inserted.
+    
+    Returns:
+        dict with:
+        - ids: document ID per input row (None for rows that failed)
+        - inserted / updated: counts of distinct leads written
+        - errors: list of {"index": row index, "error": message}
     """
     db = get_database()
+    now = datetime.utcnow()
     
-    documents = []
-    for lead in leads:
-        doc = {
-            **lead,
-            "created_at": datetime.utcnow()
-        }
-        documents.append(doc)
+    merged: Dict[str, Dict[str, Any]] = {}
+    row_keys: List[Optional[str]] = []
+    errors = []
+    
+    for index, lead in enumerate(leads):
+        own_key = normalize_email(lead.get("email"))
+        if not own_key:
+            row_keys.append(None)
+            errors.append({"index": index, "error": "Missing email"})
+            continue
+        # Rows resolved as duplicates (app/lead_dedupe.py) update the lead they match
+        key = lead.get("_merge_key") or own_key
+        row_keys.append(key)
+        update = {k: v for k, v in lead.items() if k not in ("_id", "id", "created_at", "_merge_key")}
+        if key != own_key:
+            update.pop("email", None)  # Kept in alternate_emails; the lead keeps its address
+        elif update.get("name"):
+            update["dedupe_keys"] = lead_dedupe.lead_keys(update)
+        fields = merged.setdefault(key, {})
+        fields.update(update)
+        fields["email_normalized"] = key
+        if "score" in lead:
+            fields["base_score"] = lead["score"]  # Imported score is the rescoring baseline
+    
+    if not merged:
+        return {"ids": [None] * len(leads), "inserted": 0, "updated": 0, "errors": errors}
+    
+    # Current state of leads being updated, needed to move their rollup counts
+    existing = {}
+    cursor = db.leads.find(
+        {"email_normalized": {"$in": list(merged)}},
+        {"email_normalized": 1, "status": 1, "source": 1, "value": 1, "created_at": 1}
+    )
+    async for doc in cursor:
+        existing[doc["email_normalized"]] = doc
+    
+    keys = list(merged)
+    operations = [
+        UpdateOne(
+            {"email_normalized": key},
+            {
+                "$set": {**merged[key], "updated_at": now},
+                "$setOnInsert": {**lead_insert_defaults(merged[key]), "created_at": now}
+            },
+            upsert=True
+        )
+        for key in keys
+    ]
+    
+    failed: Dict[str, str] = {}
+    try:
+        result = await db.leads.bulk_write(operations, ordered=False)
+        upserted = result.upserted_ids
+    except BulkWriteError as e:
+        upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+        for write_error in e.details.get("writeErrors", []):
+            failed[keys[write_error["index"]]] = write_error.get("errmsg", "Write failed")
+    
+    key_ids: Dict[str, Any] = {}
+    deltas: Dict[Any, Dict[str, int]] = {}
+    for position, key in enumerate(keys):
+        if key in failed:
+            continue
+        if position in upserted:
+            key_ids[key] = upserted[position]
+            inserted_lead = {**lead_insert_defaults(merged[key]), **merged[key], "created_at": now}
+            rollups.collect_increments(deltas, "leads", inserted_lead)
+        elif key in existing:
+            old = existing[key]
+            key_ids[key] = old["_id"]
+            rollups.collect_increments(deltas, "leads", old, sign=-1)
+            rollups.collect_increments(deltas, "leads", {**old, **merged[key]})
+    
+    try:
+        await rollups.apply_increments(db, deltas)
+    except Exception as e:
+        print(f"[Rollups] Failed to record lead upserts: {e}")
+    
+    ids = []
+    for index, key in enumerate(row_keys):
+        if key is None:
+            ids.append(None)
+        elif key in key_ids:
+            ids.append(str(key_ids[key]))
+        else:
+            ids.append(None)
+            errors.append({"index": index, "error": failed.get(key, "Write failed")})
+    
+    return {
+        "ids": ids,
+        "inserted": len(upserted),
+        "updated": len(key_ids) - len(upserted),
+        "errors": sorted(errors, key=lambda e: e["index"])
+    }
+
+
+async def save_lead(lead_data: Dict[str, Any]) -> str:
+    """
+    Save a single lead to the database.
+    
+    A lead whose email already exists updates that lead instead of
+    creating a duplicate.
+    
+    Returns the document ID as a string.
+    """
+    result = await upsert_leads([lead_data])
+    if result["errors"]:
+        raise ValueError(result["errors"][0]["error"])
+    return result["ids"][0]
+
+
+async def save_leads_bulk(leads: List[Dict[str, Any]]) -> List[str]:
+    """
+    Save multiple leads to the database using a bulk upsert on normalized email.
     
-    result = await db.leads.insert_many(documents)
-    return [str(id) for id in result.inserted_ids]
+    Returns list of document IDs for the leads that were written.
+    """
+    result = await upsert_leads(leads)
+    return [lead_id for lead_id in result["ids"] if lead_id]
 
 
 async def get_leads(
@@ -588,15 +977,36 @@ async def get_leads(
         del doc["_id"]
         if doc.get("created_at"):
             doc["created_at"] = doc["created_at"].isoformat()
+        if doc.get("updated_at"):
+            doc["updated_at"] = doc["updated_at"].isoformat()
         results.append(doc)
     
     return results
 
 
+async def get_leads_by_ids(lead_ids: List[str]) -> List[Dict[str, Any]]:
+    """
+    Retrieve leads by ID, in the order given (missing leads are left out).
+    """
+    db = get_database()
+    
+    object_ids = [ObjectId(lead_id) for lead_id in lead_ids if lead_id and ObjectId.is_valid(lead_id)]
+    found = {}
+    async for doc in db.leads.find({"_id": {"$in": object_ids}}):
+        doc["id"] = str(doc.pop("_id"))
+        for field in ("created_at", "updated_at"):
+            if doc.get(field):
+                doc[field] = doc[field].isoformat()
+        found[doc["id"]] = doc
+    
+    return [found[lead_id] for lead_id in lead_ids if lead_id in found]
+
+
 async def delete_all_leads() -> int:
     """Delete all leads from the database. Returns count of deleted documents."""
     db = get_database()
     result = await db.leads.delete_many({})
+    await rollups.reset_scope(db, "leads")
     return result.deleted_count
 
 
@@ -628,6 +1038,25 @@ def get_email_frequency_hours(score: int) -> int:
         return 48  # Cold leads: every 48 hours
 
 
+def build_email_history_document(
+    lead_id: str,
+    lead_email: str,
+    subject: str,
+    success: bool,
+    message: str = None,
+    sent_at: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """Build an email_history document. One timestamp is used for the whole record."""
+    return {
+        "lead_id": lead_id,
+        "lead_email": lead_email,
+        "subject": subject,
+        "success": success,
+        "message": message,
+        "sent_at": sent_at or datetime.utcnow()
+    }
+
+
 async def save_email_history(
     lead_id: str,
     lead_email: str,
@@ -637,30 +1066,61 @@ async def save_email_history(
 ) -> str:
     """
     Save email send history to track when emails were sent.
+    
+    Campaign loops should prefer the buffered writer in
+    `app/history_writer.py`, which batches these writes.
     """
-    db = get_database()
+    document = build_email_history_document(lead_id, lead_email, subject, success, message)
+    ids = await save_email_history_bulk([document])
+    return ids[0]
+
+
+async def save_email_history_bulk(documents: List[Dict[str, Any]]) -> List[str]:
+    """
+    Save many email history documents with two bulk writes.
     
-    document = {
-        "lead_id": lead_id,
-        "lead_email": lead_email,
-        "subject": subject,
-        "success": success,
-        "message": message,
-        "sent_at": datetime.utcnow()
-    }
+    Inserts all history rows in one unordered batch, then updates each
+    lead once per distinct lead: `last_emailed_at` with `$max`, so batches
+    flushed out of order never move the timestamp backwards, and the
+    `emails_sent` / `emails_failed` counters segments filter on with `$inc`.
+    
+    Returns list of inserted history IDs.
+    """
+    db = get_database()
     
-    result = await db.email_history.insert_one(document)
+    ids = await insert_documents("email_history", documents)
     
-    # Also update the lead's last_emailed_at field
-    try:
-        await db.leads.update_one(
-            {"_id": ObjectId(lead_id)},
-            {"$set": {"last_emailed_at": datetime.utcnow()}}
-        )
-    except Exception:
-        pass
+    # Also update each lead's last_emailed_at field and send counters
+    now = datetime.utcnow()
+    last_sent: Dict[str, datetime] = {}
+    counters: Dict[str, Dict[str, int]] = {}
+    for document in documents:
+        lead_id = document.get("lead_id")
+        if lead_id and ObjectId.is_valid(lead_id):
+            last_sent[lead_id] = max(document["sent_at"], last_sent.get(lead_id, document["sent_at"]))
+            counts = counters.setdefault(lead_id, {"emails_sent": 0, "emails_failed": 0})
+            counts["emails_sent" if document.get("success") else "emails_failed"] += 1
+    
+    if last_sent:
+        try:
+            await db.leads.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": ObjectId(lead_id)},
+                        {
+                            "$max": {"last_emailed_at": sent_at},
+                            "$inc": counters[lead_id],
+                            "$set": {"updated_at": now}
+                        }
+                    )
+                    for lead_id, sent_at in last_sent.items()
+                ],
+                ordered=False
+            )
+        except Exception as e:
+            print(f"[MongoDB] Failed to update last_emailed_at: {e}")
     
-    return str(result.inserted_id)
+    return ids
 
 
 async def get_last_email_time(lead_id: str) -> Optional[datetime]:
@@ -677,18 +1137,25 @@ async def get_last_email_time(lead_id: str) -> Optional[datetime]:
         return None
 
 
-async def get_leads_for_email_campaign() -> List[Dict[str, Any]]:
+async def get_leads_for_email_campaign(query: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
     """
     Get all leads that are eligible for email based on their score and last email time.
     
     Returns leads sorted by score (highest first) that haven't been emailed
-    within their score-based frequency window.
+    within their score-based frequency window and are not on the
+    suppression list (unsubscribed, bounced or complained).
+    
+    Args:
+        query: Optional lead filter restricting the campaign to a segment
+            (see `app/segments.py`)
     """
+    from app.suppression import is_suppressed
+    
     db = get_database()
     now = datetime.utcnow()
     
-    # Get all leads
-    cursor = db.leads.find({}).sort("score", -1)
+    # Get all leads (in the segment, if any)
+    cursor = db.leads.find(query or {}).sort("score", -1)
     
     eligible_leads = []
     async for lead in cursor:
@@ -696,7 +1163,7 @@ async def get_leads_for_email_campaign() -> List[Dict[str, Any]]:
         score = lead.get("score", 50)
         email = lead.get("email")
         
-        if not email:
+        if not email or is_suppressed(email):
             continue
         
         # Get required frequency based on score
@@ -729,7 +1196,7 @@ async def get_leads_for_email_campaign() -> List[Dict[str, Any]]:
 
 async def get_email_history(lead_id: str = None, limit: int = 50) -> List[Dict[str, Any]]:
     """Get email history, optionally filtered by lead ID."""
-    db = get_database()
+    db = get_analytics_database()
     
     query = {}
     if lead_id:
@@ -0,0 +1,356 @@
+"""
+Async Email Delivery Engine for AI Marketing Agent.
+Sends many emails concurrently over asyncio SMTP connections (aiosmtplib),
+so campaigns no longer block the event loop on one synchronous send at a
+time.
+
+Each of up to EMAIL_DELIVERY_CONCURRENCY workers owns one logged-in
+connection and pulls messages from a shared queue, so concurrency is
+bounded by the number of open connections. Every message (and connect)
+has a timeout; a connection that times out or drops is discarded and the
+worker reconnects. Results are yielded as each send completes.
+
+Messages are handed to the workers by the send pacer (app/send_pacing.py):
+hot leads first, within the daily, per-minute and per-domain limits.
+Messages the daily budget cannot cover are returned as deferred.
+
+Recipients on the suppression list (app/suppression.py) are returned as
+suppressed without being sent or paced; recipients the server permanently
+refuses are returned as bounced and suppressed.
+
+Server settings and per-connection message limits are shared with the
+synchronous pool in app/integrations/email_sender.py.
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, AsyncIterator
+
+import aiosmtplib
+
+from app.integrations.email_sender import (
+    SMTP_HOST, SMTP_PORT, SMTP_SSL, SMTP_STARTTLS,
+    SMTP_MAX_MESSAGES_PER_CONNECTION, build_message
+)
+from app.send_pacing import PacedQueue, SendPacer, get_send_pacer
+from app.tracking import record_sent
+from app.suppression import (
+    is_suppressed, suppressed_result, get_suppression_list, suppression_ready,
+    NOT_LOADED, SUPPRESSION_LOAD_RETRY_SECONDS
+)
+
+
+EMAIL_DELIVERY_CONCURRENCY = int(os.getenv("EMAIL_DELIVERY_CONCURRENCY") or "10")
+EMAIL_SEND_TIMEOUT_SECONDS = float(os.getenv("EMAIL_SEND_TIMEOUT_SECONDS") or "30")
+EMAIL_PACING = (os.getenv("EMAIL_PACING") or "true").lower() == "true"
+
+_AUTH_FAILED = "Gmail authentication failed. Check your app password."
+
+
+class _UnpacedQueue:
+    """Hands out messages in order, without pacing (same interface as PacedQueue)."""
+
+    daily_reset = None
+
+    def __init__(self, emails: List[Dict[str, Any]]):
+        self._emails = iter(emails)
+
+    async def next(self):
+        email = next(self._emails, None)
+        return None if email is None else (email, None)
+
+
+class AsyncEmailDelivery:
+    """Delivers a batch of emails over a bounded set of async SMTP connections."""
+
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        concurrency: int = EMAIL_DELIVERY_CONCURRENCY,
+        timeout: float = EMAIL_SEND_TIMEOUT_SECONDS,
+        host: str = SMTP_HOST,
+        port: int = SMTP_PORT,
+        use_ssl: bool = SMTP_SSL,
+        starttls: bool = SMTP_STARTTLS,
+        max_messages: int = SMTP_MAX_MESSAGES_PER_CONNECTION,
+        pacer: Optional[SendPacer] = None,
+        paced: bool = EMAIL_PACING,
+        stop: Optional[asyncio.Event] = None
+    ):
+        """
+        Args:
+            username / password: SMTP login (also the sender address)
+            concurrency: Maximum connections (and messages in flight)
+            timeout: Seconds allowed per message, and per connect + login
+            host / port / use_ssl: Server (use_ssl: implicit TLS)
+            starttls: Upgrade plain (non-SSL) connections with STARTTLS
+            max_messages: Messages per connection before it is recycled
+            pacer: Pacing state to use (default: the process-wide pacer)
+            paced: Apply pacing; without it messages go out as fast as possible, in order
+            stop: Once set, messages not yet started are returned as deferred
+                (retry_at None); sends already in flight still complete
+        """
+        self.username = username
+        self.password = password
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.starttls = starttls
+        self.max_messages = max_messages
+        self.pacer = pacer
+        self.paced = paced
+        self.stop = stop
+
+        self._fatal: Optional[str] = None
+        self.stats = {"sent": 0, "failed": 0, "deferred": 0, "timeouts": 0, "connections": 0, "reconnects": 0}
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(
+            hostname=self.host,
+            port=self.port,
+            username=self.username,
+            password=self.password,
+            use_tls=self.use_ssl,
+            start_tls=self.starttls and not self.use_ssl,
+            timeout=self.timeout
+        )
+        await asyncio.wait_for(smtp.connect(), self.timeout)  # Also logs in
+        self.stats["connections"] += 1
+        return smtp
+
+    @staticmethod
+    async def _close(smtp: Optional[aiosmtplib.SMTP], graceful: bool = True) -> None:
+        if smtp is None or not smtp.is_connected:
+            return
+        try:
+            if graceful:
+                await asyncio.wait_for(smtp.quit(), 5)
+            else:
+                smtp.close()
+        except Exception:
+            smtp.close()
+
+    async def _send_one(self, smtp: Optional[aiosmtplib.SMTP], email: Dict[str, Any]):
+        """
+        Send one email, (re)connecting as needed.
+
+        Returns (connection to keep using or None, result dict). A server
+        disconnect before the message was accepted is retried once.
+        """
+        for attempt in range(2):
+            try:
+                message = build_message(
+                    self.username, email["to"], email["subject"], email["body"], email.get("message_id"),
+                    lead_id=email.get("lead_id"), campaign=email.get("campaign")
+                )
+                if smtp is None:
+                    try:
+                        smtp = await self._connect()
+                    except asyncio.TimeoutError:
+                        # Nothing was handed to the server yet: an ordinary, retryable failure
+                        self.stats["timeouts"] += 1
+                        return None, {
+                            "success": False,
+                            "message": f"Failed to send email: connect timed out after {self.timeout:g}s"
+                        }
+                await asyncio.wait_for(smtp.send_message(message), self.timeout)
+                record_sent(email.get("lead_id"), email.get("campaign"))
+                return smtp, {"success": True, "message": f"Email sent successfully to {email['to']}"}
+            except aiosmtplib.SMTPAuthenticationError:
+                self._fatal = _AUTH_FAILED
+                await self._close(smtp, graceful=False)
+                return None, {"success": False, "message": _AUTH_FAILED}
+            except aiosmtplib.SMTPServerDisconnected as e:
+                await self._close(smtp, graceful=False)
+                smtp = None
+                if attempt == 0:
+                    self.stats["reconnects"] += 1
+                    continue
+                return None, {"success": False, "message": f"Failed to send email: {str(e)}"}
+            except aiosmtplib.SMTPRecipientsRefused as e:
+                # 5xx: the mailbox does not exist or refuses mail, a hard bounce
+                try:
+                    await asyncio.wait_for(smtp.rset(), self.timeout)
+                except Exception:
+                    await self._close(smtp, graceful=False)
+                    smtp = None
+                return smtp, {
+                    "success": False,
+                    "bounced": any(recipient.code >= 500 for recipient in e.recipients),
+                    "message": f"Failed to send email: {str(e)}"
+                }
+            except asyncio.TimeoutError:
+                # The message may or may not have been accepted; never reuse the connection
+                self.stats["timeouts"] += 1
+                await self._close(smtp, graceful=False)
+                return None, {
+                    "success": False,
+                    "uncertain": True,
+                    "message": f"Failed to send email: timed out after {self.timeout:g}s"
+                }
+            except aiosmtplib.SMTPResponseException as e:
+                # Refused sender/recipient/data: the connection is still usable after RSET
+                try:
+                    await asyncio.wait_for(smtp.rset(), self.timeout)
+                except Exception:
+                    await self._close(smtp, graceful=False)
+                    smtp = None
+                return smtp, {"success": False, "message": f"Failed to send email: {str(e)}"}
+            except Exception as e:
+                await self._close(smtp, graceful=False)
+                return None, {"success": False, "message": f"Failed to send email: {str(e)}"}
+
+    async def _worker(self, queue, results: asyncio.Queue) -> None:
+        smtp: Optional[aiosmtplib.SMTP] = None
+        sent_on_connection = 0
+        try:
+            while True:
+                item = await queue.next()
+                if item is None:
+                    return
+                email, deferred = item
+
+                started = time.perf_counter()
+                if deferred:
+                    result = {"success": False, "deferred": True, "message": deferred, "retry_at": queue.daily_reset}
+                elif self._fatal:
+                    result = {"success": False, "message": self._fatal}
+                elif self.stop is not None and self.stop.is_set():
+                    result = {"success": False, "deferred": True, "message": "Delivery stopped before this email was sent", "retry_at": None}
+                else:
+                    if smtp is not None and sent_on_connection >= self.max_messages:
+                        await self._close(smtp)
+                        smtp = None
+                    previous = smtp
+                    smtp, result = await self._send_one(smtp, email)
+                    if smtp is not previous:
+                        sent_on_connection = 0
+                    if result["success"]:
+                        sent_on_connection += 1
+
+                self.stats["sent" if result["success"] else "deferred" if result.get("deferred") else "failed"] += 1
+                result.setdefault("deferred", False)
+                result.update(
+                    key=email.get("key"),
+                    to=email["to"],
+                    subject=email["subject"],
+                    elapsed_ms=round((time.perf_counter() - started) * 1000, 1)
+                )
+                await results.put(result)
+        finally:
+            await self._close(smtp)
+
+    async def deliver(self, emails: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Send emails concurrently, yielding one result per email as it completes.
+
+        Args:
+            emails: dicts with "to", "subject", "body" and an optional "key"
+                echoed back on the result (e.g. the lead ID); paced
+                deliveries send higher-"score" leads first. An optional
+                "message_id" sets the Message-ID header, and "lead_id" /
+                "campaign" enable open/click tracking.
+
+        Yields:
+            dicts with key, to, subject, success, message, elapsed_ms and
+            deferred (with retry_at, when the daily budget ran out);
+            failures that may still have been delivered (timeouts after
+            the message was handed to the server, not connect or login
+            timeouts) also have uncertain=True, and permanent recipient refusals
+            bounced=True
+        """
+        if not emails:
+            return
+
+        queue = PacedQueue(emails, self.pacer or get_send_pacer()) if self.paced else _UnpacedQueue(emails)
+        results: asyncio.Queue = asyncio.Queue()
+
+        started = time.perf_counter()
+        workers = [
+            asyncio.create_task(self._worker(queue, results))
+            for _ in range(min(self.concurrency, len(emails)))
+        ]
+        completed = False
+        try:
+            for _ in range(len(emails)):
+                yield await results.get()
+            completed = True
+        finally:
+            if not completed:
+                # The consumer stopped early: abandon the remaining sends
+                for worker in workers:
+                    worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        elapsed = time.perf_counter() - started
+        print(f"[Delivery] {self.stats['sent']} sent, {self.stats['failed']} failed, "
+              f"{self.stats['deferred']} deferred in {elapsed:.2f}s "
+              f"({len(emails) / elapsed * 60:.0f}/min, {self.stats['connections']} connections)")
+
+
+async def deliver_emails(emails: List[Dict[str, Any]], **options) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Deliver emails from the configured Gmail account (see AsyncEmailDelivery).
+
+    Suppressed recipients are yielded first, as failed results with
+    suppressed=True; bounced recipients are added to the suppression list.
+    Until the suppression list has loaded, every email is yielded as
+    deferred. Without credentials, yields a failed result per email, like
+    `send_email`.
+    """
+    if not suppression_ready():
+        retry_at = datetime.utcnow() + timedelta(seconds=max(60.0, SUPPRESSION_LOAD_RETRY_SECONDS))
+        for email in emails:
+            yield {
+                "key": email.get("key"),
+                "to": email["to"],
+                "subject": email["subject"],
+                "success": False,
+                "message": NOT_LOADED,
+                "deferred": True,
+                "retry_at": retry_at,
+                "elapsed_ms": 0.0
+            }
+        return
+
+    sendable = []
+    for email in emails:
+        if is_suppressed(email["to"]):
+            yield {
+                **suppressed_result(email["to"]),
+                "key": email.get("key"),
+                "to": email["to"],
+                "subject": email["subject"],
+                "deferred": False,
+                "elapsed_ms": 0.0
+            }
+        else:
+            sendable.append(email)
+    emails = sendable
+
+    gmail_address = os.getenv("GMAIL_ADDRESS")
+    gmail_app_password = os.getenv("GMAIL_APP_PASSWORD")
+
+    if not gmail_address or not gmail_app_password:
+        for email in emails:
+            yield {
+                "key": email.get("key"),
+                "to": email["to"],
+                "subject": email["subject"],
+                "success": False,
+                "message": "Gmail credentials not configured. Set GMAIL_ADDRESS and GMAIL_APP_PASSWORD in .env",
+                "deferred": False,
+                "elapsed_ms": 0.0
+            }
+        return
+
+    delivery = AsyncEmailDelivery(gmail_address, gmail_app_password, **options)
+    async for result in delivery.deliver(emails):
+        if result.get("bounced"):
+            get_suppression_list().suppress_later(result["to"], "bounce", "smtp")
+        yield result
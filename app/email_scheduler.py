@@ -0,0 +1,448 @@
+"""
+Continuous Email Scheduler for AI Marketing Agent.
+Emails every lead on its score-based cadence (see
+`get_email_frequency_hours`) without anyone calling /leads/email-campaign
+and without cron jobs rescanning the whole leads collection.
+
+The scheduler keeps a min-heap of leads keyed by when each is next due:
+`last_emailed_at` plus the lead's frequency, or now for leads never
+emailed. It sleeps until the earliest lead is due, then pops the due
+leads and emails them in batches of EMAIL_SCHEDULER_BATCH_SIZE through
+the paced delivery engine (app/email_delivery.py). Emails deferred by the
+daily send limit go back on the heap for when the budget resets.
+
+The heap is loaded once and kept in sync with a change stream on `leads`
+(replica sets), or else by polling leads whose `updated_at` moved, every
+EMAIL_SCHEDULER_POLL_SECONDS. Score, email and last-email changes move a
+lead in the heap; stale heap entries are skipped when popped, and every
+due lead is re-read from the database before it is emailed.
+
+The templates and optional segment live in the `email_scheduler`
+collection (PUT /email-scheduler). Only the worker holding the scheduler
+lease sends; the others wait to take over. The lease is renewed by a
+heartbeat while a batch is delivered; if it is lost, the rest of the
+batch is not sent and the heap is reloaded when the lease is regained.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from app.database import get_database, get_email_frequency_hours
+from app.campaign_content import render_template_email
+from app.campaign_runner import WORKER_ID
+from app.email_delivery import deliver_emails
+from app.history_writer import get_history_writer
+
+
+EMAIL_SCHEDULER_BATCH_SIZE = int(os.getenv("EMAIL_SCHEDULER_BATCH_SIZE") or "50")
+EMAIL_SCHEDULER_POLL_SECONDS = float(os.getenv("EMAIL_SCHEDULER_POLL_SECONDS") or "15")
+EMAIL_SCHEDULER_LEASE_SECONDS = int(os.getenv("EMAIL_SCHEDULER_LEASE_SECONDS") or "60")
+
+SCHEDULER_COLLECTION = "email_scheduler"
+CONFIG_ID = "config"
+LEASE_ID = "lease"
+
+_LEAD_FIELDS = {"email": 1, "score": 1, "last_emailed_at": 1, "updated_at": 1}
+
+
+def next_due_at(lead: Dict[str, Any], now: datetime) -> Optional[datetime]:
+    """When a lead is next due for an email (None for leads without an email)."""
+    if not lead.get("email"):
+        return None
+    last_emailed = lead.get("last_emailed_at")
+    if last_emailed is None:
+        return now
+    return last_emailed + timedelta(hours=get_email_frequency_hours(lead.get("score", 50)))
+
+
+# ============================================
+# Configuration
+# ============================================
+
+async def ensure_email_scheduler_indexes(db) -> None:
+    """Index for the polling feed (leads changed since the last poll)."""
+    await db.leads.create_index("updated_at")
+
+
+async def get_scheduler_config() -> Optional[Dict[str, Any]]:
+    return await get_database()[SCHEDULER_COLLECTION].find_one({"_id": CONFIG_ID}, {"_id": 0})
+
+
+async def save_scheduler_config(
+    enabled: bool,
+    subject_template: str,
+    body_template: str,
+    segment: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Save the scheduler configuration and start or stop the scheduler here.
+
+    Raises ValueError for templates with unknown placeholders.
+    """
+    try:
+        render_template_email({}, subject_template, body_template)
+    except (KeyError, IndexError, ValueError) as e:
+        raise ValueError(f"Invalid template placeholder: {e}")
+
+    config = {
+        "enabled": enabled,
+        "subject_template": subject_template,
+        "body_template": body_template,
+        "segment": segment,
+        "updated_at": datetime.utcnow(),
+    }
+    await get_database()[SCHEDULER_COLLECTION].update_one({"_id": CONFIG_ID}, {"$set": config}, upsert=True)
+    get_email_scheduler().wake()
+    print(f"[Scheduler] Continuous email scheduler {'enabled' if enabled else 'disabled'}")
+    return config
+
+
+# ============================================
+# Scheduler
+# ============================================
+
+class EmailScheduler:
+    """Min-heap of leads by next due time, dispatched as they come due."""
+
+    def __init__(self, batch_size: int = EMAIL_SCHEDULER_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._heap: List[Tuple[datetime, int, str]] = []
+        self._due: Dict[str, datetime] = {}  # Current due time per lead; older heap entries are stale
+        self._sequence = itertools.count()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._feed_task: Optional[asyncio.Task] = None
+        self._loaded = False
+        self._lease_lost = asyncio.Event()
+        self.feed_mode: Optional[str] = None
+        self.is_leader = False
+        self.stats = {
+            "loads": 0, "feed_updates": 0, "batches": 0,
+            "sent": 0, "failed": 0, "deferred": 0, "skipped": 0,
+            "last_dispatch_at": None,
+        }
+
+    def schedule(self, lead_id: str, due_at: Optional[datetime]) -> None:
+        """Add, move or (with None) remove a lead."""
+        if due_at is None:
+            self._due.pop(lead_id, None)
+            return
+        if self._due.get(lead_id) == due_at:
+            return
+        head = self._heap[0][0] if self._heap else None
+        self._due[lead_id] = due_at
+        heapq.heappush(self._heap, (due_at, next(self._sequence), lead_id))
+        if head is None or due_at < head:
+            self._wake.set()  # Earlier than what the loop is sleeping towards
+
+    def update_lead(self, lead: Dict[str, Any], now: Optional[datetime] = None) -> None:
+        self.schedule(str(lead["_id"]), next_due_at(lead, now or datetime.utcnow()))
+
+    def _prune(self) -> None:
+        """Drop stale entries from the top of the heap."""
+        while self._heap and self._due.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_due(self) -> Optional[datetime]:
+        self._prune()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime, limit: int) -> List[str]:
+        """Remove and return up to `limit` leads due by `now`, earliest first."""
+        due = []
+        while len(due) < limit:
+            self._prune()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            _, _, lead_id = heapq.heappop(self._heap)
+            del self._due[lead_id]
+            due.append(lead_id)
+        if len(self._heap) > 2 * len(self._due) + 1000:
+            # Mostly stale entries: rebuild
+            self._heap = [entry for entry in self._heap if self._due.get(entry[2]) == entry[0]]
+            heapq.heapify(self._heap)
+        return due
+
+    async def load(self) -> None:
+        """Build the heap from every lead (projected to the scheduling fields)."""
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        self._heap, self._due = [], {}
+        async for lead in get_database().leads.find({}, _LEAD_FIELDS):
+            due_at = next_due_at(lead, now)
+            if due_at is not None:
+                lead_id = str(lead["_id"])
+                self._due[lead_id] = due_at
+                self._heap.append((due_at, next(self._sequence), lead_id))
+        heapq.heapify(self._heap)
+        self._loaded = True
+        self.stats["loads"] += 1
+        print(f"[Scheduler] Loaded {len(self._due)} leads in {time.perf_counter() - started:.2f}s")
+
+    async def _watch_changes(self) -> None:
+        """Follow `leads` with a change stream (replica sets only)."""
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        async with get_database().leads.watch(pipeline, full_document="updateLookup") as stream:
+            self.feed_mode = "change_stream"
+            print("[Scheduler] Following lead changes with a change stream")
+            async for change in stream:
+                lead = change.get("fullDocument")
+                if change["operationType"] == "delete" or lead is None:
+                    self.schedule(str(change["documentKey"]["_id"]), None)
+                else:
+                    self.update_lead(lead)
+                self.stats["feed_updates"] += 1
+
+    async def _poll_changes(self) -> None:
+        """Re-schedule leads whose `updated_at` moved since the last poll."""
+        self.feed_mode = "polling"
+        print(f"[Scheduler] Polling lead changes every {EMAIL_SCHEDULER_POLL_SECONDS:g}s")
+        watermark = datetime.utcnow()
+        while True:
+            await asyncio.sleep(EMAIL_SCHEDULER_POLL_SECONDS)
+            try:
+                cursor = get_database().leads.find({"updated_at": {"$gte": watermark}}, _LEAD_FIELDS).sort("updated_at", 1)
+                async for lead in cursor:
+                    self.update_lead(lead)
+                    watermark = max(watermark, lead["updated_at"])
+                    self.stats["feed_updates"] += 1
+            except Exception as e:
+                print(f"[Scheduler] Lead poll failed: {e}")
+
+    async def _follow_changes(self) -> None:
+        try:
+            await self._watch_changes()
+        except Exception as e:
+            # Standalone servers have no change streams
+            print(f"[Scheduler] Change stream unavailable ({e}), falling back to polling")
+        await self._poll_changes()
+
+    async def _dispatch(self, lead_ids: List[str], config: Dict[str, Any], segment_query: Optional[Dict[str, Any]]) -> None:
+        """Email one batch of due leads, re-checked against the database first."""
+        db = get_database()
+        now = datetime.utcnow()
+        query = {"_id": {"$in": [ObjectId(lead_id) for lead_id in lead_ids]}}
+        if segment_query:
+            query = {"$and": [query, segment_query]}
+        leads = {str(lead["_id"]): lead async for lead in db.leads.find(query)}
+
+        outgoing = []
+        for lead_id in lead_ids:
+            lead = leads.get(lead_id)
+            if lead is None:
+                self.stats["skipped"] += 1  # Deleted, or outside the segment
+                continue
+            due_at = next_due_at(lead, now)
+            if due_at is None or due_at > now:
+                # Emailed elsewhere, or its score changed: just reschedule
+                self.schedule(lead_id, due_at)
+                self.stats["skipped"] += 1
+                continue
+            try:
+                subject, body = render_template_email(lead, config["subject_template"], config["body_template"])
+            except (KeyError, IndexError, ValueError) as e:
+                print(f"[Scheduler] Template error for lead {lead_id}: {e}")
+                self.schedule(lead_id, now + timedelta(hours=get_email_frequency_hours(lead.get("score", 50))))
+                self.stats["skipped"] += 1
+                continue
+            outgoing.append({
+                "key": lead_id, "to": lead["email"], "subject": subject, "body": body,
+                "score": lead.get("score", 50), "lead_id": lead_id, "campaign": "scheduler"
+            })
+
+        history_writer = get_history_writer()
+        async for result in deliver_emails(outgoing, stop=self._lease_lost):
+            lead = leads[result["key"]]
+            if result["deferred"]:
+                self.schedule(result["key"], result["retry_at"])
+                self.stats["deferred"] += 1
+                continue
+            if result.get("suppressed"):
+                # Unsubscribed or bounced: dropped until the lead changes
+                self.stats["skipped"] += 1
+                continue
+            await history_writer.add(
+                lead_id=result["key"],
+                lead_email=result["to"],
+                subject=result["subject"],
+                success=result["success"],
+                message=result["message"]
+            )
+            # Like campaigns, a failed send also starts the lead's next window
+            self.schedule(
+                result["key"],
+                datetime.utcnow() + timedelta(hours=get_email_frequency_hours(lead.get("score", 50)))
+            )
+            self.stats["sent" if result["success"] else "failed"] += 1
+
+        await history_writer.flush()
+        self.stats["batches"] += 1
+        self.stats["last_dispatch_at"] = datetime.utcnow()
+
+    async def _segment_query(self, config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not config.get("segment"):
+            return None
+        from app.segments import resolve_segment
+        return await resolve_segment(config["segment"])
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._wake.wait(), max(0.0, seconds))
+        except asyncio.TimeoutError:
+            pass
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    async def _acquire_lease(self) -> bool:
+        now = datetime.utcnow()
+        try:
+            lease = await get_database()[SCHEDULER_COLLECTION].find_one_and_update(
+                {
+                    "_id": LEASE_ID,
+                    # A released lease has owner None (and $lt never matches a null expires_at)
+                    "$or": [{"owner": None}, {"owner": WORKER_ID}, {"expires_at": {"$lt": now}}],
+                },
+                {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=EMAIL_SCHEDULER_LEASE_SECONDS)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except PyMongoError:
+            return False  # Duplicate key: another worker holds it
+        return bool(lease) and lease["owner"] == WORKER_ID
+
+    async def _renew_lease_periodically(self) -> None:
+        """Heartbeat while a batch is delivered; a lost lease stops the delivery."""
+        while True:
+            await asyncio.sleep(EMAIL_SCHEDULER_LEASE_SECONDS / 3)
+            if not await self._acquire_lease():
+                print(f"[Scheduler] {WORKER_ID} lost the scheduler lease, stopping delivery")
+                self.is_leader = False
+                self._loaded = False  # Another worker may have sent since; reload when regained
+                self._lease_lost.set()
+                return
+
+    async def _release_lease(self) -> None:
+        await get_database()[SCHEDULER_COLLECTION].update_one(
+            {"_id": LEASE_ID, "owner": WORKER_ID},
+            {"$set": {"owner": None, "expires_at": None}}
+        )
+        self.is_leader = False
+
+    async def _run(self) -> None:
+        lease_checked = 0.0
+        config_checked = 0.0
+        config: Optional[Dict[str, Any]] = None
+        while True:
+            try:
+                clock = time.monotonic()
+                woken = self._wake.is_set()
+                self._wake.clear()
+                if woken or clock - config_checked >= EMAIL_SCHEDULER_POLL_SECONDS:
+                    config = await get_scheduler_config()
+                    config_checked = clock
+                if not config or not config.get("enabled"):
+                    if self.is_leader:
+                        await self._release_lease()
+                    await self._sleep(EMAIL_SCHEDULER_POLL_SECONDS)
+                    continue
+
+                if clock - lease_checked >= EMAIL_SCHEDULER_LEASE_SECONDS / 3:
+                    was_leader = self.is_leader
+                    self.is_leader = await self._acquire_lease()
+                    lease_checked = clock
+                    if self.is_leader and not was_leader:
+                        print(f"[Scheduler] {WORKER_ID} is now sending scheduled emails")
+                if not self.is_leader:
+                    await self._sleep(EMAIL_SCHEDULER_LEASE_SECONDS / 3)
+                    continue
+
+                if not self._loaded:
+                    if self._feed_task is None or self._feed_task.done():
+                        self._feed_task = asyncio.create_task(self._follow_changes())
+                    await self.load()
+
+                now = datetime.utcnow()
+                due = self.pop_due(now, self.batch_size)
+                if due:
+                    self._lease_lost.clear()
+                    heartbeat = asyncio.create_task(self._renew_lease_periodically())
+                    try:
+                        await self._dispatch(due, config, await self._segment_query(config))
+                    finally:
+                        heartbeat.cancel()
+                    continue
+
+                # Sleep until the earliest lead is due, waking for config, lease and earlier leads
+                next_due = self.next_due()
+                wait = (next_due - now).total_seconds() if next_due else float("inf")
+                await self._sleep(min(wait, EMAIL_SCHEDULER_POLL_SECONDS, EMAIL_SCHEDULER_LEASE_SECONDS / 3))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Scheduler] Dispatch failed: {e}")
+                await self._sleep(EMAIL_SCHEDULER_POLL_SECONDS)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._feed_task):
+            if task and not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._task = self._feed_task = None
+        self._loaded = False
+        if self.is_leader:
+            await self._release_lease()
+
+    def get_stats(self) -> Dict[str, Any]:
+        next_due = self.next_due()
+        return {
+            **self.stats,
+            "running": self._task is not None and not self._task.done(),
+            "leader": self.is_leader,
+            "worker_id": WORKER_ID,
+            "feed": self.feed_mode,
+            "scheduled_leads": len(self._due),
+            "next_due_at": next_due.isoformat() if next_due else None,
+            "last_dispatch_at": self.stats["last_dispatch_at"].isoformat() if self.stats["last_dispatch_at"] else None,
+        }
+
+
+_scheduler: Optional[EmailScheduler] = None
+
+
+def get_email_scheduler() -> EmailScheduler:
+    """Get the process-wide scheduler."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = EmailScheduler()
+    return _scheduler
+
+
+def start_email_scheduler() -> None:
+    """Run the scheduler loop; it sends only while enabled in its configuration."""
+    get_email_scheduler().start()
+
+
+async def stop_email_scheduler() -> None:
+    if _scheduler is not None:
+        await _scheduler.stop()
+
+
+async def get_email_scheduler_status() -> Dict[str, Any]:
+    config = await get_scheduler_config()
+    if config and config.get("updated_at"):
+        config["updated_at"] = config["updated_at"].isoformat()
+    return {"config": config, "scheduler": get_email_scheduler().get_stats()}
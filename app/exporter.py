@@ -0,0 +1,166 @@
+"""
+Streaming Export for AI Marketing Agent.
+Streams leads, email history, generations and social posts straight from
+Motor cursors as NDJSON or CSV (optionally gzipped) in constant memory.
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Optional, List, Dict, Any
+
+from bson import ObjectId
+
+from app.database import get_analytics_database
+from app.archival import ARCHIVED_COLLECTIONS, iter_archived
+from app import content_store
+
+
+# Export name -> (collection, timestamp field, CSV columns)
+EXPORTS = {
+    "leads": ("leads", "created_at", [
+        "id", "name", "email", "company", "status", "score", "source",
+        "lastContact", "value", "last_emailed_at", "created_at"
+    ]),
+    "email-history": ("email_history", "sent_at", [
+        "id", "lead_id", "lead_email", "subject", "success", "message", "sent_at"
+    ]),
+    "generations": ("generations", "created_at", [
+        "id", "type", "business_name", "product_description", "target_audience",
+        "goal", "content", "image_url", "created_at"
+    ]),
+    "social-posts": ("social_posts", "created_at", [
+        "id", "business_name", "platform", "status", "content", "image_url",
+        "scheduled_for", "created_at"
+    ]),
+}
+
+# Collections exported in `_id` order: ObjectIds are created with the
+# document, so they sort like `created_at` without an index on it
+SORT_BY_ID = {"leads", "social_posts"}
+
+CURSOR_BATCH_SIZE = 1000
+UNPACK_BATCH_SIZE = 200
+OUTPUT_CHUNK_BYTES = 64 * 1024
+
+
+def _serialize(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a Mongo document to JSON-friendly values (`_id` becomes `id`)."""
+    row = {"id": str(document.pop("_id"))}
+    for key, value in document.items():
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, ObjectId):
+            value = str(value)
+        row[key] = value
+    return row
+
+
+async def iter_documents(
+    export_name: str,
+    query: Optional[Dict[str, Any]] = None,
+    limit: int = 0
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield serialized documents for an export, oldest first.
+
+    Archived email history and generations are included: their archived
+    documents (all older than the hot ones) are streamed first.
+
+    Generated content is decompressed in small batches so blob lookups
+    stay batched without buffering the whole collection.
+    """
+    collection_name, time_field, _ = EXPORTS[export_name]
+    db = get_analytics_database()
+    query = dict(query or {})
+    sort_field = time_field
+
+    if collection_name in SORT_BY_ID:
+        sort_field = "_id"
+        time_range = query.pop(time_field, None)
+        if time_range:
+            query["_id"] = {op: ObjectId.from_datetime(bound) for op, bound in time_range.items()}
+
+    if collection_name in ARCHIVED_COLLECTIONS:
+        async for document in iter_archived(collection_name, query, CURSOR_BATCH_SIZE):
+            yield _serialize(document)
+            limit -= 1
+            if limit == 0:
+                return
+
+    cursor = db[collection_name].find(query).sort(sort_field, 1).batch_size(CURSOR_BATCH_SIZE)
+    if limit > 0:
+        cursor = cursor.limit(limit)
+
+    batch: List[Dict[str, Any]] = []
+    async for document in cursor:
+        batch.append(document)
+        if len(batch) >= UNPACK_BATCH_SIZE:
+            await content_store.unpack_documents(db, collection_name, batch)
+            for doc in batch:
+                yield _serialize(doc)
+            batch = []
+
+    if batch:
+        await content_store.unpack_documents(db, collection_name, batch)
+        for doc in batch:
+            yield _serialize(doc)
+
+
+async def _encode_ndjson(rows: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    async for row in rows:
+        yield json.dumps(row, default=str, ensure_ascii=False) + "\n"
+
+
+async def _encode_csv(rows: AsyncIterator[Dict[str, Any]], columns: List[str]) -> AsyncIterator[str]:
+    """Encode rows as CSV; nested values (e.g. generation content) are JSON-encoded."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+
+    async for row in rows:
+        writer.writerow({
+            key: json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+            for key, value in row.items()
+        })
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+async def export_stream(
+    export_name: str,
+    file_format: str = "ndjson",
+    gzip: bool = False,
+    query: Optional[Dict[str, Any]] = None,
+    limit: int = 0
+) -> AsyncIterator[bytes]:
+    """
+    Stream an export as bytes.
+
+    Output is coalesced into ~64KB chunks, and gzip uses a streaming
+    compressor, so memory use does not depend on the export size.
+    """
+    _, _, columns = EXPORTS[export_name]
+    rows = iter_documents(export_name, query, limit)
+    lines = _encode_csv(rows, columns) if file_format == "csv" else _encode_ndjson(rows)
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    pending = bytearray()
+
+    async for text in lines:
+        pending += text.encode("utf-8")
+        if len(pending) >= OUTPUT_CHUNK_BYTES:
+            chunk = compressor.compress(bytes(pending)) if compressor else bytes(pending)
+            pending.clear()
+            if chunk:
+                yield chunk
+
+    tail = compressor.compress(bytes(pending)) + compressor.flush() if compressor else bytes(pending)
+    if tail:
+        yield tail
@@ -0,0 +1,126 @@
+"""
+Buffered Email History Writer for AI Marketing Agent.
+Accumulates email send results and flushes them to MongoDB as bulk writes
+on size or time thresholds, instead of two round trips per email.
+"""
+
+import asyncio
+import os
+from typing import Optional, List, Dict, Any
+
+from app.storage import build_email_history_document, save_email_history_bulk
+
+
+class EmailHistoryWriter:
+    """Buffers email history records and writes them in batches."""
+
+    def __init__(self, max_batch_size: int = 500, flush_interval: float = 2.0, max_buffer_size: int = 50000):
+        """
+        Args:
+            max_batch_size: Flush as soon as this many records are buffered
+            flush_interval: Seconds between background flushes
+            max_buffer_size: Records kept for retry after failed flushes before dropping
+        """
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer_size = max_buffer_size
+
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # Set by a failed flush: inline flushes wait until the background loop gets one through
+        self._failing = False
+
+        self.stats = {"buffered": 0, "written": 0, "flushes": 0, "failed_flushes": 0, "dropped": 0}
+
+    async def add(
+        self,
+        lead_id: str,
+        lead_email: str,
+        subject: str,
+        success: bool,
+        message: str = None
+    ) -> None:
+        """
+        Buffer one send result. Triggers a flush when the batch is full,
+        unless the last flush failed: then the background loop retries
+        every `flush_interval` instead of every send paying a failing write.
+        """
+        self._buffer.append(build_email_history_document(lead_id, lead_email, subject, success, message))
+        self.stats["buffered"] += 1
+
+        if len(self._buffer) >= self.max_batch_size and not self._failing:
+            await self.flush()
+
+    async def flush(self) -> int:
+        """
+        Write all buffered records. Returns the number written.
+
+        On failure the records are put back for the next flush, up to
+        `max_buffer_size`; anything beyond that is dropped and counted.
+        """
+        async with self._lock:
+            written = 0
+            while self._buffer:
+                batch = self._buffer[:self.max_batch_size]
+                del self._buffer[:self.max_batch_size]
+
+                try:
+                    await save_email_history_bulk(batch)
+                except Exception as e:
+                    self._failing = True
+                    self.stats["failed_flushes"] += 1
+                    self._buffer[:0] = batch
+                    overflow = len(self._buffer) - self.max_buffer_size
+                    if overflow > 0:
+                        del self._buffer[-overflow:]
+                        self.stats["dropped"] += overflow
+                    print(f"[HistoryWriter] Flush failed, {len(self._buffer)} records pending: {e}")
+                    break
+
+                self._failing = False
+                written += len(batch)
+                self.stats["written"] += len(batch)
+                self.stats["flushes"] += 1
+
+            return written
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._buffer:
+                await self.flush()
+
+    def start(self) -> None:
+        """Start the background flush loop (call from within the event loop)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background loop and flush whatever is left."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "pending": len(self._buffer), "failing": self._failing}
+
+
+# Singleton instance
+_writer_instance = None
+
+
+def get_history_writer() -> EmailHistoryWriter:
+    """Get or create the email history writer singleton."""
+    global _writer_instance
+    if _writer_instance is None:
+        _writer_instance = EmailHistoryWriter(
+            max_batch_size=int(os.getenv("EMAIL_HISTORY_BATCH_SIZE", "500")),
+            flush_interval=float(os.getenv("EMAIL_HISTORY_FLUSH_SECONDS", "2"))
+        )
+    return _writer_instance
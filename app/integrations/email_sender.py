@@ -1,66 +1,374 @@
 """
 Email sender integration using Gmail SMTP.
 Sends marketing emails autonomously.
+
+Connections are pooled: each one is opened, TLS-negotiated and logged in
+once, then reused for up to SMTP_MAX_MESSAGES_PER_CONNECTION messages.
+Connections idle for SMTP_NOOP_AFTER_SECONDS are checked with NOOP before
+reuse, and dead ones are replaced transparently.
+
+Recipients on the suppression list (app/suppression.py) are never sent to,
+and addresses the server permanently refuses are added to it as bounces.
 """
 
 import smtplib
 import os
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from typing import Optional, List, Dict, Any
 from dotenv import load_dotenv
 
+from app.tracking import tracking_enabled, tracked_html, record_sent
+from app.suppression import (
+    is_suppressed, suppressed_result, unsubscribe_link, get_suppression_list, suppression_ready, not_loaded_result
+)
+
 load_dotenv()
 
 
-def send_email(to: str, subject: str, body: str) -> dict:
+SMTP_HOST = os.getenv("SMTP_HOST") or "smtp.gmail.com"
+SMTP_PORT = int(os.getenv("SMTP_PORT") or "465")
+SMTP_SSL = (os.getenv("SMTP_SSL") or "true").lower() == "true"           # Implicit TLS (465)
+SMTP_STARTTLS = (os.getenv("SMTP_STARTTLS") or "true").lower() == "true"  # Upgrade plain connections (587)
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS") or "30")
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE") or "4")
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION") or "100")
+SMTP_NOOP_AFTER_SECONDS = float(os.getenv("SMTP_NOOP_AFTER_SECONDS") or "10")
+SMTP_MAX_IDLE_SECONDS = float(os.getenv("SMTP_MAX_IDLE_SECONDS") or "120")
+
+
+def build_message(
+    sender: str,
+    to: str,
+    subject: str,
+    body: str,
+    message_id: Optional[str] = None,
+    lead_id: Optional[str] = None,
+    campaign: Optional[str] = None
+) -> MIMEMultipart:
+    """
+    Build the multipart (plain text + HTML) message for a marketing email.
+
+    A fixed `message_id` makes a resent message recognisable as the same
+    one (see app/outbox.py). With tracking configured, emails to a lead get
+    tracked links and an open pixel in the HTML part (see app/tracking.py),
+    and every email gets a one-click unsubscribe link (RFC 8058).
+    """
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = subject
+    msg["From"] = sender
+    msg["To"] = to
+    if message_id:
+        msg["Message-ID"] = message_id
+    unsubscribe = unsubscribe_link(to)
+    if unsubscribe:
+        msg["List-Unsubscribe"] = f"<{unsubscribe}>"
+        msg["List-Unsubscribe-Post"] = "List-Unsubscribe=One-Click"
+
+    # Attach both plain text and HTML versions
+    msg.attach(MIMEText(body, "plain"))
+    if lead_id and tracking_enabled():
+        html = tracked_html(body, lead_id, campaign)
+    else:
+        html = f"<html><body><pre>{body}</pre></body></html>"
+    msg.attach(MIMEText(html, "html"))
+    return msg
+
+
+# ============================================
+# Connection Pool
+# ============================================
+
+class _PooledConnection:
+    """An authenticated SMTP connection and its usage counters."""
+
+    def __init__(self, server: smtplib.SMTP):
+        self.server = server
+        self.messages = 0
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class SMTPConnectionPool:
+    """Thread-safe pool of logged-in SMTP connections."""
+
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        host: str = SMTP_HOST,
+        port: int = SMTP_PORT,
+        use_ssl: bool = SMTP_SSL,
+        starttls: bool = SMTP_STARTTLS,
+        max_size: int = SMTP_POOL_SIZE,
+        max_messages: int = SMTP_MAX_MESSAGES_PER_CONNECTION
+    ):
+        """
+        Args:
+            username / password: SMTP login
+            host / port / use_ssl: Server (use_ssl: implicit TLS)
+            starttls: Upgrade plain (non-SSL) connections with STARTTLS
+            max_size: Maximum open connections
+            max_messages: Messages per connection before it is recycled
+        """
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.starttls = starttls
+        self.max_size = max_size
+        self.max_messages = max_messages
+
+        self._idle: List[_PooledConnection] = []
+        self._open = 0
+        self._condition = threading.Condition()
+
+        self.stats = {
+            "connections_opened": 0, "connections_reused": 0, "connect_failures": 0,
+            "closed_message_limit": 0, "closed_idle": 0, "closed_dead": 0, "closed_error": 0,
+            "noop_checks": 0, "messages_sent": 0, "send_failures": 0, "retries": 0,
+            "connect_ms_total": 0.0, "send_ms_total": 0.0,
+        }
+
+    def _connect(self) -> _PooledConnection:
+        started = time.perf_counter()
+        try:
+            if self.use_ssl:
+                server = smtplib.SMTP_SSL(self.host, self.port, timeout=SMTP_TIMEOUT_SECONDS)
+            else:
+                server = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT_SECONDS)
+                if self.starttls:
+                    server.starttls()
+            try:
+                server.login(self.username, self.password)
+            except Exception:
+                server.close()
+                raise
+        except Exception:
+            self.stats["connect_failures"] += 1
+            raise
+        self.stats["connections_opened"] += 1
+        self.stats["connect_ms_total"] += (time.perf_counter() - started) * 1000
+        return _PooledConnection(server)
+
+    def _close(self, connection: _PooledConnection, reason: str) -> None:
+        self.stats[f"closed_{reason}"] += 1
+        try:
+            if reason in ("dead", "error"):
+                connection.server.close()
+            else:
+                connection.server.quit()
+        except Exception:
+            connection.server.close()
+
+    def _is_alive(self, connection: _PooledConnection) -> bool:
+        self.stats["noop_checks"] += 1
+        try:
+            return connection.server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _discard(self, connection: _PooledConnection, reason: str) -> None:
+        """Drop a connection from the pool and close it (outside the lock)."""
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+        self._close(connection, reason)
+
+    def acquire(self) -> _PooledConnection:
+        """
+        Get a healthy connection, reusing the most recently used idle one.
+
+        Blocks while `max_size` connections are in use. Network calls
+        (connect, NOOP, QUIT) happen outside the lock.
+        """
+        while True:
+            with self._condition:
+                while not self._idle and self._open >= self.max_size:
+                    self._condition.wait()
+                connection = self._idle.pop() if self._idle else None
+                if connection is None:
+                    self._open += 1
+
+            if connection is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._condition:
+                        self._open -= 1
+                        self._condition.notify()
+                    raise
+
+            idle_for = time.monotonic() - connection.last_used
+            if idle_for > SMTP_MAX_IDLE_SECONDS:
+                self._discard(connection, "idle")
+            elif idle_for > SMTP_NOOP_AFTER_SECONDS and not self._is_alive(connection):
+                self._discard(connection, "dead")
+            else:
+                self.stats["connections_reused"] += 1
+                return connection
+
+    def release(self, connection: _PooledConnection, broken: bool = False) -> None:
+        """Return a connection, closing it if broken or at its message limit."""
+        if broken:
+            self._discard(connection, "error")
+        elif connection.messages >= self.max_messages:
+            self._discard(connection, "message_limit")
+        else:
+            with self._condition:
+                connection.last_used = time.monotonic()
+                self._idle.append(connection)
+                self._condition.notify()
+
+    def send(self, sender: str, to: str, message: str) -> None:
+        """
+        Send one message on a pooled connection.
+
+        If the server dropped the connection before accepting the message,
+        it is retried once on a fresh connection; other errors are raised.
+        Socket errors and timeouts are not retried, since the server may
+        already have accepted the message.
+        """
+        for attempt in range(2):
+            connection = self.acquire()
+            started = time.perf_counter()
+            try:
+                connection.server.sendmail(sender, to, message)
+            except smtplib.SMTPServerDisconnected:
+                self.release(connection, broken=True)
+                if attempt == 0:
+                    self.stats["retries"] += 1
+                    continue
+                self.stats["send_failures"] += 1
+                raise
+            except smtplib.SMTPException:
+                # Recipient/message errors leave the connection usable, once the transaction is reset
+                try:
+                    connection.server.rset()
+                    self.release(connection)
+                except Exception:
+                    self.release(connection, broken=True)
+                self.stats["send_failures"] += 1
+                raise
+            except OSError:
+                # Socket errors and timeouts: the connection is gone, the message may be too
+                self.release(connection, broken=True)
+                self.stats["send_failures"] += 1
+                raise
+            connection.messages += 1
+            self.stats["messages_sent"] += 1
+            self.stats["send_ms_total"] += (time.perf_counter() - started) * 1000
+            self.release(connection)
+            return
+
+    def close_all(self) -> None:
+        """Close all idle connections (on shutdown or credential change)."""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._condition.notify_all()
+        for connection in idle:
+            self._close(connection, "idle")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Pool metrics: counters plus current size and average timings."""
+        with self._condition:
+            stats = dict(self.stats)
+            stats["open"] = self._open
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._open - len(self._idle)
+        opened = stats.pop("connect_ms_total")
+        sent = stats.pop("send_ms_total")
+        stats["avg_connect_ms"] = round(opened / stats["connections_opened"], 1) if stats["connections_opened"] else None
+        stats["avg_send_ms"] = round(sent / stats["messages_sent"], 1) if stats["messages_sent"] else None
+        stats["config"] = {
+            "host": self.host, "port": self.port, "ssl": self.use_ssl,
+            "max_size": self.max_size, "max_messages_per_connection": self.max_messages,
+        }
+        return stats
+
+
+_pool: Optional[SMTPConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_smtp_pool(username: str, password: str) -> SMTPConnectionPool:
+    """Get the shared pool, recreating it if the credentials changed."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or (_pool.username, _pool.password) != (username, password):
+            if _pool is not None:
+                _pool.close_all()
+            _pool = SMTPConnectionPool(username, password)
+        return _pool
+
+
+def get_smtp_pool_stats() -> Optional[Dict[str, Any]]:
+    """Metrics of the shared pool, or None before the first send."""
+    return _pool.get_stats() if _pool else None
+
+
+def close_smtp_pool() -> None:
+    if _pool is not None:
+        _pool.close_all()
+
+
+def send_email(to: str, subject: str, body: str, lead_id: Optional[str] = None, campaign: Optional[str] = None) -> dict:
     """
-    Send an email using Gmail SMTP.
-    
+    Send an email over a pooled Gmail SMTP connection.
+
     Args:
         to: Recipient email address
         subject: Email subject line
         body: Email body content (can be HTML)
-        
+        lead_id / campaign: Lead and campaign, for open/click tracking
+
     Returns:
-        dict with success status and message
+        dict with success status and message (and suppressed=True when the
+        recipient is on the suppression list)
     """
+    if not suppression_ready():
+        return not_loaded_result()
+    if is_suppressed(to):
+        return suppressed_result(to)
+
     gmail_address = os.getenv("GMAIL_ADDRESS")
     gmail_app_password = os.getenv("GMAIL_APP_PASSWORD")
-    
+
     if not gmail_address or not gmail_app_password:
         return {
             "success": False,
             "message": "Gmail credentials not configured. Set GMAIL_ADDRESS and GMAIL_APP_PASSWORD in .env"
         }
-    
+
     try:
-        # Create message
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = subject
-        msg["From"] = gmail_address
-        msg["To"] = to
-        
-        # Attach both plain text and HTML versions
-        text_part = MIMEText(body, "plain")
-        html_part = MIMEText(f"<html><body><pre>{body}</pre></body></html>", "html")
-        msg.attach(text_part)
-        msg.attach(html_part)
-        
-        # Send via Gmail SMTP
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(gmail_address, gmail_app_password)
-            server.sendmail(gmail_address, to, msg.as_string())
-        
+        msg = build_message(gmail_address, to, subject, body, lead_id=lead_id, campaign=campaign)
+        get_smtp_pool(gmail_address, gmail_app_password).send(gmail_address, to, msg.as_string())
+        record_sent(lead_id, campaign)
+
         return {
             "success": True,
             "message": f"Email sent successfully to {to}"
         }
-        
+
     except smtplib.SMTPAuthenticationError:
         return {
             "success": False,
             "message": "Gmail authentication failed. Check your app password."
         }
+    except smtplib.SMTPRecipientsRefused as e:
+        # 5xx: the mailbox does not exist or refuses mail, a hard bounce
+        bounced = any(code >= 500 for code, _ in e.recipients.values())
+        if bounced:
+            get_suppression_list().suppress_later(to, "bounce", "smtp")
+        return {
+            "success": False,
+            "bounced": bounced,
+            "message": f"Failed to send email: {str(e)}"
+        }
     except Exception as e:
         return {
             "success": False,
@@ -9,6 +9,28 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def _may_have_been_sent(error: Exception) -> bool:
+    """
+    Whether a failed Twilio call may still have created the message.
+    
+    Only errors raised before the request reached Twilio (connect failures)
+    or explicit 4xx rejections are known not to have sent anything.
+    """
+    try:
+        from requests.exceptions import ConnectionError as RequestsConnectionError, RequestException
+        from twilio.base.exceptions import TwilioRestException
+        from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+    except ImportError:
+        return False
+    
+    if isinstance(error, TwilioRestException):
+        return (error.status or 500) >= 500
+    if isinstance(error, RequestsConnectionError):
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return not isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+    return isinstance(error, RequestException)
+
+
 def send_whatsapp(to: str, message: str) -> dict:
     """
     Send a WhatsApp message using Twilio.
@@ -18,8 +40,17 @@ def send_whatsapp(to: str, message: str) -> dict:
         message: Message content to send
         
     Returns:
-        dict with success status and message
+        dict with success status and message (and suppressed=True when the
+        number is on the suppression list, uncertain=True when the send
+        failed in a way that may still have delivered it, e.g. a read timeout)
     """
+    from app.suppression import is_suppressed, suppressed_result, suppression_ready, not_loaded_result
+    
+    if not suppression_ready():
+        return not_loaded_result()
+    if is_suppressed(to):
+        return suppressed_result(to)
+    
     account_sid = os.getenv("TWILIO_ACCOUNT_SID")
     auth_token = os.getenv("TWILIO_AUTH_TOKEN")
     from_number = os.getenv("TWILIO_WHATSAPP_FROM")
@@ -60,5 +91,6 @@ def send_whatsapp(to: str, message: str) -> dict:
     except Exception as e:
         return {
             "success": False,
+            "uncertain": _may_have_been_sent(e),
             "message": f"Failed to send WhatsApp message: {str(e)}"
         }
@@ -0,0 +1,469 @@
+"""
+Lead Deduplication for AI Marketing Agent.
+Finds leads that are the same person under different spellings or email
+variants, both while importing and as a batch job over existing leads.
+Imports only merge on the same canonical email; fuzzy matches are reported
+there and merged by the batch job.
+
+- Normalization: canonical emails (case, gmail dots, +tags, googlemail),
+  company names without punctuation or legal suffixes, and names
+- Blocking: each lead gets a few hashed `dedupe_keys` (canonical email,
+  company + name initial, corporate domain + name initial), stored on the
+  lead with a multikey index, so candidates are found by key lookup
+- Scoring: difflib similarity of name, company and email local part,
+  computed only between leads that share a block
+"""
+
+import hashlib
+import os
+import re
+import unicodedata
+from datetime import datetime
+from difflib import SequenceMatcher
+from typing import Optional, List, Dict, Any, Tuple
+
+from pymongo import UpdateOne, UpdateMany
+
+
+DEDUPE_THRESHOLD = float(os.getenv("DEDUPE_THRESHOLD") or "0.88")
+DEDUPE_MAX_BLOCK_SIZE = int(os.getenv("DEDUPE_MAX_BLOCK_SIZE") or "500")
+
+FREE_EMAIL_DOMAINS = {
+    "gmail.com", "googlemail.com", "yahoo.com", "outlook.com", "hotmail.com", "live.com",
+    "msn.com", "icloud.com", "me.com", "aol.com", "proton.me", "protonmail.com",
+    "fastmail.com", "gmx.com", "yandex.com", "zoho.com", "mail.com", "rediffmail.com",
+}
+DOMAIN_ALIASES = {"googlemail.com": "gmail.com"}
+DOT_INSENSITIVE_DOMAINS = {"gmail.com"}
+# Providers where local+tag@domain delivers to local@domain
+PLUS_TAG_DOMAINS = {
+    "gmail.com", "outlook.com", "hotmail.com", "live.com", "icloud.com", "me.com",
+    "proton.me", "protonmail.com", "fastmail.com",
+}
+
+COMPANY_SUFFIXES = {
+    "inc", "incorporated", "llc", "llp", "ltd", "limited", "corp", "corporation", "co",
+    "company", "plc", "gmbh", "ag", "sa", "bv", "pvt", "pty", "private", "group", "holdings",
+}
+
+_NON_WORD_RE = re.compile(r"[^\w\s]", re.UNICODE)
+
+# Fields needed to profile existing leads during import
+_PROFILE_FIELDS = {"name": 1, "email": 1, "company": 1, "email_normalized": 1, "alternate_emails": 1}
+# Fields the batch merge job matches on (full documents are fetched only for merged clusters)
+_MATCH_FIELDS = {"name": 1, "email": 1, "company": 1, "dedupe_keys": 1}
+# Oversized blocks listed in the merge job result
+MAX_REPORTED_BLOCKS = 20
+
+
+# ============================================
+# Normalization & Blocking
+# ============================================
+
+def _fold(text: Optional[str]) -> str:
+    """Lowercase, strip accents and punctuation, collapse whitespace."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return " ".join(_NON_WORD_RE.sub(" ", text).split())
+
+
+def canonical_email(email: Optional[str]) -> str:
+    """Canonical form of an email, e.g. "John.Doe+news@GoogleMail.com" -> "johndoe@gmail.com"."""
+    email = (email or "").strip().lower()
+    if "@" not in email:
+        return email
+    local, domain = email.rsplit("@", 1)
+    domain = DOMAIN_ALIASES.get(domain, domain)
+    if domain in PLUS_TAG_DOMAINS:
+        local = local.split("+", 1)[0]
+    if domain in DOT_INSENSITIVE_DOMAINS:
+        local = local.replace(".", "")
+    return f"{local}@{domain}"
+
+
+def normalize_company(company: Optional[str]) -> str:
+    """"Acme, Inc." and "ACME Incorporated" both become "acme"."""
+    tokens = _fold(company).split()
+    while len(tokens) > 1 and tokens[-1] in COMPANY_SUFFIXES:
+        tokens.pop()
+    return " ".join(tokens)
+
+
+def normalize_name(name: Optional[str]) -> str:
+    return _fold(name)
+
+
+def profile(lead: Dict[str, Any]) -> Dict[str, str]:
+    """Normalized fields used for blocking and scoring."""
+    email = canonical_email(lead.get("email"))
+    local, _, domain = email.partition("@")
+    return {
+        "email": email,
+        "local": local,
+        "domain": domain,
+        "name": normalize_name(lead.get("name")),
+        "company": normalize_company(lead.get("company")),
+    }
+
+
+def _hash_key(kind: str, value: str) -> str:
+    return f"{kind}:{hashlib.blake2b(value.encode('utf-8'), digest_size=8).hexdigest()}"
+
+
+def blocking_keys(p: Dict[str, str]) -> List[str]:
+    """Hashed blocking keys for a profile. Leads can only match if they share one."""
+    keys = []
+    if p["email"]:
+        keys.append(_hash_key("e", p["email"]))
+    initial = p["name"][:1]
+    if p["company"] and initial:
+        keys.append(_hash_key("c", f"{p['company']}|{initial}"))
+    if p["domain"] and p["domain"] not in FREE_EMAIL_DOMAINS and initial:
+        keys.append(_hash_key("d", f"{p['domain']}|{initial}"))
+    return keys
+
+
+def lead_keys(lead: Dict[str, Any]) -> List[str]:
+    """Blocking keys for a lead document (stored as `dedupe_keys`)."""
+    return blocking_keys(profile(lead))
+
+
+def match_score(a: Dict[str, str], b: Dict[str, str]) -> float:
+    """
+    Similarity of two profiles in [0, 1].
+
+    The same canonical email is a certain match; otherwise names must be
+    close, and company and email local part add evidence.
+    """
+    if a["email"] and a["email"] == b["email"]:
+        return 1.0
+    if not a["name"] or not b["name"]:
+        return 0.0
+
+    name = SequenceMatcher(None, a["name"], b["name"]).ratio()
+    if name < 0.8:
+        return 0.0
+    company = SequenceMatcher(None, a["company"], b["company"]).ratio() if a["company"] and b["company"] else 0.5
+    local = SequenceMatcher(None, a["local"], b["local"]).ratio() if a["local"] and b["local"] else 0.5
+    same_domain = 1.0 if a["domain"] and a["domain"] == b["domain"] and a["domain"] not in FREE_EMAIL_DOMAINS else 0.0
+
+    return 0.5 * name + 0.25 * company + 0.15 * local + 0.1 * same_domain
+
+
+# ============================================
+# Import-Time Resolution
+# ============================================
+
+async def resolve_duplicates(
+    leads: List[Dict[str, Any]],
+    check_existing: bool = True,
+    threshold: float = DEDUPE_THRESHOLD
+) -> Dict[str, int]:
+    """
+    Point import rows at the lead they duplicate, in place.
+
+    Only a row with the same canonical email as an existing lead (or an
+    earlier row of the same batch), e.g. a gmail dot or +tag variant, is
+    merged: it gets `_merge_key` set to that lead's normalized email;
+    `upsert_leads` then updates that lead instead of inserting a new one,
+    and records the row's email in the lead's `alternate_emails`.
+
+    Fuzzy matches (similar name and company, different email) are often
+    different people at the same company, so they are imported as their
+    own leads and only reported in `possible_duplicates` for review (the
+    batch job, POST /admin/leads/dedupe, can merge them after a dry run).
+
+    Existing candidates are fetched with one query per batch on the
+    `dedupe_keys` index.
+
+    Returns counts of rows merged into existing leads and within the batch,
+    and the possible duplicates (row index, email, matched lead's email, score).
+    """
+    from app.database import normalize_email
+
+    profiles = [profile(lead) for lead in leads]
+    keys = [blocking_keys(p) for p in profiles]
+
+    # Candidate pool: blocking key -> [(profile, normalized email of the lead it resolves to)]
+    pool: Dict[str, List[Tuple[Dict[str, str], str]]] = {}
+    alternates: Dict[str, set] = {}
+
+    if check_existing:
+        from app.database import get_database
+        all_keys = list({key for row_keys in keys for key in row_keys})
+        if all_keys:
+            cursor = get_database().leads.find({"dedupe_keys": {"$in": all_keys}}, _PROFILE_FIELDS)
+            async for existing in cursor:
+                target = existing.get("email_normalized") or normalize_email(existing.get("email"))
+                alternates[target] = set(existing.get("alternate_emails") or [])
+                existing_profile = profile(existing)
+                for key in blocking_keys(existing_profile):
+                    pool.setdefault(key, []).append((existing_profile, target))
+
+    stats: Dict[str, Any] = {"matched_existing": 0, "matched_in_batch": 0, "possible_duplicates": []}
+    existing_targets = set(alternates)
+
+    for index, (lead, p, row_keys) in enumerate(zip(leads, profiles, keys)):
+        own_key = normalize_email(lead.get("email"))
+        if not own_key:
+            continue
+
+        best_target, best_score = None, 0.0
+        for key in row_keys:
+            for candidate, target in pool.get(key, ()):
+                if target == own_key:
+                    best_target, best_score = None, 1.0  # Same lead by email; plain upsert
+                    break
+                score = match_score(p, candidate)
+                if score > best_score:
+                    best_target, best_score = target, score
+            if best_score >= 1.0:
+                break
+
+        if best_target and best_score >= 1.0:
+            lead["_merge_key"] = best_target
+            emails = alternates.setdefault(best_target, set())
+            emails.add(lead["email"].strip())
+            lead["alternate_emails"] = sorted(emails)
+            stats["matched_existing" if best_target in existing_targets else "matched_in_batch"] += 1
+            target = best_target
+        else:
+            if best_target and best_score >= threshold:
+                stats["possible_duplicates"].append({
+                    "index": index, "email": lead["email"], "matches": best_target, "score": round(best_score, 3)
+                })
+            target = own_key
+
+        # Later rows can match this one
+        for key in row_keys:
+            pool.setdefault(key, []).append((p, target))
+
+    return stats
+
+
+# ============================================
+# Batch Merge Job
+# ============================================
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, a: int, b: int) -> None:
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def _merge_cluster(members: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Pick the survivor (oldest lead) and compute its merged fields.
+
+    Returns (survivor, fields to $set on it).
+    """
+    members = sorted(members, key=lambda lead: lead.get("created_at") or datetime.max)
+    survivor = members[0]
+    updates: Dict[str, Any] = {}
+
+    for other in members[1:]:
+        for field, value in other.items():
+            if field.startswith("_") or field in ("email", "email_normalized", "alternate_emails", "dedupe_keys"):
+                continue
+            if survivor.get(field) in (None, "") and value not in (None, "") and field not in updates:
+                updates[field] = value
+
+    for field in ("value", "score", "last_emailed_at"):
+        values = [m.get(field) for m in members if m.get(field) is not None]
+        if values and max(values) != survivor.get(field):
+            updates[field] = max(values)
+
+    # Send counters follow the history, which is repointed to the survivor
+    for field in ("emails_sent", "emails_failed"):
+        total = sum(m.get(field) or 0 for m in members)
+        if total != (survivor.get(field) or 0):
+            updates[field] = total
+
+    emails = set(survivor.get("alternate_emails") or [])
+    for other in members[1:]:
+        emails.update(other.get("alternate_emails") or [])
+        if other.get("email"):
+            emails.add(other["email"])
+    emails.discard(survivor.get("email"))
+    updates["alternate_emails"] = sorted(emails)
+    updates["updated_at"] = datetime.utcnow()
+
+    return survivor, updates
+
+
+async def merge_duplicate_leads(
+    dry_run: bool = True,
+    threshold: float = DEDUPE_THRESHOLD,
+    batch_size: int = 5000
+) -> Dict[str, Any]:
+    """
+    Find and merge duplicate leads across the whole `leads` collection.
+
+    Each cluster of duplicates collapses into its oldest lead: missing
+    fields are filled from the others, value/score/last_emailed_at take
+    the maximum, send counters are summed, other emails become
+    `alternate_emails`, email history (hot and archived) is repointed to
+    the survivor, and rollup counters are adjusted. Also (re)writes
+    `dedupe_keys` for every lead, which import-time resolution relies on.
+
+    Only the fields matched on are loaded for the whole collection; full
+    documents are fetched for the clusters being merged. Blocks larger than
+    DEDUPE_MAX_BLOCK_SIZE are not compared and are listed in
+    `oversized_blocks` (size and sample leads) for manual review.
+
+    Returns counts, plus sample clusters when dry_run is set.
+    """
+    from app.database import get_database
+    from app.archival import reassign_archived
+    from app import rollups
+
+    db = get_database()
+    leads: List[Dict[str, Any]] = []
+    cursor = db.leads.find({}, _MATCH_FIELDS).batch_size(batch_size)
+    while True:
+        batch = await cursor.to_list(batch_size)
+        if not batch:
+            break
+        leads.extend(batch)
+
+    profiles = [profile(lead) for lead in leads]
+    keys = [blocking_keys(p) for p in profiles]
+
+    blocks: Dict[str, List[int]] = {}
+    for index, row_keys in enumerate(keys):
+        for key in row_keys:
+            blocks.setdefault(key, []).append(index)
+
+    union = _UnionFind(len(leads))
+    compared = set()
+    oversized: List[Dict[str, Any]] = []
+    for key, members in blocks.items():
+        if len(members) < 2:
+            continue
+        if len(members) > DEDUPE_MAX_BLOCK_SIZE:
+            oversized.append({
+                "key": key,
+                "size": len(members),
+                "sample": [_summary(leads[i]) for i in members[:5]],
+            })
+            continue
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                if (a, b) in compared or union.find(a) == union.find(b):
+                    continue
+                compared.add((a, b))
+                if match_score(profiles[a], profiles[b]) >= threshold:
+                    union.union(a, b)
+
+    clusters: Dict[int, List[int]] = {}
+    for index in range(len(leads)):
+        clusters.setdefault(union.find(index), []).append(index)
+    clusters = {root: members for root, members in clusters.items() if len(members) > 1}
+
+    result: Dict[str, Any] = {
+        "leads": len(leads),
+        "blocks": len(blocks),
+        "oversized_blocks_skipped": len(oversized),
+        "oversized_blocks": sorted(oversized, key=lambda block: -block["size"])[:MAX_REPORTED_BLOCKS],
+        "comparisons": len(compared),
+        "clusters": len(clusters),
+        "duplicates": sum(len(members) - 1 for members in clusters.values()),
+        "dry_run": dry_run,
+    }
+
+    if oversized:
+        print(f"[Dedupe] Skipped {len(oversized)} blocks larger than {DEDUPE_MAX_BLOCK_SIZE} leads")
+
+    if dry_run:
+        result["sample_clusters"] = [
+            [_summary(leads[i]) for i in members]
+            for members in list(clusters.values())[:20]
+        ]
+        return result
+
+    # Full documents, only for the leads being merged
+    merged_ids = [leads[i]["_id"] for members in clusters.values() for i in members]
+    full: Dict[Any, Dict[str, Any]] = {}
+    for start in range(0, len(merged_ids), batch_size):
+        async for document in db.leads.find({"_id": {"$in": merged_ids[start:start + batch_size]}}):
+            full[document["_id"]] = document
+    clusters = {
+        root: [i for i in members if leads[i]["_id"] in full]
+        for root, members in clusters.items()
+    }
+    clusters = {root: members for root, members in clusters.items() if len(members) > 1}
+
+    survivor_updates = []
+    merged_survivors: Dict[Any, Dict[str, Any]] = {}
+    history_updates = []
+    reassigned: Dict[str, str] = {}
+    duplicate_ids = []
+    deltas: Dict[Any, Dict[str, int]] = {}
+
+    for members in clusters.values():
+        survivor, updates = _merge_cluster([full[leads[i]["_id"]] for i in members])
+        duplicates = [full[leads[i]["_id"]] for i in members if leads[i]["_id"] != survivor["_id"]]
+        survivor_updates.append(UpdateOne({"_id": survivor["_id"]}, {"$set": updates}))
+        merged_survivors[survivor["_id"]] = {**survivor, **updates}
+        history_updates.append(UpdateMany(
+            {"lead_id": {"$in": [str(d["_id"]) for d in duplicates]}},
+            {"$set": {"lead_id": str(survivor["_id"])}}
+        ))
+        reassigned.update({str(d["_id"]): str(survivor["_id"]) for d in duplicates})
+        duplicate_ids.extend(d["_id"] for d in duplicates)
+
+        rollups.collect_increments(deltas, "leads", survivor, sign=-1)
+        rollups.collect_increments(deltas, "leads", {**survivor, **updates})
+        for duplicate in duplicates:
+            rollups.collect_increments(deltas, "leads", duplicate, sign=-1)
+
+    # Update survivors and repoint hot and archived history first, delete
+    # duplicates last: a failure part-way leaves the duplicates in place
+    # rather than losing merged fields or leaving history on deleted leads
+    repointed = 0
+    await _bulk(db.leads, survivor_updates, 1000)
+    repointed += await _bulk(db.email_history, history_updates, 1000)
+    # Archived history keeps lead_id on the locator and inside the compressed document
+    repointed += await reassign_archived("email_history", "lead_id", reassigned)
+    for start in range(0, len(duplicate_ids), 1000):
+        await db.leads.delete_many({"_id": {"$in": duplicate_ids[start:start + 1000]}})
+    await rollups.apply_increments(db, deltas)
+
+    # Refresh blocking keys for every remaining lead
+    removed = set(duplicate_ids)
+    key_updates = []
+    for lead, row_keys in zip(leads, keys):
+        if lead["_id"] in removed:
+            continue
+        if lead["_id"] in merged_survivors:
+            row_keys = lead_keys(merged_survivors[lead["_id"]])
+        if lead.get("dedupe_keys") != row_keys:
+            key_updates.append(UpdateOne({"_id": lead["_id"]}, {"$set": {"dedupe_keys": row_keys}}))
+    await _bulk(db.leads, key_updates, batch_size)
+
+    result.update({"history_repointed": repointed, "keys_updated": len(key_updates)})
+    print(f"[Dedupe] Merged {result['duplicates']} duplicate leads into {result['clusters']} leads")
+    return result
+
+
+def _summary(lead: Dict[str, Any]) -> Dict[str, Any]:
+    return {"id": str(lead["_id"]), "name": lead.get("name"), "email": lead.get("email"), "company": lead.get("company")}
+
+
+async def _bulk(collection, operations: List[Any], chunk_size: int) -> int:
+    """Run operations in unordered chunks. Returns the number of modified documents."""
+    modified = 0
+    for start in range(0, len(operations), chunk_size):
+        result = await collection.bulk_write(operations[start:start + chunk_size], ordered=False)
+        modified += result.modified_count
+    return modified
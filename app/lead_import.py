@@ -0,0 +1,227 @@
+"""
+Streaming Lead Import for AI Marketing Agent.
+Parses CSV or NDJSON uploads incrementally and upserts leads in fixed-size
+chunks, so imports of 100k+ rows never hold the whole file in memory.
+
+The request body is spooled (in memory up to IMPORT_SPOOL_MAX_MEMORY bytes,
+then to a temp file) before the streamed response starts: once a
+StreamingResponse is running, the server consumes the remaining request
+messages, so the body cannot be read from inside it.
+"""
+
+import asyncio
+import codecs
+import csv
+import json
+import os
+import tempfile
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple, IO
+from pydantic import ValidationError
+
+from app.schemas import LeadCreate
+
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_MAX_ERRORS = 1000
+IMPORT_SPOOL_MAX_MEMORY = int(os.getenv("IMPORT_SPOOL_MAX_MEMORY") or str(8 * 1024 * 1024))
+SPOOL_READ_SIZE = 64 * 1024
+
+# Row tuple: (row number, parsed fields or None, error message or None)
+Row = Tuple[int, Optional[Dict[str, Any]], Optional[str]]
+
+
+async def spool_body(byte_stream: AsyncIterator[bytes]) -> IO[bytes]:
+    """Read a whole request body into a spooled temp file, rewound for reading."""
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_MAX_MEMORY)
+    try:
+        async for chunk in byte_stream:
+            if chunk:
+                await asyncio.to_thread(spool.write, chunk)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+async def iter_spooled(spool: IO[bytes]) -> AsyncIterator[bytes]:
+    """Read a spooled body back in chunks, closing it at the end."""
+    try:
+        while True:
+            chunk = await asyncio.to_thread(spool.read, SPOOL_READ_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        spool.close()
+
+
+async def iter_lines(byte_stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream as UTF-8 and yield complete lines (without newlines)."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+
+    async for chunk in byte_stream:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[Row]:
+    """
+    Parse CSV records from a line stream. The first record is the header.
+
+    Quoted fields may span lines: lines are joined until the quotes balance.
+    """
+    header: Optional[List[str]] = None
+    record = ""
+    row_number = 0
+
+    async for line in lines:
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2:
+            continue  # Inside a quoted field, keep reading
+
+        text, record = record, ""
+        if not text.strip():
+            continue
+
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [h.strip() for h in values]
+            continue
+
+        row_number += 1
+        if len(values) > len(header):
+            yield row_number, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+
+        yield row_number, dict(zip(header, values)), None
+
+    if record.strip():
+        yield row_number + 1, None, "Unterminated quoted field at end of file"
+
+
+async def iter_ndjson_rows(lines: AsyncIterator[str]) -> AsyncIterator[Row]:
+    """Parse one JSON object per line."""
+    row_number = 0
+
+    async for line in lines:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            value = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, None, f"Invalid JSON: {e.msg}"
+            continue
+        if not isinstance(value, dict):
+            yield row_number, None, "Expected a JSON object"
+            continue
+        yield row_number, value, None
+
+
+def validate_lead(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate a raw row against LeadCreate.
+
+    Empty strings are treated as missing (CSV exports often have blank
+    score/value/status cells). Only supplied fields are returned, so
+    re-importing a file never resets fields it lacks on existing leads.
+    """
+    cleaned = {
+        k.strip(): v.strip() if isinstance(v, str) else v
+        for k, v in fields.items()
+        if k and v not in ("", None)
+    }
+    return LeadCreate(**cleaned).model_dump(exclude_unset=True)
+
+
+def _format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in error.errors()
+    )
+
+
+async def import_leads_stream(
+    byte_stream: AsyncIterator[bytes],
+    file_format: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_errors: int = DEFAULT_MAX_ERRORS
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Import leads from a streamed CSV/NDJSON body.
+
+    Yields events as the import progresses:
+    - {"event": "error", "row": n, "error": "..."} per rejected row (up to max_errors)
+    - {"event": "possible_duplicate", "row": n, "email": ..., "matches": ..., "score": ...}
+      per row imported as a new lead that fuzzy-matches another (up to max_errors)
+    - {"event": "progress", ...counters} after each chunk is written
+    - {"event": "done", ...counters} at the end
+    """
+    from app.storage import upsert_leads, is_mongo
+    from app.lead_dedupe import resolve_duplicates
+
+    lines = iter_lines(byte_stream)
+    rows = iter_csv_rows(lines) if file_format == "csv" else iter_ndjson_rows(lines)
+
+    counters = {"rows": 0, "inserted": 0, "updated": 0, "duplicates": 0, "possible_duplicates": 0, "failed": 0}
+    chunk: List[Dict[str, Any]] = []
+    chunk_rows: List[int] = []
+
+    def error_event(row_number: int, message: str) -> Optional[Dict[str, Any]]:
+        counters["failed"] += 1
+        if counters["failed"] <= max_errors:
+            return {"event": "error", "row": row_number, "error": message}
+        return None
+
+    async def flush():
+        # Rows with an existing lead's canonical email (or an earlier row's) update it instead
+        matches = await resolve_duplicates(chunk, check_existing=is_mongo())
+        counters["duplicates"] += matches["matched_existing"] + matches["matched_in_batch"]
+        events = []
+        for match in matches["possible_duplicates"]:
+            counters["possible_duplicates"] += 1
+            if counters["possible_duplicates"] <= max_errors:
+                events.append({
+                    "event": "possible_duplicate", "row": chunk_rows[match["index"]],
+                    "email": match["email"], "matches": match["matches"], "score": match["score"]
+                })
+        result = await upsert_leads(chunk)
+        counters["inserted"] += result["inserted"]
+        counters["updated"] += result["updated"]
+        events += [error_event(chunk_rows[e["index"]], e["error"]) for e in result["errors"]]
+        chunk.clear()
+        chunk_rows.clear()
+        return [e for e in events if e]
+
+    async for row_number, fields, error in rows:
+        counters["rows"] += 1
+
+        if error is None:
+            try:
+                chunk.append(validate_lead(fields))
+                chunk_rows.append(row_number)
+            except ValidationError as e:
+                error = _format_validation_error(e)
+
+        if error is not None:
+            event = error_event(row_number, error)
+            if event:
+                yield event
+
+        if len(chunk) >= chunk_size:
+            for event in await flush():
+                yield event
+            yield {"event": "progress", **counters}
+
+    if chunk:
+        for event in await flush():
+            yield event
+
+    yield {"event": "done", **counters}
@@ -0,0 +1,314 @@
+"""
+Lead Rescoring Engine for AI Marketing Agent.
+Recomputes every lead's score from its features and email history in one
+vectorized NumPy pass, and writes back only the leads whose priority tier
+(hot/warm/medium/cool/cold, see `get_email_frequency_hours`) changed.
+
+Score model (clipped to 0-100):
+    base score (as imported, kept in `base_score`)
+    + status adjustment (Hot +15 ... Cold -5)
+    + deal value adjustment (log-scaled, up to +15)
+    + recency of last contact, decaying with SCORING_HALF_LIFE_DAYS
+    - email fatigue: decayed count of successful sends
+    - bounce penalty: decayed count of failed sends
+    + engagement: tracked opens and clicks (see app/tracking.py), decaying
+      with the time since the last one
+
+Email history is aggregated server-side (one `$group` per lead, with the
+decay computed in the pipeline), so the engine never loads raw history.
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any
+
+import numpy as np
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.database import get_database, get_analytics_database
+
+
+SCORING_HALF_LIFE_DAYS = float(os.getenv("SCORING_HALF_LIFE_DAYS") or "14")
+RESCORE_BATCH_SIZE = int(os.getenv("RESCORE_BATCH_SIZE") or "5000")
+
+STATUS_ADJUSTMENTS = {"Hot": 15, "Qualified": 10, "Warm": 5, "Contacted": 0, "Cold": -5}
+VALUE_WEIGHT = 3.0          # points per order of magnitude of deal value
+VALUE_CAP = 15.0
+RECENCY_WEIGHT = 10.0       # points for a contact today, decaying with the half-life
+FATIGUE_WEIGHT = 1.5        # points per (decayed) successful send
+FATIGUE_CAP = 15.0
+BOUNCE_WEIGHT = 10.0        # points per (decayed) failed send
+BOUNCE_CAP = 20.0
+OPEN_WEIGHT = 2.0           # points per open, up to 5 opens
+CLICK_WEIGHT = 5.0          # points per click, up to 5 clicks
+ENGAGEMENT_CAP = 20.0
+
+# Tier lower bounds, highest first (same tiers as the email campaign priority)
+TIER_NAMES = np.array(["hot", "warm", "medium", "cool", "cold"])
+TIER_BOUNDS = [90, 70, 50, 30]
+
+_LEAD_PROJECTION = {
+    "score": 1, "base_score": 1, "status": 1, "value": 1, "lastContact": 1, "created_at": 1,
+    "email_opens": 1, "email_clicks": 1, "last_engaged_at": 1
+}
+
+
+def score_tiers(scores: np.ndarray) -> np.ndarray:
+    """Tier index per score (0 = hot ... 4 = cold)."""
+    tiers = np.full(scores.shape, len(TIER_BOUNDS), dtype=np.int8)
+    for index in reversed(range(len(TIER_BOUNDS))):
+        tiers[scores >= TIER_BOUNDS[index]] = index
+    return tiers
+
+
+def _decay(age_days: np.ndarray) -> np.ndarray:
+    """Exponential decay weight for ages in days (NaN ages weigh 0)."""
+    weights = np.exp2(-np.maximum(age_days, 0) / SCORING_HALF_LIFE_DAYS)
+    return np.nan_to_num(weights, nan=0.0)
+
+
+def compute_scores(
+    base: np.ndarray,
+    status_adjustment: np.ndarray,
+    value: np.ndarray,
+    contact_age_days: np.ndarray,
+    sent_decayed: np.ndarray,
+    failed_decayed: np.ndarray,
+    opens: Optional[np.ndarray] = None,
+    clicks: Optional[np.ndarray] = None,
+    engagement_age_days: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Vectorized score model (see module docstring). Returns int scores 0-100."""
+    value_adjustment = np.minimum(VALUE_WEIGHT * np.log10(1 + np.maximum(value, 0)), VALUE_CAP)
+    recency = RECENCY_WEIGHT * _decay(contact_age_days)
+    fatigue = np.minimum(FATIGUE_WEIGHT * sent_decayed, FATIGUE_CAP)
+    bounces = np.minimum(BOUNCE_WEIGHT * failed_decayed, BOUNCE_CAP)
+
+    scores = base + status_adjustment + value_adjustment + recency - fatigue - bounces
+    if opens is not None:
+        engagement = OPEN_WEIGHT * np.minimum(opens, 5) + CLICK_WEIGHT * np.minimum(clicks, 5)
+        scores = scores + np.minimum(engagement, ENGAGEMENT_CAP) * _decay(engagement_age_days)
+    return np.clip(np.rint(scores), 0, 100).astype(np.int64)
+
+
+# ============================================
+# Loading
+# ============================================
+
+def _number(value: Any, default: float) -> float:
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else default
+
+
+async def _load_leads(db, batch_size: int) -> Dict[str, Any]:
+    """Load the scoring features of all leads into column arrays."""
+    ids: List[ObjectId] = []
+    current: List[float] = []
+    base: List[float] = []
+    status: List[float] = []
+    value: List[float] = []
+    last_contact: List[Optional[str]] = []
+    created_at: List[Optional[datetime]] = []
+    opens: List[float] = []
+    clicks: List[float] = []
+    last_engaged: List[Optional[datetime]] = []
+
+    # Pull whole batches with to_list instead of awaiting once per document
+    cursor = db.leads.find({}, _LEAD_PROJECTION).batch_size(batch_size)
+    while True:
+        batch = await cursor.to_list(batch_size)
+        if not batch:
+            break
+        for lead in batch:
+            score = _number(lead.get("score"), 50.0)
+            ids.append(lead["_id"])
+            current.append(score)
+            base.append(_number(lead.get("base_score"), score))
+            status.append(STATUS_ADJUSTMENTS.get(lead.get("status"), 0))
+            value.append(_number(lead.get("value"), 0.0))
+            last_contact.append(lead.get("lastContact") or None)
+            created_at.append(lead.get("created_at"))
+            opens.append(_number(lead.get("email_opens"), 0.0))
+            clicks.append(_number(lead.get("email_clicks"), 0.0))
+            last_engaged.append(lead.get("last_engaged_at"))
+
+    return {
+        "ids": ids,
+        "current": np.array(current, dtype=np.float64),
+        "base": np.array(base, dtype=np.float64),
+        "status": np.array(status, dtype=np.float64),
+        "value": np.array(value, dtype=np.float64),
+        "last_contact": _parse_days(last_contact),
+        "created_at": np.array(created_at, dtype="datetime64[ms]").astype("datetime64[D]"),
+        "opens": np.array(opens, dtype=np.float64),
+        "clicks": np.array(clicks, dtype=np.float64),
+        "last_engaged": np.array(last_engaged, dtype="datetime64[ms]").astype("datetime64[D]"),
+    }
+
+
+def _parse_days(values: List[Optional[str]]) -> np.ndarray:
+    """Parse YYYY-MM-DD strings to datetime64[D], with NaT for missing or invalid values."""
+    cleaned = [value[:10] if isinstance(value, str) else "NaT" for value in values]
+    try:
+        return np.array(cleaned, dtype="datetime64[D]")
+    except ValueError:
+        parsed = []
+        for value in cleaned:
+            try:
+                parsed.append(np.datetime64(value, "D"))
+            except ValueError:
+                parsed.append(np.datetime64("NaT"))
+        return np.array(parsed, dtype="datetime64[D]")
+
+
+async def _load_email_aggregates(db, now: datetime) -> Dict[str, Dict[str, float]]:
+    """
+    Decayed successful/failed send counts per lead, computed in one aggregation.
+
+    Sends older than 10 half-lives weigh under 0.1% and are skipped.
+    """
+    half_life_ms = SCORING_HALF_LIFE_DAYS * 86400 * 1000
+    since = now - timedelta(days=10 * SCORING_HALF_LIFE_DAYS)
+
+    pipeline = [
+        {"$match": {"sent_at": {"$gte": since}}},
+        {"$project": {
+            "lead_id": 1,
+            "success": 1,
+            # 2^(-age / half-life), with age = now - sent_at in ms
+            "weight": {"$pow": [2, {"$divide": [{"$subtract": ["$sent_at", now]}, half_life_ms]}]}
+        }},
+        {"$group": {
+            "_id": "$lead_id",
+            "sent": {"$sum": {"$cond": ["$success", "$weight", 0]}},
+            "failed": {"$sum": {"$cond": ["$success", 0, "$weight"]}}
+        }}
+    ]
+
+    aggregates = {}
+    async for row in db.email_history.aggregate(pipeline, allowDiskUse=True):
+        if row["_id"]:
+            aggregates[str(row["_id"])] = row
+    return aggregates
+
+
+# ============================================
+# Rescoring
+# ============================================
+
+async def rescore_leads(batch_size: int = RESCORE_BATCH_SIZE, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Rescore all leads and persist the ones whose tier changed.
+
+    Changed leads get `score`, `score_tier`, `scored_at` and `base_score`
+    (the score as imported, so repeated runs never compound) in chunked,
+    unordered bulk writes.
+
+    Returns counts, timings and the tier transitions.
+    """
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    db = get_database()
+
+    leads = await _load_leads(db, batch_size)
+    history = await _load_email_aggregates(get_analytics_database(), now)
+    loaded = time.perf_counter()
+
+    count = len(leads["ids"])
+    sent = np.zeros(count)
+    failed = np.zeros(count)
+    if history:
+        position = {str(lead_id): index for index, lead_id in enumerate(leads["ids"])}
+        for lead_id, row in history.items():
+            index = position.get(lead_id)
+            if index is not None:
+                sent[index] = row["sent"]
+                failed[index] = row["failed"]
+
+    today = np.datetime64(now.date(), "D")
+    contact = np.where(np.isnat(leads["last_contact"]), leads["created_at"], leads["last_contact"])
+    contact_age = (today - contact).astype(np.float64)  # NaT becomes NaN
+    contact_age[np.isnat(contact)] = np.nan
+
+    engaged_age = (today - leads["last_engaged"]).astype(np.float64)
+    engaged_age[np.isnat(leads["last_engaged"])] = np.nan
+
+    scores = compute_scores(
+        leads["base"], leads["status"], leads["value"], contact_age, sent, failed,
+        leads["opens"], leads["clicks"], engaged_age
+    )
+    old_tiers = score_tiers(leads["current"])
+    new_tiers = score_tiers(scores)
+    changed = np.flatnonzero(old_tiers != new_tiers)
+    computed = time.perf_counter()
+
+    transitions: Dict[str, int] = {}
+    for old, new in zip(old_tiers[changed], new_tiers[changed]):
+        key = f"{TIER_NAMES[old]}->{TIER_NAMES[new]}"
+        transitions[key] = transitions.get(key, 0) + 1
+
+    written = 0
+    if not dry_run:
+        for start in range(0, len(changed), batch_size):
+            chunk = changed[start:start + batch_size]
+            operations = [
+                UpdateOne(
+                    {"_id": leads["ids"][index]},
+                    {"$set": {
+                        "score": int(scores[index]),
+                        "score_tier": str(TIER_NAMES[new_tiers[index]]),
+                        "base_score": float(leads["base"][index]),
+                        "scored_at": now,
+                        "updated_at": now
+                    }}
+                )
+                for index in chunk
+            ]
+            result = await db.leads.bulk_write(operations, ordered=False)
+            written += result.modified_count
+
+    finished = time.perf_counter()
+    print(f"[Scoring] Rescored {count} leads: {len(changed)} changed tier, {written} written "
+          f"in {finished - started:.2f}s")
+
+    return {
+        "leads": count,
+        "with_email_history": len(history),
+        "tier_changes": int(len(changed)),
+        "written": written,
+        "dry_run": dry_run,
+        "transitions": transitions,
+        "tier_counts": {str(TIER_NAMES[t]): int(n) for t, n in zip(*np.unique(new_tiers, return_counts=True))},
+        "timings_ms": {
+            "load": round((loaded - started) * 1000, 1),
+            "compute": round((computed - loaded) * 1000, 1),
+            "write": round((finished - computed) * 1000, 1),
+        },
+    }
+
+
+# ============================================
+# Periodic Rescoring
+# ============================================
+
+_rescore_task: Optional[asyncio.Task] = None
+
+
+async def _rescore_periodically(interval_hours: float) -> None:
+    while True:
+        try:
+            await rescore_leads()
+        except Exception as e:
+            print(f"[Scoring] Rescore failed: {e}")
+        await asyncio.sleep(interval_hours * 3600)
+
+
+def start_rescorer() -> None:
+    """Start periodic rescoring if LEAD_RESCORE_INTERVAL_HOURS is set."""
+    global _rescore_task
+    interval = os.getenv("LEAD_RESCORE_INTERVAL_HOURS")
+    if interval and (_rescore_task is None or _rescore_task.done()):
+        _rescore_task = asyncio.create_task(_rescore_periodically(float(interval)))
+        print(f"[Scoring] Periodic lead rescoring every {interval}h")
@@ -3,7 +3,8 @@ FastAPI entry point for the AI Marketing Automation Agent.
 Provides REST API endpoint for generating marketing content.
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.schemas import (
     MarketingRequest, MarketingResponse, ActionResult,
@@ -33,6 +34,87 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def on_startup():
+    """Prepare background data structures (rollup counters) when the server starts."""
+    from app.storage import ensure_lead_indexes, is_mongo
+    
+    try:
+        await ensure_lead_indexes()
+        if is_mongo():
+            from app.database import get_database
+            from app.rollups import ensure_rollups
+            from app.archival import ensure_archive_indexes
+            from app.search import ensure_search_indexes
+            from app.segments import ensure_segment_indexes
+            from app.campaign_runner import ensure_campaign_indexes
+            from app.email_scheduler import ensure_email_scheduler_indexes
+            from app.outbox import ensure_outbox_indexes
+            from app.tracking import ensure_tracking_indexes
+            from app.suppression import ensure_suppression_indexes
+            
+            await ensure_archive_indexes()
+            await ensure_search_indexes(get_database())
+            await ensure_segment_indexes(get_database())
+            await ensure_campaign_indexes(get_database())
+            await ensure_email_scheduler_indexes(get_database())
+            await ensure_outbox_indexes(get_database())
+            await ensure_tracking_indexes(get_database())
+            await ensure_suppression_indexes(get_database())
+            await ensure_rollups(get_database())
+    except Exception as e:
+        print(f"[Startup] Database not ready: {e}")  # Don't fail if DB is not configured
+    
+    from app.history_writer import get_history_writer
+    from app.write_behind import get_write_behind_queue
+    from app.tracking import get_engagement_tracker
+    get_history_writer().start()
+    get_write_behind_queue().start()
+    get_engagement_tracker().start()
+    if is_mongo():
+        from app.suppression import start_suppression_list
+        # Started before any sender; sends are refused until the list has loaded
+        await start_suppression_list()
+        
+        from app.archival import start_archiver
+        from app.lead_scoring import start_rescorer
+        from app.campaign_runner import start_campaign_runner
+        from app.email_scheduler import start_email_scheduler
+        from app.outbox import start_outbox_worker
+        start_archiver()
+        start_rescorer()
+        start_campaign_runner()
+        start_email_scheduler()
+        start_outbox_worker()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Flush buffered writes and close pooled connections before the server exits."""
+    from app.history_writer import get_history_writer
+    from app.write_behind import get_write_behind_queue
+    from app.integrations.email_sender import close_smtp_pool
+    from app.tracking import get_engagement_tracker
+    from app.campaign_runner import stop_campaign_runner
+    from app.email_scheduler import stop_email_scheduler
+    from app.outbox import stop_outbox_worker
+    from app.suppression import stop_suppression_list
+    from app.send_pacing import release_send_budget
+    
+    await stop_email_scheduler()
+    await stop_outbox_worker()
+    await stop_campaign_runner()
+    await stop_suppression_list()
+    try:
+        await release_send_budget()
+    except Exception as e:
+        print(f"[Shutdown] Send budget not released: {e}")
+    await get_write_behind_queue().stop()
+    await get_history_writer().stop()
+    await get_engagement_tracker().stop()
+    close_smtp_pool()
+
+
 @app.get("/")
 async def root():
     """Health check endpoint."""
@@ -151,20 +233,21 @@ async def generate_seo(request: SimpleContentRequest):
     - Long-tail keywords
     - SEO title suggestions
     """
-    from app.database import save_generation
+    from app.storage import save_generation
     
     try:
         business_info = f"{request.business_name}: {request.product_description} for {request.target_audience}"
         content = seo_keyword_tool.invoke(business_info)
         
-        # Save to MongoDB
+        # Save to MongoDB (queued, off the response path)
         try:
             await save_generation(
                 generation_type="seo",
                 business_name=request.business_name,
                 product_description=request.product_description,
                 target_audience=request.target_audience,
-                content={"seo": content}
+                content={"seo": content},
+                background=True
             )
         except Exception:
             pass  # Don't fail if DB is not configured
@@ -238,15 +321,16 @@ Be specific to the actual content and purpose of this website."""
 
         ai_response = llm.invoke(prompt)
         
-        # Save to MongoDB
+        # Save to MongoDB (queued, off the response path)
         try:
-            from app.database import save_website_analysis
+            from app.storage import save_website_analysis
             await save_website_analysis(
                 website_url=request.website_url,
                 title=title,
                 description=description,
                 content_summary=content_summary[:500] if content_summary else None,
-                seo_analysis=ai_response.content
+                seo_analysis=ai_response.content,
+                background=True
             )
         except Exception:
             pass  # Don't fail if DB is not configured
@@ -274,7 +358,7 @@ async def generate_social(request: SocialPostRequest):
     Saves the post to database for history tracking.
     If manual_schedule is False, auto-schedules at optimal time.
     """
-    from app.database import save_social_post, auto_schedule_post
+    from app.storage import save_social_post, auto_schedule_post
     
     try:
         business_info = f"{request.business_name}: {request.product_description} for {request.target_audience}"
@@ -306,7 +390,8 @@ async def generate_social(request: SocialPostRequest):
                 platform=request.platform,
                 content=content,
                 image_url=image_url,
-                status="draft"  # Save as draft first
+                status="draft",  # Save as draft first
+                background=request.manual_schedule  # Auto-scheduling needs the stored post
             )
             
             # Auto-schedule if user didn't select manual scheduling
@@ -471,10 +556,10 @@ async def send_email_action(request: EmailSendRequest):
 # History Endpoints (MongoDB)
 # ============================================
 
-from app.database import (
+from app.storage import (
     save_generation, save_website_analysis,
     get_generations, get_website_analyses,
-    get_generation_by_id, get_stats
+    get_generation_by_id, get_website_analysis_by_id, get_stats
 )
 from typing import Optional
 
@@ -482,7 +567,8 @@ from typing import Optional
 @app.get("/history/generations", tags=["History"])
 async def list_generations(
     limit: int = 50,
-    type: Optional[str] = None
+    type: Optional[str] = None,
+    include_content: bool = True
 ):
     """
     Get generation history from MongoDB.
@@ -490,9 +576,10 @@ async def list_generations(
     Args:
         limit: Maximum number of records (default 50)
         type: Filter by type (seo, social, email, whatsapp, full)
+        include_content: Set to false to list metadata only (skips decompression)
     """
     try:
-        generations = await get_generations(limit=limit, generation_type=type)
+        generations = await get_generations(limit=limit, generation_type=type, include_content=include_content)
         return {"generations": generations, "count": len(generations)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -526,6 +613,22 @@ async def get_single_generation(generation_id: str):
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 
+@app.get("/history/analyses/{analysis_id}", tags=["History"])
+async def get_single_website_analysis(analysis_id: str):
+    """
+    Get a specific website analysis by ID.
+    """
+    try:
+        analysis = await get_website_analysis_by_id(analysis_id)
+        if not analysis:
+            raise HTTPException(status_code=404, detail="Analysis not found")
+        return analysis
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+
 @app.get("/history/stats", tags=["History"])
 async def get_history_stats():
     """
@@ -542,7 +645,7 @@ async def get_history_stats():
 # Social Posts & Scheduling Endpoints
 # ============================================
 
-from app.database import get_social_posts, get_scheduled_posts, update_post_status, update_post_schedule
+from app.storage import get_social_posts, get_scheduled_posts, update_post_status, update_post_schedule
 from datetime import datetime as dt
 
 
@@ -678,7 +781,9 @@ async def check_calendar_status():
 # Lead Management Endpoints
 # ============================================
 
-from app.database import save_lead, save_leads_bulk, get_leads
+from app.storage import save_lead, upsert_leads, get_leads, get_leads_by_ids, is_mongo
+from app.lead_dedupe import resolve_duplicates
+import json
 from app.schemas import LeadCreate, LeadResponse, LeadsImportRequest, LeadsImportResponse
 
 
@@ -694,31 +799,89 @@ async def import_leads(request: LeadsImportRequest):
         if not request.leads:
             raise HTTPException(status_code=400, detail="No leads provided")
         
-        # Convert Pydantic models to dicts
-        leads_data = [lead.model_dump() for lead in request.leads]
+        # Only supplied fields, so re-imports never reset existing leads to defaults
+        leads_data = [lead.model_dump(exclude_unset=True) for lead in request.leads]
         
-        # Bulk insert
-        inserted_ids = await save_leads_bulk(leads_data)
+        # Fold canonical-email duplicates into their lead, then bulk upsert on normalized email
+        matches = await resolve_duplicates(leads_data, check_existing=is_mongo())
+        possible = len(matches["possible_duplicates"])
+        result = await upsert_leads(leads_data)
         
-        # Fetch the inserted leads to return
-        all_leads = await get_leads(limit=len(inserted_ids))
+        # Echo the stored leads (updates only wrote the supplied fields)
+        written = [LeadResponse(**lead) for lead in await get_leads_by_ids(result["ids"])]
         
         return LeadsImportResponse(
-            success=True,
-            message=f"Successfully imported {len(inserted_ids)} leads",
-            imported_count=len(inserted_ids),
-            leads=all_leads[:len(inserted_ids)]
+            success=not result["errors"],
+            message=(
+                f"Imported {result['inserted']} new leads, updated {result['updated']}, {len(result['errors'])} failed"
+                + (f", {possible} possible duplicates (review with POST /admin/leads/dedupe)" if possible else "")
+            ),
+            imported_count=len(written),
+            leads=written
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error importing leads: {str(e)}")
 
 
+@app.post("/leads/import/stream", tags=["Leads"])
+async def import_leads_stream_endpoint(
+    request: Request,
+    format: Optional[str] = None,
+    chunk_size: int = 1000,
+    max_errors: int = 1000
+):
+    """
+    Stream-import leads from a raw CSV or NDJSON request body.
+    
+    The body is spooled to a temp file first (the response stream cannot
+    read it once started), then parsed incrementally and upserted in
+    unordered chunks keyed on normalized email, so large files never sit in
+    memory. Progress and per-row errors are streamed back as NDJSON events.
+    
+    Example:
+        curl -X POST "localhost:8000/leads/import/stream?format=csv" \\
+             -H "Content-Type: text/csv" --data-binary @leads.csv
+    
+    Args:
+        format: "csv" or "ndjson" (inferred from Content-Type if omitted)
+        chunk_size: Rows per bulk write (default 1000)
+        max_errors: Maximum per-row error events to report (others are only counted)
+    """
+    from app.lead_import import import_leads_stream, spool_body, iter_spooled
+    
+    file_format = (format or "").lower()
+    if not file_format:
+        content_type = request.headers.get("content-type", "")
+        file_format = "csv" if "csv" in content_type else "ndjson"
+    if file_format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Invalid format. Use: csv or ndjson")
+    if chunk_size < 1 or chunk_size > 10000:
+        raise HTTPException(status_code=400, detail="chunk_size must be between 1 and 10000")
+    
+    # Read before the response starts; afterwards the server drains the body itself
+    body = await spool_body(request.stream())
+    
+    async def events():
+        try:
+            async for event in import_leads_stream(iter_spooled(body), file_format, chunk_size, max_errors):
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            yield json.dumps({"event": "failed", "error": str(e)}) + "\n"
+        finally:
+            body.close()
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
 @app.get("/leads", tags=["Leads"])
 async def list_leads(
     limit: int = 100,
     status: Optional[str] = None,
-    source: Optional[str] = None
+    source: Optional[str] = None,
+    segment: Optional[str] = None
 ):
     """
     Get all leads from the database.
@@ -727,7 +890,11 @@ async def list_leads(
         limit: Maximum number of leads to return (default 100)
         status: Filter by status (Hot, Warm, Cold, Qualified, Contacted)
         source: Filter by source (Website, LinkedIn, Referral, etc.)
+        segment: Only leads in this saved segment, highest score first
     """
+    if segment:
+        return await list_segment_leads(segment, limit=limit)
+    
     try:
         leads = await get_leads(limit=limit, status=status, source=source)
         return {"leads": leads, "count": len(leads)}
@@ -741,24 +908,232 @@ async def create_lead(lead: LeadCreate):
     Create a single new lead.
     """
     try:
-        lead_data = lead.model_dump()
-        lead_id = await save_lead(lead_data)
+        lead_id = await save_lead(lead.model_dump(exclude_unset=True))
         
-        return LeadResponse(
-            id=lead_id,
-            **lead_data
-        )
+        # The stored lead: an existing lead with this email keeps unsupplied fields
+        stored = await get_leads_by_ids([lead_id])
+        return LeadResponse(**stored[0])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating lead: {str(e)}")
 
 
+# ============================================
+# Lead Segment Endpoints
+# ============================================
+
+from app.schemas import SegmentRequest, SegmentPreviewRequest
+
+
+def _require_mongo(feature: str) -> None:
+    if not is_mongo():
+        raise HTTPException(status_code=400, detail=f"{feature} requires the mongo storage backend")
+
+
+async def _segment_query(segment: Optional[str] = None, definition: Optional[dict] = None) -> Optional[dict]:
+    """Lead filter for a saved or inline segment (None when neither is given)."""
+    if not segment and definition is None:
+        return None
+    _require_mongo("Segment targeting")
+    from app.segments import resolve_segment
+    
+    try:
+        return await resolve_segment(segment, definition)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid segment: {str(e)}")
+
+
+@app.get("/segments", tags=["Segments"])
+async def list_saved_segments(refresh_counts: bool = False):
+    """
+    List saved segments with their cached lead counts.
+    
+    Args:
+        refresh_counts: Recount segments whose cached count has expired
+    """
+    _require_mongo("Segments")
+    from app.segments import list_segments, refresh_segment_counts
+    
+    try:
+        if refresh_counts:
+            await refresh_segment_counts()
+        segments = await list_segments()
+        return {"segments": segments, "count": len(segments)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.post("/segments", tags=["Segments"])
+async def create_segment(request: SegmentRequest):
+    """
+    Create or replace a saved segment.
+    
+    Example definition:
+        {"status": ["Hot", "Warm"], "score": {"min": 70},
+         "last_emailed": {"older_than_days": 7}, "emails_failed": {"max": 0}}
+    
+    See app/segments.py for the full segment language.
+    """
+    _require_mongo("Segments")
+    from app.segments import save_segment
+    
+    try:
+        return await save_segment(request.name, request.definition, request.description)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid segment: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.post("/segments/preview", tags=["Segments"])
+async def preview_segment(request: SegmentPreviewRequest):
+    """
+    Count and sample the leads matching an unsaved segment definition.
+    
+    Also returns the compiled Mongo query.
+    """
+    _require_mongo("Segments")
+    from app.segments import find_segment_leads, count_segment_query
+    from bson import json_util
+    
+    query = await _segment_query(definition=request.definition)
+    try:
+        return {
+            "count": await count_segment_query(query),
+            "leads": await find_segment_leads(query, limit=min(max(request.limit, 0), 100)),
+            "query": json.loads(json_util.dumps(query))
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.get("/segments/{name}", tags=["Segments"])
+async def get_saved_segment(name: str):
+    """Get a saved segment and its cached count."""
+    _require_mongo("Segments")
+    from app.segments import get_segment
+    
+    segment = await get_segment(name)
+    if not segment:
+        raise HTTPException(status_code=404, detail="Segment not found")
+    return segment
+
+
+@app.delete("/segments/{name}", tags=["Segments"])
+async def delete_saved_segment(name: str):
+    """Delete a saved segment."""
+    _require_mongo("Segments")
+    from app.segments import delete_segment
+    
+    if not await delete_segment(name):
+        raise HTTPException(status_code=404, detail="Segment not found")
+    return {"success": True, "message": f"Segment '{name}' deleted"}
+
+
+@app.get("/segments/{name}/count", tags=["Segments"])
+async def get_saved_segment_count(name: str, refresh: bool = False):
+    """
+    Number of leads in a saved segment.
+    
+    Served from the cache while it is younger than SEGMENT_COUNT_TTL_SECONDS,
+    unless refresh is set.
+    """
+    _require_mongo("Segments")
+    from app.segments import get_segment_count
+    
+    try:
+        return await get_segment_count(name, refresh=refresh)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.get("/segments/{name}/leads", tags=["Segments"])
+async def list_segment_leads(name: str, limit: int = 100, skip: int = 0):
+    """Leads in a saved segment, highest score first."""
+    from app.segments import find_segment_leads
+    
+    query = await _segment_query(segment=name)
+    try:
+        leads = await find_segment_leads(query, limit=limit, skip=skip)
+        return {"leads": leads, "count": len(leads), "segment": name}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching leads: {str(e)}")
+
+
+# ============================================
+# Search Endpoints
+# ============================================
+
+@app.get("/search", tags=["Search"])
+async def search_content(
+    q: str,
+    source: Optional[str] = None,
+    type: Optional[str] = None,
+    business_name: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0
+):
+    """
+    Full-text search over generated content, social posts and website analyses.
+    
+    Results are ranked by relevance (BM25) and include a snippet with the
+    matched terms wrapped in <mark> tags.
+    
+    Args:
+        q: Search query
+        source: Comma-separated subset of generations, social_posts, website_analyses
+        type: Generation type (seo, social, email, ...) or social post platform
+        business_name: Exact business name (website URL for analyses)
+        since / until: ISO datetime range on created_at
+        limit / offset: Pagination
+    """
+    _require_mongo("Search")
+    from app.database import get_analytics_database
+    from app.search import SEARCH_SOURCES, search
+    
+    sources = [s.strip() for s in source.split(",")] if source else None
+    if sources and any(s not in SEARCH_SOURCES for s in sources):
+        raise HTTPException(status_code=400, detail=f"Invalid source. Use: {', '.join(SEARCH_SOURCES)}")
+    
+    try:
+        since_dt = dt.fromisoformat(since.replace('Z', '+00:00')) if since else None
+        until_dt = dt.fromisoformat(until.replace('Z', '+00:00')) if until else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid datetime format. Use ISO format.")
+    
+    try:
+        return await search(
+            get_analytics_database(), q,
+            sources=sources,
+            content_type=type,
+            business_name=business_name,
+            since=since_dt,
+            until=until_dt,
+            limit=min(max(limit, 1), 100),
+            offset=max(offset, 0)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
+
+
 # ============================================
 # Score-Based Email Campaign Endpoints
 # ============================================
 
-from app.database import get_leads_for_email_campaign, save_email_history, get_email_history, get_email_frequency_hours
+from app.storage import get_leads_for_email_campaign, get_email_history, get_email_frequency_hours
+from app.history_writer import get_history_writer
 from app.schemas import EmailCampaignRequest, EmailCampaignResult, EmailCampaignResponse
-from app.integrations.email_sender import send_email
+from app.email_delivery import deliver_emails
+from app.campaign_content import render_template_email
+from app.outbox import enqueue_messages, idempotency_key
+import uuid
+
+history_writer = get_history_writer()
 
 
 @app.post("/leads/email-campaign", response_model=EmailCampaignResponse, tags=["Email Campaign"])
@@ -774,16 +1149,29 @@ async def run_email_campaign(request: EmailCampaignRequest):
     - Score 0-29 (Cold): Every 48 hours
     
     Higher score leads get emailed more frequently and are processed first.
+    Emails are sent concurrently over pooled async SMTP connections
+    (see app/email_delivery.py); results are listed in completion order.
+    Sends are paced to the daily, per-minute and per-domain limits
+    (app/send_pacing.py): emails beyond the daily limit are not attempted
+    and are reported as deferred. Use POST /campaigns for large sends.
     
     Args:
         subject_template: Email subject with placeholders {name}, {company}, {score}
         body_template: Email body with placeholders
         max_emails: Maximum emails to send in this batch
         dry_run: If True, preview only without sending
+        segment / segment_definition: Only email leads in this segment
+        queue: Queue the emails in the outbox (app/outbox.py) and return
+            without waiting for delivery; track them with GET /outbox
+        idempotency_key: With queue, makes retrying the request safe
     """
+    query = await _segment_query(request.segment, request.segment_definition)
+    if request.queue and not request.dry_run:
+        _require_mongo("Queued sending")
+    
     try:
         # Get eligible leads sorted by score
-        eligible_leads = await get_leads_for_email_campaign()
+        eligible_leads = await get_leads_for_email_campaign(query)
         
         if not eligible_leads:
             return EmailCampaignResponse(
@@ -802,27 +1190,19 @@ async def run_email_campaign(request: EmailCampaignRequest):
         results = []
         emails_sent = 0
         emails_failed = 0
+        emails_deferred = 0
+        outgoing = []
+        campaign = f"email-campaign:{request.idempotency_key or uuid.uuid4().hex}"
         
-        for lead in leads_to_email:
+        for index, lead in enumerate(leads_to_email):
             lead_id = lead.get("id")
             lead_email = lead.get("email")
             lead_name = lead.get("name", "Valued Customer")
-            lead_company = lead.get("company", "")
             lead_score = lead.get("score", 50)
             priority = lead.get("priority", "medium")
             
             # Prepare email content using templates
-            subject = request.subject_template.format(
-                name=lead_name,
-                company=lead_company,
-                score=lead_score
-            )
-            body = request.body_template.format(
-                name=lead_name,
-                email=lead_email,
-                company=lead_company,
-                score=lead_score
-            )
+            subject, body = render_template_email(lead, request.subject_template, request.body_template)
             
             if request.dry_run:
                 # Preview mode - don't actually send
@@ -837,18 +1217,64 @@ async def run_email_campaign(request: EmailCampaignRequest):
                 ))
                 emails_sent += 1
             else:
-                # Actually send the email
-                result = send_email(
-                    to=lead_email,
-                    subject=subject,
-                    body=body
-                )
-                
-                # Save to email history
-                await save_email_history(
-                    lead_id=lead_id,
-                    lead_email=lead_email,
-                    subject=subject,
+                outgoing.append({
+                    "key": index, "to": lead_email, "subject": subject, "body": body, "score": lead_score,
+                    "lead_id": lead_id, "campaign": campaign
+                })
+        
+        if request.queue and outgoing:
+            # Hand the emails to the outbox; its workers deliver them
+            messages = []
+            for email in outgoing:
+                lead = leads_to_email[email["key"]]
+                messages.append({
+                    **email,
+                    "key": idempotency_key(campaign, lead["id"]),
+                    "channel": "email",
+                    "lead_id": lead["id"],
+                    "campaign": campaign
+                })
+            queued = await enqueue_messages(messages)
+            
+            for email, message in zip(outgoing, messages):
+                lead = leads_to_email[email["key"]]
+                results.append(EmailCampaignResult(
+                    lead_id=lead["id"],
+                    lead_email=message["to"],
+                    lead_name=lead.get("name", "Valued Customer"),
+                    score=lead.get("score", 50),
+                    priority=lead.get("priority", "medium"),
+                    success=True,
+                    message=f"Queued for delivery ({message['key']})"
+                ))
+            
+            return EmailCampaignResponse(
+                success=True,
+                message=f"Email campaign queued. {queued['queued']} emails queued, {queued['duplicates']} already queued. "
+                        f"Track delivery with GET /outbox?campaign={campaign}",
+                total_eligible=len(eligible_leads),
+                emails_sent=0,
+                emails_failed=0,
+                dry_run=False,
+                results=results
+            )
+        
+        # Send concurrently; collect each result as its send completes
+        async for result in deliver_emails(outgoing):
+            lead = leads_to_email[result["key"]]
+            
+            if result["deferred"]:
+                # Over the daily send limit: not attempted, so no history entry
+                emails_deferred += 1
+            elif result.get("suppressed"):
+                # On the suppression list: not attempted either
+                emails_failed += 1
+            else:
+                # Buffer for batched email history write
+                await history_writer.add(
+                    lead_id=lead.get("id"),
+                    lead_email=result["to"],
+                    subject=result["subject"],
                     success=result["success"],
                     message=result["message"]
                 )
@@ -857,20 +1283,24 @@ async def run_email_campaign(request: EmailCampaignRequest):
                     emails_sent += 1
                 else:
                     emails_failed += 1
-                
-                results.append(EmailCampaignResult(
-                    lead_id=lead_id,
-                    lead_email=lead_email,
-                    lead_name=lead_name,
-                    score=lead_score,
-                    priority=priority,
-                    success=result["success"],
-                    message=result["message"]
-                ))
+            
+            results.append(EmailCampaignResult(
+                lead_id=lead.get("id"),
+                lead_email=result["to"],
+                lead_name=lead.get("name", "Valued Customer"),
+                score=lead.get("score", 50),
+                priority=lead.get("priority", "medium"),
+                success=result["success"],
+                message=result["message"]
+            ))
+        
+        # Persist any history still buffered for this campaign
+        await history_writer.flush()
         
         return EmailCampaignResponse(
             success=True,
-            message=f"{'Dry run completed' if request.dry_run else 'Email campaign completed'}. {emails_sent} emails {'would be sent' if request.dry_run else 'sent'}, {emails_failed} failed.",
+            message=f"{'Dry run completed' if request.dry_run else 'Email campaign completed'}. {emails_sent} emails {'would be sent' if request.dry_run else 'sent'}, {emails_failed} failed."
+                    + (f" {emails_deferred} deferred: daily send limit reached." if emails_deferred else ""),
             total_eligible=len(eligible_leads),
             emails_sent=emails_sent,
             emails_failed=emails_failed,
@@ -883,14 +1313,17 @@ async def run_email_campaign(request: EmailCampaignRequest):
 
 
 @app.get("/leads/email-eligible", tags=["Email Campaign"])
-async def get_eligible_leads():
+async def get_eligible_leads(segment: Optional[str] = None):
     """
     Get all leads eligible for email based on score and last email time.
     
-    Shows which leads would receive emails if a campaign is run now.
+    Shows which leads would receive emails if a campaign is run now,
+    optionally only within a saved segment.
     """
+    query = await _segment_query(segment)
+    
     try:
-        leads = await get_leads_for_email_campaign()
+        leads = await get_leads_for_email_campaign(query)
         return {
             "eligible_leads": leads,
             "count": len(leads),
@@ -922,24 +1355,59 @@ async def get_email_send_history(lead_id: Optional[str] = None, limit: int = 50)
 async def run_ai_personalized_email_campaign(
     max_emails: int = 10,
     dry_run: bool = True,
-    business_context: str = "AI Marketing Automation Platform - helping businesses grow with intelligent marketing"
+    business_context: str = "AI Marketing Automation Platform - helping businesses grow with intelligent marketing",
+    segment: Optional[str] = None,
+    queue: bool = False,
+    idempotency_key: Optional[str] = None,
+    segment_drafts: bool = False,
+    bespoke_min_score: Optional[int] = None,
+    bespoke_min_value: Optional[int] = None,
+    leads_per_prompt: int = 1
 ):
     """
     Run an AI-powered personalized email campaign.
     
     Fetches leads from the database and uses AI to generate a unique,
     personalized email for each lead based on their name, company, and score.
+    With segment_drafts, the AI writes one draft per (score tier, industry)
+    that is personalized locally for each lead; only high-value leads get
+    their own AI email, so a campaign needs a handful of LLM calls instead
+    of one per lead. With leads_per_prompt, per-lead emails are generated
+    several leads per LLM call.
     
     Args:
         max_emails: Maximum number of emails to send
         dry_run: If True, preview emails without sending
         business_context: Context about your business for AI personalization
+        segment: Only email leads in this saved segment
+        queue: Queue the generated emails in the outbox instead of sending
+            them in the request; track them with GET /outbox
+        idempotency_key: With queue, makes retrying the request safe
+        segment_drafts: Generate one draft per segment instead of per lead
+        bespoke_min_score: With segment_drafts, leads scoring at least this
+            get their own AI email (default AI_BESPOKE_MIN_SCORE)
+        bespoke_min_value: ... or with at least this deal value
+            (default AI_BESPOKE_MIN_VALUE)
+        leads_per_prompt: Leads per LLM call for per-lead emails (1 = one
+            prompt each, max AI_MAX_LEADS_PER_PROMPT); failed leads are
+            retried on their own
     """
     from app.config import get_llm
+    from app.outbox import idempotency_key as outbox_key
+    from app.campaign_content import (
+        generate_ai_emails, is_high_value, segment_key, AI_BESPOKE_MIN_SCORE, AI_BESPOKE_MIN_VALUE
+    )
+    from app.campaign_runner import CAMPAIGN_AI_CONCURRENCY
+    
+    query = await _segment_query(segment)
+    if queue and not dry_run:
+        _require_mongo("Queued sending")
+    campaign = f"ai-email-campaign:{idempotency_key or uuid.uuid4().hex}"
+    queued_messages = []
     
     try:
         # Get eligible leads
-        eligible_leads = await get_leads_for_email_campaign()
+        eligible_leads = await get_leads_for_email_campaign(query)
         
         if not eligible_leads:
             return {
@@ -953,11 +1421,34 @@ async def run_ai_personalized_email_campaign(
         leads_to_email = eligible_leads[:max_emails]
         llm = get_llm()
         
+        # Generate every email up front (concurrently, or per segment)
+        min_score = AI_BESPOKE_MIN_SCORE if bespoke_min_score is None else bespoke_min_score
+        min_value = AI_BESPOKE_MIN_VALUE if bespoke_min_value is None else bespoke_min_value
+        drafts = {}
+        usage = {}
+        generated = await generate_ai_emails(
+            llm, leads_to_email, business_context,
+            segment_drafts=segment_drafts,
+            drafts=drafts,
+            concurrency=CAMPAIGN_AI_CONCURRENCY,
+            min_score=min_score,
+            min_value=min_value,
+            leads_per_prompt=leads_per_prompt,
+            usage=usage
+        )
+        generation = {"mode": "segment" if segment_drafts else "per_lead", "leads_per_prompt": leads_per_prompt, **usage}
+        if segment_drafts:
+            generation["segments"] = len(drafts)
+            generation["bespoke"] = sum(1 for lead in leads_to_email if is_high_value(lead, min_score, min_value))
+        
         results = []
         emails_sent = 0
         emails_failed = 0
+        emails_deferred = 0
+        outgoing = []
+        sending = []
         
-        for lead in leads_to_email:
+        for lead, subject, body, error in generated:
             lead_id = lead.get("id")
             lead_email = lead.get("email")
             lead_name = lead.get("name", "Valued Customer")
@@ -965,39 +1456,9 @@ async def run_ai_personalized_email_campaign(
             lead_score = lead.get("score", 50)
             priority = lead.get("priority", "medium")
             
-            # Generate personalized email using AI
-            prompt = f"""Generate a personalized marketing email for this lead:
-
-Lead Name: {lead_name}
-Company: {lead_company}
-Lead Score: {lead_score}/100 ({"hot lead - very interested" if lead_score >= 80 else "warm lead" if lead_score >= 50 else "needs nurturing"})
-
-Business Context: {business_context}
-
-Requirements:
-1. Create a compelling subject line (under 50 characters)
-2. Write a personalized email body (150-200 words)
-3. Include a clear call-to-action
-4. Reference their company name naturally
-5. Be professional but friendly
-
-Format your response exactly as:
-SUBJECT: [your subject line]
----
-[email body]"""
-
             try:
-                response = llm.invoke(prompt)
-                email_content = response.content
-                
-                # Parse subject and body
-                if "SUBJECT:" in email_content and "---" in email_content:
-                    parts = email_content.split("---", 1)
-                    subject = parts[0].replace("SUBJECT:", "").strip()
-                    body = parts[1].strip()
-                else:
-                    subject = f"Exclusive Opportunity for {lead_company}"
-                    body = email_content
+                if error:
+                    raise RuntimeError(error)
                 
                 if dry_run:
                     results.append({
@@ -1007,34 +1468,20 @@ SUBJECT: [your subject line]
                         "company": lead_company,
                         "score": lead_score,
                         "priority": priority,
+                        "content": "bespoke" if not segment_drafts or is_high_value(lead, min_score, min_value)
+                                   else f"segment:{segment_key(lead)}",
                         "subject": subject,
                         "body_preview": body[:300] + "..." if len(body) > 300 else body,
                         "success": True,
                         "message": "[DRY RUN] Email generated but not sent"
                     })
                     emails_sent += 1
-                else:
-                    # Actually send the email
-                    result = send_email(
-                        to=lead_email,
-                        subject=subject,
-                        body=body
-                    )
-                    
-                    # Save to history
-                    await save_email_history(
-                        lead_id=lead_id,
-                        lead_email=lead_email,
-                        subject=subject,
-                        success=result["success"],
-                        message=result["message"]
-                    )
-                    
-                    if result["success"]:
-                        emails_sent += 1
-                    else:
-                        emails_failed += 1
-                    
+                elif queue:
+                    key = outbox_key(campaign, lead_id)
+                    queued_messages.append({
+                        "key": key, "channel": "email", "to": lead_email, "subject": subject, "body": body,
+                        "lead_id": lead_id, "campaign": campaign, "score": lead_score
+                    })
                     results.append({
                         "lead_id": lead_id,
                         "lead_email": lead_email,
@@ -1043,9 +1490,16 @@ SUBJECT: [your subject line]
                         "score": lead_score,
                         "priority": priority,
                         "subject": subject,
-                        "success": result["success"],
-                        "message": result["message"]
+                        "success": True,
+                        "message": f"Queued for delivery ({key})"
+                    })
+                else:
+                    # Sent below, concurrently and paced
+                    outgoing.append({
+                        "key": len(outgoing), "to": lead_email, "subject": subject, "body": body,
+                        "score": lead_score, "lead_id": lead_id, "campaign": campaign
                     })
+                    sending.append(lead)
                     
             except Exception as e:
                 emails_failed += 1
@@ -1057,16 +1511,73 @@ SUBJECT: [your subject line]
                     "score": lead_score,
                     "priority": priority,
                     "success": False,
-                    "message": f"Failed to generate email: {str(e)}"
+                    "message": str(e) if error else f"Failed to generate email: {str(e)}"
                 })
         
+        # Send concurrently through the pacer; collect each result as its send completes
+        async for result in deliver_emails(outgoing):
+            lead = sending[result["key"]]
+            
+            if result["deferred"]:
+                # Over the daily send limit: not attempted, so no history entry
+                emails_deferred += 1
+            elif result.get("suppressed"):
+                emails_failed += 1
+            else:
+                # Buffer for batched email history write
+                await history_writer.add(
+                    lead_id=lead.get("id"),
+                    lead_email=result["to"],
+                    subject=result["subject"],
+                    success=result["success"],
+                    message=result["message"]
+                )
+                
+                if result["success"]:
+                    emails_sent += 1
+                else:
+                    emails_failed += 1
+            
+            results.append({
+                "lead_id": lead.get("id"),
+                "lead_email": result["to"],
+                "lead_name": lead.get("name", "Valued Customer"),
+                "company": lead.get("company", ""),
+                "score": lead.get("score", 50),
+                "priority": lead.get("priority", "medium"),
+                "subject": result["subject"],
+                "success": result["success"],
+                "message": result["message"]
+            })
+        
+        # Persist any history still buffered for this campaign
+        await history_writer.flush()
+        
+        if queued_messages:
+            queued = await enqueue_messages(queued_messages)
+            return {
+                "success": True,
+                "message": f"Campaign queued. {queued['queued']} emails queued, {queued['duplicates']} already queued, "
+                           f"{emails_failed} failed to generate. Track delivery with GET /outbox?campaign={campaign}",
+                "total_eligible": len(eligible_leads),
+                "emails_processed": len(results),
+                "emails_queued": queued["queued"],
+                "emails_failed": emails_failed,
+                "campaign": campaign,
+                "generation": generation,
+                "dry_run": dry_run,
+                "results": results
+            }
+        
         return {
             "success": True,
-            "message": f"{'Dry run completed' if dry_run else 'Campaign completed'}. {emails_sent} emails {'generated' if dry_run else 'sent'}, {emails_failed} failed.",
+            "message": f"{'Dry run completed' if dry_run else 'Campaign completed'}. {emails_sent} emails {'generated' if dry_run else 'sent'}, {emails_failed} failed."
+                       + (f" {emails_deferred} deferred: daily send limit reached." if emails_deferred else ""),
             "total_eligible": len(eligible_leads),
             "emails_processed": len(results),
             "emails_sent": emails_sent,
             "emails_failed": emails_failed,
+            "generation": generation,
             "dry_run": dry_run,
             "results": results
         }
@@ -1076,79 +1587,902 @@ SUBJECT: [your subject line]
 
 
 # ============================================
-# Dashboard Stats Endpoint
+# Background Campaign Endpoints
 # ============================================
 
-@app.get("/dashboard/stats", tags=["Dashboard"])
-async def get_dashboard_stats():
+from app.schemas import CampaignCreateRequest
+from bson import ObjectId
+
+
+def _campaign_id(campaign_id: str) -> str:
+    _require_mongo("Background campaigns")
+    if not ObjectId.is_valid(campaign_id):
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return campaign_id
+
+
+@app.post("/campaigns", tags=["Campaigns"])
+async def start_background_campaign(request: CampaignCreateRequest):
     """
-    Get real-time dashboard statistics from the database.
+    Start an email campaign that runs in the background.
     
-    Returns lead counts, email stats, and pipeline value.
+    The eligible leads (within the segment, if given) are snapshotted, then
+    emailed in checkpointed batches. Progress survives client disconnects
+    and restarts: interrupted campaigns resume automatically. Poll
+    GET /campaigns/{campaign_id} for progress.
     """
-    from app.database import get_database
+    _require_mongo("Background campaigns")
+    from app.campaign_runner import create_campaign
+    
+    query = await _segment_query(request.segment, request.segment_definition)
+    params = request.model_dump(exclude={"kind", "segment_definition"})
+    if request.kind == "ai":
+        params.pop("subject_template")
+        params.pop("body_template")
+    else:
+        params.pop("business_context")
+        params.pop("segment_drafts")
+        params.pop("leads_per_prompt")
     
     try:
-        db = get_database()
-        
-        # Get lead stats
-        total_leads = await db.leads.count_documents({})
-        hot_leads = await db.leads.count_documents({"status": "Hot"})
-        warm_leads = await db.leads.count_documents({"status": "Warm"})
-        qualified_leads = await db.leads.count_documents({"status": "Qualified"})
-        
-        # Get pipeline value
-        pipeline = [
-            {"$group": {"_id": None, "total_value": {"$sum": "$value"}}}
-        ]
-        value_result = await db.leads.aggregate(pipeline).to_list(1)
-        pipeline_value = value_result[0]["total_value"] if value_result else 0
-        
-        # Get email stats
-        total_emails = await db.email_history.count_documents({})
-        successful_emails = await db.email_history.count_documents({"success": True})
-        
-        # Get leads by status for chart
-        status_pipeline = [
-            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
-        ]
-        status_counts = {}
-        async for doc in db.leads.aggregate(status_pipeline):
-            status_counts[doc["_id"]] = doc["count"]
-        
-        # Get leads by source
-        source_pipeline = [
-            {"$group": {"_id": "$source", "count": {"$sum": 1}}}
-        ]
-        source_counts = {}
-        async for doc in db.leads.aggregate(source_pipeline):
-            source_counts[doc["_id"]] = doc["count"]
-        
-        # Get recent leads (last 7 days simulation - actually recent by created_at)
-        from datetime import datetime, timedelta
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        leads_this_week = await db.leads.count_documents({"created_at": {"$gte": week_ago}})
-        
-        return {
-            "totalLeads": total_leads,
-            "hotLeads": hot_leads,
-            "warmLeads": warm_leads,
-            "qualifiedLeads": qualified_leads,
-            "leadsThisWeek": leads_this_week,
-            "pipelineValue": pipeline_value,
-            "emailsSent": total_emails,
-            "emailsSuccessful": successful_emails,
-            "emailOpenRate": 68.4,  # Placeholder - would need tracking
-            "socialReach": 45200,  # Placeholder - would need integration
-            "socialEngagement": 8.7,
-            "byStatus": status_counts,
-            "bySource": source_counts
-        }
-        
+        return await create_campaign(request.kind, params, query)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error starting campaign: {str(e)}")
+
+
+@app.get("/campaigns", tags=["Campaigns"])
+async def list_background_campaigns(limit: int = 20, status: Optional[str] = None):
+    """
+    List recent background campaigns with their progress.
+    
+    Args:
+        status: running, paused, completed, cancelled or failed
+    """
+    _require_mongo("Background campaigns")
+    from app.campaign_runner import list_campaigns
+    
+    try:
+        campaigns = await list_campaigns(limit=limit, status=status)
+        return {"campaigns": campaigns, "count": len(campaigns)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
+@app.get("/campaigns/{campaign_id}", tags=["Campaigns"])
+async def get_background_campaign(campaign_id: str):
+    """Status and progress of a background campaign (counts per lead state, percent done)."""
+    from app.campaign_runner import get_campaign
+    
+    campaign = await get_campaign(_campaign_id(campaign_id))
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return campaign
+
+
+@app.get("/campaigns/{campaign_id}/leads", tags=["Campaigns"])
+async def get_background_campaign_leads(
+    campaign_id: str,
+    state: Optional[str] = None,
+    limit: int = 100,
+    skip: int = 0
+):
+    """
+    Per-lead state of a background campaign, in send order.
+    
+    Args:
+        state: pending, sending, sent, failed or skipped
+    """
+    from app.campaign_runner import get_campaign_leads, LEAD_STATES
+    
+    campaign_id = _campaign_id(campaign_id)
+    if state and state not in LEAD_STATES:
+        raise HTTPException(status_code=400, detail=f"Invalid state. Use: {', '.join(LEAD_STATES)}")
+    try:
+        leads = await get_campaign_leads(campaign_id, state=state, limit=limit, skip=skip)
+        return {"leads": leads, "count": len(leads)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.post("/campaigns/{campaign_id}/{action}", tags=["Campaigns"])
+async def control_background_campaign(campaign_id: str, action: str):
+    """
+    Pause, resume or cancel a background campaign.
+    
+    Pause and cancel take effect after the batch in flight is checkpointed.
+    Paused and failed campaigns can be resumed.
+    """
+    from app.campaign_runner import set_campaign_status
+    
+    statuses = {"pause": "paused", "resume": "running", "cancel": "cancelled"}
+    if action not in statuses:
+        raise HTTPException(status_code=404, detail=f"Unknown action. Use: {', '.join(statuses)}")
+    
+    campaign = await set_campaign_status(_campaign_id(campaign_id), statuses[action])
+    if not campaign:
+        raise HTTPException(status_code=409, detail=f"Campaign not found or cannot {action} in its current state")
+    return campaign
+
+
+# ============================================
+# Continuous Email Scheduler
+# ============================================
+
+from app.schemas import EmailSchedulerConfigRequest
+
+
+@app.get("/email-scheduler", tags=["Campaigns"])
+async def get_email_scheduler_settings():
+    """
+    Configuration and state of the continuous email scheduler: leads on the
+    schedule, when the next one is due, whether this worker is the sender,
+    and sends so far.
+    """
+    _require_mongo("The email scheduler")
+    from app.email_scheduler import get_email_scheduler_status
+    
+    try:
+        return await get_email_scheduler_status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.put("/email-scheduler", tags=["Campaigns"])
+async def configure_email_scheduler(request: EmailSchedulerConfigRequest):
+    """
+    Enable or disable the continuous email scheduler and set its templates.
+    
+    While enabled, every lead (in the segment, if given) is emailed as soon
+    as its score-based window opens: hot leads every 2 hours down to cold
+    leads every 48 hours, as in /leads/email-campaign.
+    """
+    _require_mongo("The email scheduler")
+    from app.email_scheduler import save_scheduler_config
+    
+    if request.segment:
+        await _segment_query(request.segment)  # 404 for unknown segments
+    try:
+        config = await save_scheduler_config(**request.model_dump())
+        config["updated_at"] = config["updated_at"].isoformat()
+        return {"success": True, "config": config}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+# ============================================
+# Outbox Endpoints
+# ============================================
+
+from app.schemas import OutboxMessageRequest
+
+
+@app.post("/outbox", tags=["Outbox"])
+async def queue_outbox_message(request: OutboxMessageRequest):
+    """
+    Queue an email or WhatsApp message for background delivery.
+    
+    Returns as soon as the message is stored. Sending the same
+    idempotency_key again is a no-op, so clients can retry safely.
+    """
+    _require_mongo("The outbox")
+    from app.outbox import enqueue_messages, CHANNELS
+    
+    if request.channel not in CHANNELS:
+        raise HTTPException(status_code=400, detail=f"Invalid channel. Use: {', '.join(CHANNELS)}")
+    if request.channel == "email" and not request.subject:
+        raise HTTPException(status_code=400, detail="Emails need a subject")
+    
+    key = request.idempotency_key or f"api:{uuid.uuid4().hex}"
+    try:
+        queued = await enqueue_messages([{**request.model_dump(exclude={"idempotency_key"}), "key": key}])
+        return {"success": True, "key": key, "duplicate": queued["duplicates"] > 0}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.get("/outbox", tags=["Outbox"])
+async def list_outbox(
+    state: Optional[str] = None,
+    campaign: Optional[str] = None,
+    limit: int = 100,
+    skip: int = 0
+):
+    """
+    Outbox messages (newest first) with counts per state.
+    
+    Args:
+        state: queued, sending, sent, failed or uncertain
+        campaign: Only messages of this campaign (as returned when queued)
+    """
+    _require_mongo("The outbox")
+    from app.outbox import list_outbox_messages, count_outbox_states, get_outbox_worker, STATES
+    
+    if state and state not in STATES:
+        raise HTTPException(status_code=400, detail=f"Invalid state. Use: {', '.join(STATES)}")
+    try:
+        messages = await list_outbox_messages(state=state, campaign=campaign, limit=limit, skip=skip)
+        return {
+            "counts": await count_outbox_states(campaign),
+            "worker": get_outbox_worker().get_stats(),
+            "messages": messages,
+            "count": len(messages)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.get("/outbox/{key}", tags=["Outbox"])
+async def get_outbox_entry(key: str):
+    """One outbox message with its state, attempts and last delivery result."""
+    _require_mongo("The outbox")
+    from app.outbox import get_outbox_message
+    
+    message = await get_outbox_message(key)
+    if not message:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return message
+
+
+@app.post("/outbox/{key}/retry", tags=["Outbox"])
+async def retry_outbox_entry(key: str):
+    """
+    Send a failed or uncertain message again.
+    
+    Uncertain messages may already have been delivered (the send was
+    interrupted or timed out); retrying them is a deliberate choice.
+    """
+    _require_mongo("The outbox")
+    from app.outbox import retry_message
+    
+    message = await retry_message(key)
+    if not message:
+        raise HTTPException(status_code=409, detail="Message not found, or not failed/uncertain")
+    return message
+
+
+# ============================================
+# Open & Click Tracking
+# ============================================
+
+from fastapi.responses import Response, RedirectResponse
+
+
+@app.get("/t/o/{token}", include_in_schema=False)
+async def track_open(token: str):
+    """Tracking pixel: counts an open and returns a 1x1 GIF."""
+    from app.tracking import read_token, get_engagement_tracker, PIXEL_GIF
+    
+    identity = read_token(token)
+    if identity:
+        get_engagement_tracker().record("open", *identity)
+    return Response(
+        content=PIXEL_GIF,
+        media_type="image/gif",
+        headers={"Cache-Control": "no-store, no-cache, must-revalidate, max-age=0"}
+    )
+
+
+@app.get("/t/c/{token}", include_in_schema=False)
+async def track_click(token: str, u: str, s: str):
+    """Tracked link: counts a click and redirects to the signed URL."""
+    from app.tracking import read_token, valid_click, get_engagement_tracker
+    
+    if not valid_click(token, u, s):
+        raise HTTPException(status_code=400, detail="Invalid link")
+    identity = read_token(token)
+    if identity:
+        get_engagement_tracker().record("click", *identity)
+    return RedirectResponse(u, status_code=302)
+
+
+@app.get("/engagement", tags=["Email Campaign"])
+async def get_email_engagement(campaign: Optional[str] = None, limit: int = 50):
+    """
+    Open and click counts and rates per campaign (unique opens/clicks over
+    tracked emails sent), plus totals and the ingestion pipeline's state.
+    """
+    _require_mongo("Engagement tracking")
+    from app.database import get_analytics_database
+    from app.tracking import get_campaign_engagement, get_engagement_totals, get_engagement_tracker
+    
+    try:
+        db = get_analytics_database()
+        campaigns = await get_campaign_engagement(db, campaign, limit)
+        if campaign and not campaigns:
+            raise HTTPException(status_code=404, detail="No engagement recorded for this campaign")
+        return {
+            "totals": await get_engagement_totals(db),
+            "campaigns": campaigns,
+            "pipeline": get_engagement_tracker().get_stats()
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.get("/engagement/leads/{lead_id}", tags=["Email Campaign"])
+async def get_lead_email_engagement(lead_id: str):
+    """Opens and clicks of one lead, per campaign."""
+    _require_mongo("Engagement tracking")
+    from app.database import get_analytics_database
+    from app.tracking import get_lead_engagement
+    
+    try:
+        campaigns = await get_lead_engagement(get_analytics_database(), lead_id)
+        return {"lead_id": lead_id, "campaigns": campaigns, "count": len(campaigns)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+# ============================================
+# Suppression List & Unsubscribe
+# ============================================
+
+from fastapi.responses import HTMLResponse
+from app.schemas import SuppressionRequest, UnsubscribeRequest
+
+
+_UNSUBSCRIBED_PAGE = """<html><body style="font-family: sans-serif; text-align: center; padding: 48px">
+<h2>You have been unsubscribed</h2><p>{address} will not receive any more emails from us.</p>
+</body></html>"""
+
+
+@app.get("/unsubscribe/{token}", response_class=HTMLResponse, include_in_schema=False)
+@app.post("/unsubscribe/{token}", response_class=HTMLResponse, include_in_schema=False)
+async def unsubscribe_link_endpoint(token: str):
+    """Unsubscribe link from an email (GET from the browser, POST for one-click List-Unsubscribe)."""
+    import html
+    _require_mongo("Unsubscribe")
+    from app.database import get_database
+    from app.suppression import read_unsubscribe_token, suppress_addresses
+    
+    address = read_unsubscribe_token(token)
+    if not address:
+        raise HTTPException(status_code=400, detail="Invalid unsubscribe link")
+    try:
+        await suppress_addresses(get_database(), [address], "unsubscribe", source="link")
+        return _UNSUBSCRIBED_PAGE.format(address=html.escape(address))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.post("/unsubscribe", tags=["Suppression"])
+async def unsubscribe(request: UnsubscribeRequest):
+    """
+    Unsubscribe an email address or WhatsApp number from all messages.
+    
+    Takes effect at once: every send path checks the suppression list.
+    """
+    _require_mongo("Unsubscribe")
+    from app.database import get_database
+    from app.suppression import suppress_addresses
+    
+    try:
+        result = await suppress_addresses(get_database(), [request.address], "unsubscribe", source="api")
+        if result["invalid"]:
+            raise HTTPException(status_code=400, detail="Invalid address")
+        return {"success": True, "address": request.address, "already_unsubscribed": bool(result["already_suppressed"])}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.post("/suppressions", tags=["Suppression"])
+async def add_suppressions(request: SuppressionRequest):
+    """
+    Add addresses to the suppression list, e.g. bounces or complaints
+    reported by the mail provider. Reason: unsubscribe, bounce, complaint
+    or manual.
+    """
+    _require_mongo("Suppression list")
+    from app.database import get_database
+    from app.suppression import suppress_addresses
+    
+    try:
+        return await suppress_addresses(get_database(), request.addresses, request.reason, source="api")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.get("/suppressions", tags=["Suppression"])
+async def get_suppressions(reason: Optional[str] = None, limit: int = 50, address: Optional[str] = None):
+    """
+    Recent suppressions with counts per reason, plus the in-memory index
+    (Bloom filter) state. With address, only whether it is suppressed.
+    """
+    _require_mongo("Suppression list")
+    from app.database import get_analytics_database
+    from app.suppression import list_suppressions, get_suppression_list, is_suppressed, normalize_address
+    
+    if address:
+        return {"address": normalize_address(address), "suppressed": is_suppressed(address)}
+    try:
+        return {
+            **await list_suppressions(get_analytics_database(), reason, limit),
+            "index": get_suppression_list().get_stats()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.delete("/suppressions/{address}", tags=["Suppression"])
+async def delete_suppression(address: str):
+    """
+    Allow an address again (e.g. a resubscribe). Other server processes
+    apply the removal at their next full reload (SUPPRESSION_RELOAD_SECONDS).
+    """
+    _require_mongo("Suppression list")
+    from app.database import get_database
+    from app.suppression import remove_suppression
+    
+    try:
+        if not await remove_suppression(get_database(), address):
+            raise HTTPException(status_code=404, detail="Address is not suppressed")
+        return {"success": True, "address": address}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+# ============================================
+# Export Endpoints
+# ============================================
+
+@app.get("/export/{export_name}", tags=["Export"])
+async def export_data(
+    export_name: str,
+    format: str = "ndjson",
+    gzip: bool = False,
+    status: Optional[str] = None,
+    source: Optional[str] = None,
+    type: Optional[str] = None,
+    platform: Optional[str] = None,
+    lead_id: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: int = 0
+):
+    """
+    Stream a full export of leads, email-history, generations or social-posts.
+    
+    Rows are streamed straight from the database cursor, so exports of any
+    size run in constant memory. Email history and generation exports
+    include archived rows (see /admin/archive/run), oldest first.
+    
+    Args:
+        format: "ndjson" or "csv"
+        gzip: Compress the stream with gzip
+        status / source: Filter leads (status also filters social posts)
+        type: Filter generations by type
+        platform: Filter social posts by platform
+        lead_id: Filter email history by lead
+        since / until: ISO datetime range on the record timestamp
+        limit: Maximum rows (0 = no limit)
+    """
+    _require_mongo("Exports")
+    from app.exporter import EXPORTS, export_stream
+    
+    if export_name not in EXPORTS:
+        raise HTTPException(status_code=404, detail=f"Unknown export. Use one of: {', '.join(EXPORTS)}")
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Invalid format. Use: ndjson or csv")
+    
+    _, time_field, _ = EXPORTS[export_name]
+    filters = {"status": status, "source": source, "type": type, "platform": platform, "lead_id": lead_id}
+    query = {field: value for field, value in filters.items() if value is not None}
+    
+    try:
+        time_range = {}
+        if since:
+            time_range["$gte"] = dt.fromisoformat(since.replace('Z', '+00:00'))
+        if until:
+            time_range["$lt"] = dt.fromisoformat(until.replace('Z', '+00:00'))
+        if time_range:
+            query[time_field] = time_range
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid datetime format. Use ISO format.")
+    
+    filename = f"{export_name}-{dt.utcnow():%Y%m%d-%H%M%S}.{format}" + (".gz" if gzip else "")
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    
+    return StreamingResponse(
+        export_stream(export_name, format, gzip, query, limit),
+        media_type="application/gzip" if gzip else media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+# ============================================
+# Dashboard Stats Endpoint
+# ============================================
+
+@app.get("/dashboard/stats", tags=["Dashboard"])
+async def get_dashboard_stats():
+    """
+    Get real-time dashboard statistics from the database.
+    
+    Returns lead counts, email stats, and pipeline value.
+    """
+    if not is_mongo():
+        return await _get_sqlite_dashboard_stats()
+    
+    from app.database import get_analytics_database
+    from app.rollups import get_rollups, rollup_total, rollup_counts
+    
+    try:
+        db = get_analytics_database()
+        
+        # All counts come from pre-aggregated rollups (O(buckets), not O(documents))
+        lead_rollups = await get_rollups(db, "leads")
+        email_rollups = await get_rollups(db, "email_history")
+        
+        # Get lead stats
+        status_counts = rollup_counts(lead_rollups, "status")
+        source_counts = rollup_counts(lead_rollups, "source")
+        total_leads = rollup_total(lead_rollups)
+        hot_leads = status_counts.get("Hot", 0)
+        warm_leads = status_counts.get("Warm", 0)
+        qualified_leads = status_counts.get("Qualified", 0)
+        
+        # Get pipeline value
+        pipeline_value = rollup_total(lead_rollups, "value")
+        
+        # Get email stats
+        total_emails = rollup_total(email_rollups)
+        successful_emails = rollup_total(email_rollups, "success")
+        
+        # Open/click rates from tracked emails (app/tracking.py)
+        from app.tracking import get_engagement_totals
+        engagement = await get_engagement_totals(db)
+        
+        # Leads created in the last 7 days (day-granularity buckets)
+        from datetime import datetime, timedelta
+        week_ago = (datetime.utcnow() - timedelta(days=7)).strftime("%Y-%m-%d")
+        leads_this_week = sum(
+            fields.get("count", 0)
+            for day, fields in lead_rollups.get("day", {}).items()
+            if day > week_ago
+        )
+        
+        return {
+            "totalLeads": total_leads,
+            "hotLeads": hot_leads,
+            "warmLeads": warm_leads,
+            "qualifiedLeads": qualified_leads,
+            "leadsThisWeek": leads_this_week,
+            "pipelineValue": pipeline_value,
+            "emailsSent": total_emails,
+            "emailsSuccessful": successful_emails,
+            "emailOpenRate": engagement["open_rate"],
+            "emailClickRate": engagement["click_rate"],
+            "socialReach": 45200,  # Placeholder - would need integration
+            "socialEngagement": 8.7,
+            "byStatus": status_counts,
+            "bySource": source_counts
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+async def _get_sqlite_dashboard_stats():
+    """Dashboard stats on the sqlite backend (no rollups or engagement tracking)."""
+    from app.sqlite_database import get_dashboard_counts
+    
+    try:
+        counts = await get_dashboard_counts()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    status_counts = counts["by_status"]
+    return {
+        "totalLeads": counts["total_leads"],
+        "hotLeads": status_counts.get("Hot", 0),
+        "warmLeads": status_counts.get("Warm", 0),
+        "qualifiedLeads": status_counts.get("Qualified", 0),
+        "leadsThisWeek": counts["leads_this_week"],
+        "pipelineValue": counts["pipeline_value"],
+        "emailsSent": counts["emails_sent"],
+        "emailsSuccessful": counts["emails_successful"],
+        "emailOpenRate": 0.0,
+        "emailClickRate": 0.0,
+        "socialReach": 45200,  # Placeholder - would need integration
+        "socialEngagement": 8.7,
+        "byStatus": status_counts,
+        "bySource": counts["by_source"]
+    }
+
+
+@app.post("/admin/rollups/rebuild", tags=["Admin"])
+async def rebuild_rollup_counters():
+    """
+    Recompute all rollup counters from the source collections.
+    
+    Only needed to repair drift or after bulk changes made outside the API.
+    """
+    _require_mongo("Rollups")
+    from app.database import get_database
+    from app.rollups import rebuild_rollups
+    
+    try:
+        counted = await rebuild_rollups(get_database())
+        return {"success": True, "counted": counted}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.post("/admin/search/reindex", tags=["Admin"])
+async def reindex_search():
+    """
+    Rebuild the full-text search index from generations, social posts and
+    website analyses.
+    
+    New content is indexed as it is saved; this backfills content saved
+    before search existed, or repairs the index.
+    """
+    _require_mongo("Search")
+    from app.database import get_database
+    from app.search import rebuild_search_index
+    
+    try:
+        indexed = await rebuild_search_index(get_database())
+        return {"success": True, "indexed": indexed}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.post("/admin/leads/rescore", tags=["Admin"])
+async def rescore_all_leads(dry_run: bool = False):
+    """
+    Rescore all leads from their status, deal value, last contact and
+    (decayed) email history, in one vectorized pass.
+    
+    Only leads whose priority tier changes are written back.
+    
+    Args:
+        dry_run: Compute and report tier changes without writing them
+    """
+    _require_mongo("Bulk rescoring")
+    from app.lead_scoring import rescore_leads
+    
+    try:
+        return await rescore_leads(dry_run=dry_run)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.post("/admin/leads/dedupe", tags=["Admin"])
+async def dedupe_leads(dry_run: bool = True, threshold: Optional[float] = None):
+    """
+    Find and merge duplicate leads (same person under email variants or
+    spelling differences).
+    
+    Each group of duplicates is merged into its oldest lead; email history
+    is repointed to it and dashboard counters are adjusted. Run once with
+    dry_run=false after upgrading, so existing leads get their dedupe keys.
+    
+    Args:
+        dry_run: Only report the duplicate groups found (default true)
+        threshold: Match score needed to merge (default DEDUPE_THRESHOLD)
+    """
+    _require_mongo("Lead deduplication")
+    from app.lead_dedupe import merge_duplicate_leads, DEDUPE_THRESHOLD
+    
+    try:
+        return await merge_duplicate_leads(dry_run=dry_run, threshold=threshold or DEDUPE_THRESHOLD)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.post("/admin/segments/backfill-email-counts", tags=["Admin"])
+async def backfill_segment_email_counts():
+    """
+    Recompute every lead's emails_sent / emails_failed counters from hot
+    and archived email history.
+    
+    The counters are maintained on every history write; run this once for
+    history recorded before they existed.
+    """
+    _require_mongo("Segments")
+    from app.segments import backfill_email_counts
+    
+    try:
+        return await backfill_email_counts()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.post("/admin/archive/run", tags=["Admin"])
+async def run_archive(older_than_days: Optional[int] = None, target: Optional[str] = None):
+    """
+    Archive email history, generations and website analyses older than
+    `older_than_days` (default ARCHIVE_AFTER_DAYS).
+    
+    Args:
+        target: "collection" (compressed archive collections) or "file"
+                (gzip NDJSON under ARCHIVE_DIR); defaults to ARCHIVE_TARGET
+    """
+    _require_mongo("Archival")
+    from app.archival import run_archival, ARCHIVE_AFTER_DAYS, ARCHIVE_TARGET
+    
+    try:
+        archived = await run_archival(
+            older_than_days=older_than_days if older_than_days is not None else ARCHIVE_AFTER_DAYS,
+            target=target or ARCHIVE_TARGET
+        )
+        return {"success": True, "archived": archived}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.get("/admin/archive/status", tags=["Admin"])
+async def archive_status():
+    """
+    Get hot vs archived document counts per collection.
+    """
+    _require_mongo("Archival")
+    from app.archival import get_archive_status
+    
+    try:
+        return await get_archive_status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.post("/admin/compression/train-dictionary", tags=["Admin"])
+async def train_compression_dictionary(sample_limit: int = 5000):
+    """
+    Train a zstd dictionary on recent generated content and use it for new writes.
+    """
+    _require_mongo("Content compression")
+    from app.database import get_database
+    from app.content_store import train_dictionary
+    
+    try:
+        return await train_dictionary(get_database(), sample_limit=sample_limit)
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.post("/admin/compression/compress-existing", tags=["Admin"])
+async def compress_existing_content():
+    """
+    Compress generated content stored before compression was enabled.
+    """
+    _require_mongo("Content compression")
+    from app.database import get_database
+    from app.content_store import compress_existing, PACKED_FIELDS
+    
+    try:
+        db = get_database()
+        rewritten = {name: await compress_existing(db, name) for name in PACKED_FIELDS}
+        return {"success": True, "rewritten": rewritten}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.get("/admin/content-store", tags=["Admin"])
+async def content_store_stats():
+    """
+    Get deduplicated content store stats (distinct blobs, references,
+    unique vs logical bytes).
+    """
+    _require_mongo("The content store")
+    from app.database import get_database
+    from app.content_store import get_store_stats
+    
+    try:
+        return await get_store_stats(get_database())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@app.get("/admin/write-queues", tags=["Admin"])
+async def get_write_queue_metrics():
+    """
+    Get metrics for the buffered write paths.
+    
+    - write_behind: generation/analysis/social post history queue
+      (queue depth, written, dropped and failed writes)
+    - email_history: buffered campaign email history writer
+    """
+    from app.write_behind import get_write_behind_queue
+    
+    return {
+        "write_behind": get_write_behind_queue().get_metrics(),
+        "email_history": history_writer.get_stats()
+    }
+
+
+@app.get("/admin/smtp-pool", tags=["Admin"])
+async def smtp_pool_status():
+    """
+    SMTP connection pool metrics: open/idle connections, reuse and
+    recycling counts, NOOP health checks and average connect/send times.
+    """
+    from app.integrations.email_sender import get_smtp_pool_stats
+    
+    stats = get_smtp_pool_stats()
+    return {"active": stats is not None, "pool": stats}
+
+
+@app.get("/admin/send-pacing", tags=["Admin"])
+async def send_pacing_status():
+    """
+    Email send pacing: daily and per-minute budgets used, the current global
+    rate, per-domain bucket settings, and how long sends waited or were
+    deferred by the limits.
+    """
+    from app.send_pacing import get_send_pacer
+    
+    return get_send_pacer().get_stats()
+
+
+@app.get("/admin/slow-queries", tags=["Admin"])
+async def list_slow_queries(limit: int = 20, sort_by: str = "total_ms", slow_only: bool = True):
+    """
+    Get the top MongoDB query shapes recorded by the query profiler.
+    
+    Each shape includes call counts, total/avg/max latency, how often it
+    exceeded SLOW_QUERY_MS, and its explain plan once captured with
+    POST /admin/slow-queries/{shape_id}/explain (COLLSCAN vs IXSCAN,
+    indexes used, docs examined vs returned).
+    
+    Args:
+        limit: Number of shapes to return
+        sort_by: total_ms, max_ms, count or slow_count
+        slow_only: Only include shapes that were slow at least once
+    """
+    from app.query_profiler import get_slow_queries
+    
+    if sort_by not in ("total_ms", "max_ms", "count", "slow_count"):
+        raise HTTPException(status_code=400, detail="Invalid sort_by. Use: total_ms, max_ms, count, slow_count")
+    
+    return get_slow_queries(limit=limit, sort_by=sort_by, slow_only=slow_only)
+
+
+@app.post("/admin/slow-queries/{shape_id}/explain", tags=["Admin"])
+async def explain_slow_query(shape_id: str):
+    """
+    Re-run explain for a query shape's most recent slow call.
+    """
+    _require_mongo("Query explain")
+    from app.query_profiler import explain_shape
+    
+    try:
+        result = await explain_shape(shape_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    if result is None:
+        raise HTTPException(status_code=404, detail="No slow call recorded for this shape")
+    return result
+
+
+@app.post("/admin/slow-queries/reset", tags=["Admin"])
+async def reset_slow_queries():
+    """
+    Clear all recorded query shapes.
+    """
+    from app.query_profiler import reset
+    
+    reset()
+    return {"success": True}
+
+
 @app.get("/dashboard/activities", tags=["Dashboard"])
 async def get_recent_activities():
     """
@@ -0,0 +1,405 @@
+"""
+Message Outbox for AI Marketing Agent.
+Decouples deciding to send a message from sending it. Campaign code
+enqueues emails and WhatsApp messages into the `outbox` collection and
+returns at once; outbox workers deliver them in the background.
+
+Every message is keyed by an idempotency key (campaign + lead + step) used
+as its `_id`, so enqueueing the same message twice - a retried request, a
+re-run campaign - stores it once. Message states:
+
+    queued -> sending -> sent
+                      -> queued (retry with backoff) -> ... -> failed
+                      -> uncertain
+
+Workers claim a batch atomically (queued -> sending, with a claim token and
+a lease renewed while they work) and record each outcome only on their own
+claim. A message whose lease expires while "sending" - the worker crashed
+mid-send - is marked uncertain and never retried automatically: it may
+already have been delivered. The same goes for emails that timed out
+after the message was handed to the server and WhatsApp sends that failed
+after the request reached Twilio (read timeouts, dropped connections, 5xx);
+connect timeouts and explicit rejections are retried. Uncertain and failed messages are
+resent only by an explicit retry (POST /outbox/{key}/retry).
+
+Emails get a Message-ID derived from the idempotency key, so even a
+manually retried message is recognisably the same email.
+"""
+
+import asyncio
+import hashlib
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from app.database import get_database
+from app.campaign_runner import WORKER_ID
+from app.email_delivery import deliver_emails
+from app.history_writer import get_history_writer
+
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE") or "50")
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS") or "2")
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS") or "120")
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS") or "5")
+OUTBOX_RETRY_BACKOFF_SECONDS = float(os.getenv("OUTBOX_RETRY_BACKOFF_SECONDS") or "60")
+OUTBOX_WHATSAPP_CONCURRENCY = int(os.getenv("OUTBOX_WHATSAPP_CONCURRENCY") or "4")
+OUTBOX_SHUTDOWN_GRACE_SECONDS = float(os.getenv("OUTBOX_SHUTDOWN_GRACE_SECONDS") or "20")
+
+OUTBOX_COLLECTION = "outbox"
+CHANNELS = ["email", "whatsapp"]
+STATES = ["queued", "sending", "sent", "failed", "uncertain"]
+
+
+def idempotency_key(campaign: str, lead: str, step: str = "email") -> str:
+    """Key identifying one message of one campaign to one lead."""
+    return f"{campaign}:{lead}:{step}"
+
+
+def message_id_for(key: str, sender: Optional[str] = None) -> str:
+    """Deterministic Message-ID for an outbox email."""
+    domain = (sender or "").rsplit("@", 1)[-1] or "outbox.local"
+    return f"<{hashlib.sha256(key.encode()).hexdigest()[:32]}@{domain}>"
+
+
+async def ensure_outbox_indexes(db) -> None:
+    await db[OUTBOX_COLLECTION].create_index([("state", 1), ("available_at", 1)])
+    await db[OUTBOX_COLLECTION].create_index([("state", 1), ("lease_expires_at", 1)])
+    await db[OUTBOX_COLLECTION].create_index([("campaign", 1), ("state", 1)])
+    await db[OUTBOX_COLLECTION].create_index("claim")
+
+
+def _serialize(doc: Dict[str, Any]) -> Dict[str, Any]:
+    doc["key"] = doc.pop("_id")
+    doc.pop("claim", None)
+    for field in ("created_at", "updated_at", "available_at", "lease_expires_at", "sent_at"):
+        if doc.get(field):
+            doc[field] = doc[field].isoformat()
+    return doc
+
+
+# ============================================
+# Enqueueing
+# ============================================
+
+async def enqueue_messages(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Add messages to the outbox; messages whose key is already there are ignored.
+
+    Args:
+        messages: dicts with key (see `idempotency_key`), channel ("email"
+            or "whatsapp"), to and body; emails also have a subject.
+            Optional: lead_id (emails are then recorded in email history),
+            campaign, and score (delivery priority).
+
+    Returns:
+        dict with queued / duplicates counts and the keys
+    """
+    now = datetime.utcnow()
+    sender = os.getenv("GMAIL_ADDRESS")
+    documents = []
+    for message in messages:
+        if message.get("channel", "email") not in CHANNELS:
+            raise ValueError(f"Invalid channel '{message.get('channel')}'. Use: {', '.join(CHANNELS)}")
+        documents.append({
+            "_id": message["key"],
+            "channel": message.get("channel", "email"),
+            "to": message["to"],
+            "subject": message.get("subject"),
+            "body": message["body"],
+            "message_id": message_id_for(message["key"], sender) if message.get("channel", "email") == "email" else None,
+            "lead_id": message.get("lead_id"),
+            "campaign": message.get("campaign"),
+            "score": message.get("score", 50),
+            "state": "queued",
+            "attempts": 0,
+            "available_at": now,
+            "lease_expires_at": None,
+            "result": None,
+            "created_at": now,
+            "updated_at": now,
+            "sent_at": None,
+        })
+
+    duplicates = 0
+    if documents:
+        try:
+            await get_database()[OUTBOX_COLLECTION].insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            duplicates = len(errors)
+        get_outbox_worker().wake()
+
+    return {
+        "queued": len(documents) - duplicates,
+        "duplicates": duplicates,
+        "keys": [document["_id"] for document in documents],
+    }
+
+
+async def get_outbox_message(key: str) -> Optional[Dict[str, Any]]:
+    doc = await get_database()[OUTBOX_COLLECTION].find_one({"_id": key})
+    return _serialize(doc) if doc else None
+
+
+async def list_outbox_messages(
+    state: Optional[str] = None,
+    campaign: Optional[str] = None,
+    limit: int = 100,
+    skip: int = 0
+) -> List[Dict[str, Any]]:
+    query: Dict[str, Any] = {}
+    if state:
+        query["state"] = state
+    if campaign:
+        query["campaign"] = campaign
+    cursor = get_database()[OUTBOX_COLLECTION].find(query, {"body": 0}).sort("created_at", -1).skip(skip).limit(limit)
+    return [_serialize(doc) async for doc in cursor]
+
+
+async def count_outbox_states(campaign: Optional[str] = None) -> Dict[str, int]:
+    pipeline = [{"$match": {"campaign": campaign}}] if campaign else []
+    pipeline.append({"$group": {"_id": "$state", "count": {"$sum": 1}}})
+    counts = {state: 0 for state in STATES}
+    async for row in get_database()[OUTBOX_COLLECTION].aggregate(pipeline):
+        counts[row["_id"]] = row["count"]
+    return counts
+
+
+async def retry_message(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Queue a failed or uncertain message again (an operator's decision: an
+    uncertain message may already have been delivered).
+    """
+    now = datetime.utcnow()
+    doc = await get_database()[OUTBOX_COLLECTION].find_one_and_update(
+        {"_id": key, "state": {"$in": ["failed", "uncertain"]}},
+        {"$set": {"state": "queued", "available_at": now, "updated_at": now, "attempts": 0}, "$unset": {"claim": ""}},
+        return_document=ReturnDocument.AFTER
+    )
+    if doc:
+        get_outbox_worker().wake()
+    return _serialize(doc) if doc else None
+
+
+# ============================================
+# Delivery Worker
+# ============================================
+
+class OutboxWorker:
+    """Claims queued messages in batches and delivers them."""
+
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.stats = {"batches": 0, "sent": 0, "retried": 0, "failed": 0, "uncertain": 0, "deferred": 0}
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    async def _expire_leases(self, collection) -> int:
+        """Messages whose worker died mid-send may have gone out: mark them uncertain."""
+        now = datetime.utcnow()
+        result = await collection.update_many(
+            {"state": "sending", "lease_expires_at": {"$lt": now}},
+            {"$set": {
+                "state": "uncertain",
+                "result": "Worker lease expired during the send; it may or may not have been delivered",
+                "updated_at": now,
+            }}
+        )
+        if result.modified_count:
+            self.stats["uncertain"] += result.modified_count
+            print(f"[Outbox] {result.modified_count} interrupted sends marked uncertain")
+        return result.modified_count
+
+    async def _claim(self, collection) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        now = datetime.utcnow()
+        candidates = await collection.find(
+            {"state": "queued", "available_at": {"$lte": now}}, {"_id": 1}
+        ).sort([("available_at", 1), ("score", -1)]).limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return None, []
+
+        claim = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+        await collection.update_many(
+            {"_id": {"$in": [doc["_id"] for doc in candidates]}, "state": "queued"},
+            {
+                "$set": {
+                    "state": "sending", "claim": claim, "updated_at": now,
+                    "lease_expires_at": now + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+                },
+                "$inc": {"attempts": 1},
+            }
+        )
+        return claim, await collection.find({"claim": claim, "state": "sending"}).to_list(None)
+
+    async def _renew_lease(self, collection, claim: str) -> None:
+        while True:
+            await asyncio.sleep(OUTBOX_LEASE_SECONDS / 3)
+            try:
+                await collection.update_many(
+                    {"claim": claim, "state": "sending"},
+                    {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=OUTBOX_LEASE_SECONDS)}}
+                )
+            except Exception as e:
+                print(f"[Outbox] Lease renewal failed for {claim}: {e}")
+
+    def _outcome(self, message: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+        """The update recording one delivery result."""
+        now = datetime.utcnow()
+        update: Dict[str, Any] = {"result": result["message"], "updated_at": now, "lease_expires_at": None}
+        if result["success"]:
+            update.update(state="sent", sent_at=now)
+            self.stats["sent"] += 1
+        elif result.get("deferred"):
+            # Never attempted (daily send limit): not an attempt
+            update.update(state="queued", available_at=result["retry_at"] or now, attempts=message["attempts"] - 1)
+            self.stats["deferred"] += 1
+        elif result.get("uncertain"):
+            update["state"] = "uncertain"
+            self.stats["uncertain"] += 1
+        elif result.get("suppressed") or result.get("bounced"):
+            # Retrying cannot help: the recipient unsubscribed, complained or does not exist
+            update["state"] = "failed"
+            self.stats["failed"] += 1
+        elif message["attempts"] < OUTBOX_MAX_ATTEMPTS:
+            backoff = OUTBOX_RETRY_BACKOFF_SECONDS * 2 ** (message["attempts"] - 1)
+            update.update(state="queued", available_at=now + timedelta(seconds=backoff))
+            self.stats["retried"] += 1
+        else:
+            update["state"] = "failed"
+            self.stats["failed"] += 1
+        return update
+
+    async def _record(self, collection, claim: str, message: Dict[str, Any], result: Dict[str, Any]) -> None:
+        # Only on our claim; an expired lease (uncertain) is corrected by the real outcome
+        await collection.update_one({"_id": message["_id"], "claim": claim}, {"$set": self._outcome(message, result)})
+        if message["channel"] == "email" and message.get("lead_id") and not (result.get("deferred") or result.get("suppressed")):
+            await get_history_writer().add(
+                lead_id=message["lead_id"],
+                lead_email=message["to"],
+                subject=message["subject"],
+                success=result["success"],
+                message=result["message"]
+            )
+
+    async def _send_whatsapp(self, messages: List[Dict[str, Any]], collection, claim: str) -> None:
+        from app.integrations.whatsapp_sender import send_whatsapp
+
+        semaphore = asyncio.Semaphore(OUTBOX_WHATSAPP_CONCURRENCY)
+
+        async def send(message):
+            async with semaphore:
+                result = await asyncio.to_thread(send_whatsapp, message["to"], message["body"])
+            await self._record(collection, claim, message, result)
+
+        await asyncio.gather(*(send(message) for message in messages))
+
+    async def process_batch(self) -> int:
+        """Claim and deliver one batch. Returns how many messages were claimed."""
+        collection = get_database()[OUTBOX_COLLECTION]
+        await self._expire_leases(collection)
+        claim, batch = await self._claim(collection)
+        if not batch:
+            return 0
+
+        heartbeat = asyncio.create_task(self._renew_lease(collection, claim))
+        try:
+            emails = {message["_id"]: message for message in batch if message["channel"] == "email"}
+            whatsapp = [message for message in batch if message["channel"] == "whatsapp"]
+
+            outgoing = [
+                {
+                    "key": key, "to": message["to"], "subject": message["subject"] or "",
+                    "body": message["body"], "score": message.get("score", 50),
+                    "message_id": message.get("message_id"),
+                    "lead_id": message.get("lead_id"), "campaign": message.get("campaign"),
+                }
+                for key, message in emails.items()
+            ]
+            await asyncio.gather(
+                self._send_whatsapp(whatsapp, collection, claim),
+                self._deliver_emails(outgoing, emails, collection, claim)
+            )
+            await get_history_writer().flush()
+        finally:
+            heartbeat.cancel()
+
+        self.stats["batches"] += 1
+        return len(batch)
+
+    async def _deliver_emails(self, outgoing, emails, collection, claim: str) -> None:
+        async for result in deliver_emails(outgoing):
+            await self._record(collection, claim, emails[result["key"]], result)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                claimed = await self.process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Outbox] Delivery batch failed: {e}")
+                claimed = 0
+            if claimed < self.batch_size and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), OUTBOX_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    def start(self) -> None:
+        self._stopping = False
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            print(f"[Outbox] Delivery worker started ({WORKER_ID})")
+
+    async def stop(self) -> None:
+        """
+        Stop the worker, letting the batch in flight finish for up to
+        OUTBOX_SHUTDOWN_GRACE_SECONDS. A batch still unfinished then is
+        abandoned: its lease expires and its unconfirmed messages become
+        uncertain.
+        """
+        self._stopping = True
+        self._wake.set()
+        if self._task and not self._task.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), OUTBOX_SHUTDOWN_GRACE_SECONDS)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+                await asyncio.gather(self._task, return_exceptions=True)
+                print("[Outbox] Shutdown grace period over: batch in flight abandoned")
+        self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "running": self._task is not None and not self._task.done(), "worker_id": WORKER_ID}
+
+
+_worker: Optional[OutboxWorker] = None
+
+
+def get_outbox_worker() -> OutboxWorker:
+    """Get the process-wide outbox worker."""
+    global _worker
+    if _worker is None:
+        _worker = OutboxWorker()
+    return _worker
+
+
+def start_outbox_worker() -> None:
+    get_outbox_worker().start()
+
+
+async def stop_outbox_worker() -> None:
+    if _worker is not None:
+        await _worker.stop()
@@ -0,0 +1,389 @@
+"""
+Query Profiler for AI Marketing Agent.
+Times every MongoDB operation issued through `get_database()` and
+`get_analytics_database()`, aggregates them by query shape, and logs any
+call slower than SLOW_QUERY_MS.
+
+Each slow shape keeps its latest slow call, and its plan is captured with
+`explain()` on request (POST /admin/slow-queries/{shape_id}/explain), showing
+whether it used an index (IXSCAN) or scanned the collection (COLLSCAN), and
+how many documents it examined versus returned. Explain re-executes the
+query, so it is not run automatically unless SLOW_QUERY_EXPLAIN is set.
+
+A query shape is the operation plus its filter, sort and projection, with
+every value replaced by "?", e.g.
+`leads.find {"status": "?", "created_at": {"$gte": "?"}} sort=[["score", -1]]`.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Set
+
+
+QUERY_PROFILING = (os.getenv("QUERY_PROFILING") or "true").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS") or "100")
+# Explain each new slow shape automatically (re-runs it, adding load while the database is slow)
+SLOW_QUERY_EXPLAIN = (os.getenv("SLOW_QUERY_EXPLAIN") or "false").lower() in ("1", "true", "yes")
+MAX_SHAPES = int(os.getenv("SLOW_QUERY_MAX_SHAPES") or "500")
+
+# Collection methods that run a single command, and where their filter is
+TIMED_METHODS = {
+    "find_one": 0, "count_documents": 0, "distinct": 1,
+    "update_one": 0, "update_many": 0, "replace_one": 0,
+    "delete_one": 0, "delete_many": 0,
+    "find_one_and_update": 0, "find_one_and_replace": 0, "find_one_and_delete": 0,
+    "insert_one": None, "insert_many": None, "bulk_write": None,
+    "estimated_document_count": None, "create_index": None,
+}
+
+_shapes: Dict[str, Dict[str, Any]] = {}
+_explain_tasks: Set[asyncio.Task] = set()
+
+
+# ============================================
+# Query Shapes
+# ============================================
+
+def _shape(value: Any) -> Any:
+    """Replace every value in a filter/sort/pipeline with "?", keeping keys and operators."""
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(item, (dict, list, tuple)) for item in value):
+            return [_shape(item) for item in value]
+        return ["?"] if value else []
+    return "?"
+
+
+def _sort_spec(sort: Any) -> Optional[List[Any]]:
+    if sort is None:
+        return None
+    if isinstance(sort, str):
+        return [[sort, 1]]
+    return [list(item) if isinstance(item, (list, tuple)) else [item, 1] for item in sort]
+
+
+def shape_key(collection: str, operation: str, spec: Dict[str, Any]) -> str:
+    """Readable shape string for an operation's spec (filter, sort, projection, pipeline)."""
+    parts = [f"{collection}.{operation}"]
+    if "pipeline" in spec:
+        parts.append(json.dumps(_shape(spec["pipeline"]), sort_keys=True, default=str))
+    if spec.get("filter") is not None:
+        parts.append(json.dumps(_shape(spec["filter"]), sort_keys=True, default=str))
+    if spec.get("sort"):
+        parts.append(f"sort={json.dumps(spec['sort'])}")
+    if spec.get("projection"):
+        parts.append(f"projection={json.dumps(sorted(spec['projection']) if isinstance(spec['projection'], dict) else spec['projection'])}")
+    return " ".join(parts)
+
+
+def _shape_id(key: str) -> str:
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+# ============================================
+# Recording
+# ============================================
+
+def record(raw_db, collection: str, operation: str, spec: Dict[str, Any], elapsed_ms: float) -> None:
+    """Add one timed call to its shape's stats; log and explain it if slow."""
+    key = shape_key(collection, operation, spec)
+    shape_id = _shape_id(key)
+
+    stats = _shapes.get(shape_id)
+    if stats is None:
+        if len(_shapes) >= MAX_SHAPES:
+            # Evict the shape with the least total time
+            del _shapes[min(_shapes, key=lambda s: _shapes[s]["total_ms"])]
+        stats = _shapes[shape_id] = {
+            "shape_id": shape_id,
+            "shape": key,
+            "collection": collection,
+            "operation": operation,
+            "count": 0,
+            "slow_count": 0,
+            "total_ms": 0.0,
+            "max_ms": 0.0,
+            "last_slow_at": None,
+            "explain": None,
+            "_sample": None,
+        }
+
+    stats["count"] += 1
+    stats["total_ms"] += elapsed_ms
+    stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    if elapsed_ms < SLOW_QUERY_MS:
+        return
+
+    stats["slow_count"] += 1
+    stats["last_slow_at"] = datetime.utcnow()
+    stats["_sample"] = (raw_db, spec)
+    print(f"[SlowQuery] {elapsed_ms:.0f}ms {key}")
+
+    if SLOW_QUERY_EXPLAIN and stats["explain"] is None and _explainable(spec):
+        stats["explain"] = {"status": "pending"}
+        task = asyncio.create_task(_explain_into(stats, raw_db, collection, spec))
+        _explain_tasks.add(task)
+        task.add_done_callback(_explain_tasks.discard)
+
+
+# ============================================
+# Explain
+# ============================================
+
+def _explainable(spec: Dict[str, Any]) -> bool:
+    return "pipeline" in spec or spec.get("filter") is not None
+
+
+def _find_all(value: Any, key: str) -> List[Any]:
+    """Collect every value stored under `key` anywhere in a nested explain document."""
+    found = []
+    if isinstance(value, dict):
+        for k, item in value.items():
+            if k == key:
+                found.append(item)
+            found.extend(_find_all(item, key))
+    elif isinstance(value, list):
+        for item in value:
+            found.extend(_find_all(item, key))
+    return found
+
+
+def summarize_explain(explain: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reduce explain output to what matters: plan stages, indexes used and
+    docs/keys examined vs returned. Handles find and aggregate explains.
+    """
+    plans = [planner.get("winningPlan", {}) for planner in _find_all(explain, "queryPlanner")]
+    stages = []
+    for plan in plans:
+        for stage in _find_all(plan, "stage"):
+            if stage not in stages:
+                stages.append(stage)
+    indexes = sorted({name for plan in plans for name in _find_all(plan, "indexName")})
+
+    execution = _find_all(explain, "executionStats")
+    docs_examined = sum(stats.get("totalDocsExamined", 0) for stats in execution)
+    keys_examined = sum(stats.get("totalKeysExamined", 0) for stats in execution)
+    returned = sum(stats.get("nReturned", 0) for stats in execution)
+
+    return {
+        "status": "ok",
+        "collscan": "COLLSCAN" in stages,
+        "stages": stages,
+        "indexes": indexes,
+        "docs_examined": docs_examined,
+        "keys_examined": keys_examined,
+        "docs_returned": returned,
+        "execution_ms": sum(stats.get("executionTimeMillis", 0) for stats in execution),
+        "explained_at": datetime.utcnow().isoformat(),
+    }
+
+
+async def explain(raw_db, collection: str, spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run `explain` (executionStats) for a recorded operation.
+
+    Aggregations explain their pipeline; every other operation explains a
+    find with its filter and sort, which selects documents the same way.
+    """
+    if "pipeline" in spec:
+        command = {"aggregate": collection, "pipeline": spec["pipeline"], "cursor": {}}
+    else:
+        command = {"find": collection, "filter": spec.get("filter") or {}}
+        if spec.get("sort"):
+            command["sort"] = {field: direction for field, direction in spec["sort"]}
+        if spec.get("limit"):
+            command["limit"] = spec["limit"]
+
+    result = await raw_db.command({"explain": command, "verbosity": "executionStats"})
+    return summarize_explain(result)
+
+
+async def _explain_into(stats: Dict[str, Any], raw_db, collection: str, spec: Dict[str, Any]) -> None:
+    try:
+        stats["explain"] = await explain(raw_db, collection, spec)
+    except Exception as e:
+        stats["explain"] = {"status": "error", "error": str(e)}
+
+
+async def explain_shape(shape_id: str) -> Optional[Dict[str, Any]]:
+    """Re-run explain for a shape's latest slow call. Returns None for unknown shapes."""
+    stats = _shapes.get(shape_id)
+    if stats is None or stats["_sample"] is None:
+        return None
+    raw_db, spec = stats["_sample"]
+    await _explain_into(stats, raw_db, stats["collection"], spec)
+    return stats["explain"]
+
+
+# ============================================
+# Reporting
+# ============================================
+
+def get_slow_queries(limit: int = 20, sort_by: str = "total_ms", slow_only: bool = True) -> Dict[str, Any]:
+    """Top query shapes by total_ms, max_ms, count or slow_count."""
+    shapes = [s for s in _shapes.values() if s["slow_count"] or not slow_only]
+    shapes.sort(key=lambda s: s.get(sort_by, 0), reverse=True)
+
+    return {
+        "enabled": QUERY_PROFILING,
+        "threshold_ms": SLOW_QUERY_MS,
+        "tracked_shapes": len(_shapes),
+        "shapes": [
+            {
+                **{k: v for k, v in s.items() if not k.startswith("_")},
+                "avg_ms": round(s["total_ms"] / s["count"], 2),
+                "total_ms": round(s["total_ms"], 2),
+                "max_ms": round(s["max_ms"], 2),
+                "last_slow_at": s["last_slow_at"].isoformat() if s["last_slow_at"] else None,
+            }
+            for s in shapes[:limit]
+        ],
+    }
+
+
+def reset() -> None:
+    """Forget all recorded shapes."""
+    _shapes.clear()
+
+
+# ============================================
+# Profiling Proxies
+# ============================================
+
+class ProfiledCursor:
+    """
+    Wraps a find/aggregate cursor. Chained modifiers update the recorded
+    spec; time is counted only while awaiting the server, not while the
+    caller processes documents.
+    """
+
+    def __init__(self, cursor, raw_db, collection: str, operation: str, spec: Dict[str, Any]):
+        self._cursor = cursor
+        self._raw_db = raw_db
+        self._collection = collection
+        self._operation = operation
+        self._spec = spec
+        self._elapsed = 0.0
+
+    def sort(self, key_or_list, direction=None):
+        self._cursor = self._cursor.sort(key_or_list, direction) if direction is not None else self._cursor.sort(key_or_list)
+        self._spec["sort"] = _sort_spec([(key_or_list, direction)] if direction is not None else key_or_list)
+        return self
+
+    def limit(self, limit: int):
+        self._cursor = self._cursor.limit(limit)
+        self._spec["limit"] = limit
+        return self
+
+    def skip(self, skip: int):
+        self._cursor = self._cursor.skip(skip)
+        return self
+
+    def batch_size(self, batch_size: int):
+        self._cursor = self._cursor.batch_size(batch_size)
+        return self
+
+    async def to_list(self, length=None):
+        start = time.perf_counter()
+        try:
+            return await self._cursor.to_list(length)
+        finally:
+            self._record((time.perf_counter() - start) * 1000)
+
+    def __aiter__(self):
+        self._iterator = self._cursor.__aiter__()
+        return self
+
+    async def __anext__(self):
+        start = time.perf_counter()
+        try:
+            document = await self._iterator.__anext__()
+        except StopAsyncIteration:
+            # Iterations are recorded once the cursor is exhausted
+            self._elapsed += time.perf_counter() - start
+            self._record(self._elapsed * 1000)
+            raise
+        self._elapsed += time.perf_counter() - start
+        return document
+
+    def _record(self, elapsed_ms: float) -> None:
+        if QUERY_PROFILING:
+            record(self._raw_db, self._collection, self._operation, self._spec, elapsed_ms)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class ProfiledCollection:
+    """Wraps a collection, timing every command it issues."""
+
+    def __init__(self, collection, raw_db):
+        self._collection = collection
+        self._raw_db = raw_db
+        self._name = collection.name
+
+    def find(self, filter=None, projection=None, *args, **kwargs):
+        cursor = self._collection.find(filter, projection, *args, **kwargs)
+        spec = {"filter": filter or {}, "projection": projection, "sort": _sort_spec(kwargs.get("sort"))}
+        return ProfiledCursor(cursor, self._raw_db, self._name, "find", spec)
+
+    def aggregate(self, pipeline, *args, **kwargs):
+        cursor = self._collection.aggregate(pipeline, *args, **kwargs)
+        return ProfiledCursor(cursor, self._raw_db, self._name, "aggregate", {"pipeline": pipeline})
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name not in TIMED_METHODS:
+            return attribute
+
+        filter_position = TIMED_METHODS[name]
+
+        async def timed(*args, **kwargs):
+            spec: Dict[str, Any] = {}
+            if filter_position is not None:
+                spec["filter"] = args[filter_position] if len(args) > filter_position else kwargs.get("filter", {})
+                spec["sort"] = _sort_spec(kwargs.get("sort"))
+            start = time.perf_counter()
+            try:
+                return await attribute(*args, **kwargs)
+            finally:
+                if QUERY_PROFILING:
+                    record(self._raw_db, self._name, name, spec, (time.perf_counter() - start) * 1000)
+
+        return timed
+
+
+# Database attributes that are never collections
+_DATABASE_ATTRIBUTES = {
+    "name", "client", "command", "get_collection", "list_collection_names", "create_collection",
+    "drop_collection", "with_options", "codec_options", "read_preference", "read_concern", "write_concern",
+}
+
+
+class ProfiledDatabase:
+    """Wraps a database: collections come back profiled, everything else passes through."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def __getitem__(self, name: str) -> ProfiledCollection:
+        return ProfiledCollection(self._db[name], self._db)
+
+    def __getattr__(self, name):
+        # Real database attributes (name, command, client, ...) pass through;
+        # anything else is a collection, as with Motor's `db.leads`
+        if name.startswith("_") or name in _DATABASE_ATTRIBUTES or hasattr(type(self._db), name):
+            return getattr(self._db, name)
+        return self[name]
+
+
+def wrap(db):
+    """Return a profiled view of a database (or the database itself when profiling is off)."""
+    return ProfiledDatabase(db) if QUERY_PROFILING else db
@@ -0,0 +1,248 @@
+"""
+Rollup Counters for AI Marketing Agent.
+Keeps pre-aggregated counters in a small `rollups` collection so dashboard
+and stats reads are O(number of buckets) instead of O(collection size).
+
+Every write path in `app/database.py` reports its inserts and status changes
+here, and the counters are maintained with `$inc` upserts.
+"""
+
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Tuple
+from pymongo import UpdateOne
+
+
+ROLLUPS_COLLECTION = "rollups"
+META_ID = "_meta"
+
+# Bucket key: (scope, dimension, bucket), e.g. ("leads", "status", "Hot")
+BucketKey = Tuple[str, str, str]
+
+
+def _day(ts: Optional[datetime]) -> str:
+    """Format a timestamp as a day bucket (YYYY-MM-DD, UTC)."""
+    return (ts or datetime.utcnow()).strftime("%Y-%m-%d")
+
+
+def _bucket_id(key: BucketKey) -> str:
+    return "|".join(key)
+
+
+def bucket_increments(scope: str, doc: Dict[str, Any]) -> List[Tuple[BucketKey, Dict[str, int]]]:
+    """
+    Return the counter increments a single document contributes to its scope.
+
+    Each bucket always gets `count`; leads also carry `value` (pipeline value)
+    and email history carries `success` so rates can be derived per bucket.
+    """
+    if scope == "leads":
+        inc = {"count": 1, "value": int(doc.get("value") or 0)}
+        return [
+            ((scope, "total", "all"), inc),
+            ((scope, "status", str(doc.get("status"))), inc),
+            ((scope, "source", str(doc.get("source"))), inc),
+            ((scope, "day", _day(doc.get("created_at"))), inc),
+        ]
+
+    if scope == "email_history":
+        success = bool(doc.get("success"))
+        inc = {"count": 1, "success": 1 if success else 0}
+        return [
+            ((scope, "total", "all"), inc),
+            ((scope, "success", "true" if success else "false"), inc),
+            ((scope, "day", _day(doc.get("sent_at"))), inc),
+        ]
+
+    if scope == "generations":
+        inc = {"count": 1}
+        return [
+            ((scope, "total", "all"), inc),
+            ((scope, "type", str(doc.get("type"))), inc),
+            ((scope, "day", _day(doc.get("created_at"))), inc),
+        ]
+
+    if scope == "website_analyses":
+        inc = {"count": 1}
+        return [
+            ((scope, "total", "all"), inc),
+            ((scope, "day", _day(doc.get("created_at"))), inc),
+        ]
+
+    if scope == "social_posts":
+        inc = {"count": 1}
+        return [
+            ((scope, "total", "all"), inc),
+            ((scope, "status", str(doc.get("status"))), inc),
+            ((scope, "platform", str(doc.get("platform"))), inc),
+        ]
+
+    return []
+
+
+def collect_increments(
+    deltas: Dict[BucketKey, Dict[str, int]],
+    scope: str,
+    doc: Dict[str, Any],
+    sign: int = 1
+) -> Dict[BucketKey, Dict[str, int]]:
+    """Accumulate a document's increments (or decrements with sign=-1) into `deltas`."""
+    for key, inc in bucket_increments(scope, doc):
+        bucket = deltas.setdefault(key, {})
+        for field, amount in inc.items():
+            bucket[field] = bucket.get(field, 0) + sign * amount
+    return deltas
+
+
+async def apply_increments(db, deltas: Dict[BucketKey, Dict[str, int]]) -> None:
+    """Write accumulated increments to the rollups collection in one bulk_write."""
+    operations = []
+    for key, inc in deltas.items():
+        inc = {field: amount for field, amount in inc.items() if amount}
+        if not inc:
+            continue
+        scope, dimension, bucket = key
+        operations.append(UpdateOne(
+            {"_id": _bucket_id(key)},
+            {
+                "$inc": inc,
+                "$set": {"updated_at": datetime.utcnow()},
+                "$setOnInsert": {"scope": scope, "dimension": dimension, "bucket": bucket}
+            },
+            upsert=True
+        ))
+
+    if operations:
+        await db[ROLLUPS_COLLECTION].bulk_write(operations, ordered=False)
+
+
+async def record_inserts(db, scope: str, documents: List[Dict[str, Any]]) -> None:
+    """
+    Update rollups for newly inserted documents.
+
+    Rollups are best-effort: a failure is logged and never fails the write
+    itself. Drift can be repaired with `rebuild_rollups`.
+    """
+    try:
+        deltas: Dict[BucketKey, Dict[str, int]] = {}
+        for doc in documents:
+            collect_increments(deltas, scope, doc)
+        await apply_increments(db, deltas)
+    except Exception as e:
+        print(f"[Rollups] Failed to record {scope} inserts: {e}")
+
+
+async def record_change(
+    db,
+    scope: str,
+    old_doc: Dict[str, Any],
+    new_doc: Dict[str, Any]
+) -> None:
+    """Move a document's contribution from its old buckets to its new ones."""
+    try:
+        deltas: Dict[BucketKey, Dict[str, int]] = {}
+        collect_increments(deltas, scope, old_doc, sign=-1)
+        collect_increments(deltas, scope, new_doc)
+        await apply_increments(db, deltas)
+    except Exception as e:
+        print(f"[Rollups] Failed to record {scope} change: {e}")
+
+
+async def reset_scope(db, scope: str) -> None:
+    """Drop all counters for a scope (used when a collection is emptied)."""
+    await db[ROLLUPS_COLLECTION].delete_many({"scope": scope})
+
+
+async def get_rollups(db, scope: str) -> Dict[str, Dict[str, Dict[str, int]]]:
+    """
+    Read all counters for a scope.
+
+    Returns:
+        {dimension: {bucket: {"count": n, ...}}}, e.g.
+        {"status": {"Hot": {"count": 12, "value": 50000}}}
+    """
+    result: Dict[str, Dict[str, Dict[str, int]]] = {}
+    cursor = db[ROLLUPS_COLLECTION].find({"scope": scope})
+    async for doc in cursor:
+        fields = {
+            k: v for k, v in doc.items()
+            if k not in ("_id", "scope", "dimension", "bucket", "updated_at")
+        }
+        result.setdefault(doc["dimension"], {})[doc["bucket"]] = fields
+    return result
+
+
+def rollup_total(rollups: Dict[str, Dict[str, Dict[str, int]]], field: str = "count") -> int:
+    """Get the all-time total for a field from a scope's rollups."""
+    return rollups.get("total", {}).get("all", {}).get(field, 0)
+
+
+def rollup_counts(rollups: Dict[str, Dict[str, Dict[str, int]]], dimension: str) -> Dict[str, int]:
+    """Get {bucket: count} for a dimension, skipping buckets that dropped to zero."""
+    return {
+        bucket: fields.get("count", 0)
+        for bucket, fields in rollups.get(dimension, {}).items()
+        if fields.get("count", 0)
+    }
+
+
+# ============================================
+# Rebuild / Backfill
+# ============================================
+
+ROLLUP_SCOPES = ["leads", "email_history", "generations", "website_analyses", "social_posts"]
+
+_PROJECTIONS = {
+    "leads": {"status": 1, "source": 1, "value": 1, "created_at": 1},
+    "email_history": {"success": 1, "sent_at": 1},
+    "generations": {"type": 1, "created_at": 1},
+    "website_analyses": {"created_at": 1},
+    "social_posts": {"status": 1, "platform": 1},
+}
+
+
+async def rebuild_rollups(db, scopes: Optional[List[str]] = None, batch_size: int = 5000) -> Dict[str, int]:
+    """
+    Recompute rollups from the source collections.
+
+    Used to backfill counters for data written before rollups existed, or to
+    repair drift. Streams only the projected fields and flushes increments
+    every `batch_size` documents, so memory stays bounded.
+
+    Returns the number of documents counted per scope.
+    """
+    counted = {}
+
+    for scope in scopes or ROLLUP_SCOPES:
+        await reset_scope(db, scope)
+
+        deltas: Dict[BucketKey, Dict[str, int]] = {}
+        count = 0
+        # Archived documents (see app/archival.py) keep their rollup fields
+        # on the archive locator, so all-time counts survive archival.
+        for source in (scope, f"{scope}_archive"):
+            cursor = db[source].find({}, _PROJECTIONS[scope]).batch_size(batch_size)
+            async for doc in cursor:
+                collect_increments(deltas, scope, doc)
+                count += 1
+                if count % batch_size == 0:
+                    await apply_increments(db, deltas)
+                    deltas = {}
+        await apply_increments(db, deltas)
+
+        counted[scope] = count
+        print(f"[Rollups] Rebuilt {scope}: {count} documents")
+
+    await db[ROLLUPS_COLLECTION].update_one(
+        {"_id": META_ID},
+        {"$set": {"rebuilt_at": datetime.utcnow(), "scope": "_meta"}},
+        upsert=True
+    )
+    return counted
+
+
+async def ensure_rollups(db) -> None:
+    """Backfill rollups once if they have never been built for this database."""
+    meta = await db[ROLLUPS_COLLECTION].find_one({"_id": META_ID})
+    if meta is None:
+        print("[Rollups] No rollups found, building from existing data...")
+        await rebuild_rollups(db)
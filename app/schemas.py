@@ -266,6 +266,104 @@ class EmailCampaignRequest(BaseModel):
         default=True,
         description="If True, only preview which emails would be sent without actually sending"
     )
+    segment: Optional[str] = Field(
+        default=None,
+        description="Only email leads in this saved segment"
+    )
+    segment_definition: Optional[Dict[str, Any]] = Field(
+        default=None,
+        description="Only email leads matching this inline segment definition"
+    )
+    queue: bool = Field(
+        default=False,
+        description="Queue the emails in the outbox and return at once instead of sending them in the request"
+    )
+    idempotency_key: Optional[str] = Field(
+        default=None,
+        description="With queue: repeating a request with the same key never emails a lead twice"
+    )
+
+
+class OutboxMessageRequest(BaseModel):
+    """Request model for queueing one message in the outbox."""
+    channel: str = Field(default="email", description="'email' or 'whatsapp'")
+    to: str = Field(..., description="Email address, or phone number with country code for WhatsApp")
+    subject: Optional[str] = Field(default=None, description="Email subject (required for email)")
+    body: str = Field(..., description="Message content")
+    idempotency_key: Optional[str] = Field(
+        default=None,
+        description="Messages with the same key are only queued (and sent) once"
+    )
+    lead_id: Optional[str] = Field(default=None, description="Lead the message is for (recorded in email history)")
+
+
+class SuppressionRequest(BaseModel):
+    """Request model for adding addresses to the suppression list."""
+    addresses: list[str] = Field(..., description="Email addresses or phone numbers")
+    reason: str = Field(default="manual", description="'unsubscribe', 'bounce', 'complaint' or 'manual'")
+
+
+class UnsubscribeRequest(BaseModel):
+    """Request model for unsubscribing an address."""
+    address: str = Field(..., description="Email address, or phone number with country code")
+
+
+class CampaignCreateRequest(BaseModel):
+    """Request model for starting a background email campaign."""
+    kind: str = Field(
+        default="template",
+        description="'template' (subject/body templates) or 'ai' (personalized by the LLM)"
+    )
+    subject_template: str = Field(
+        default="Special Offer for {company}!",
+        description="Email subject template. Use {name}, {company}, {score} as placeholders."
+    )
+    body_template: str = Field(
+        default="Hi {name},\n\nWe have an exclusive offer for {company}!\n\nBest regards,\nMarketing Team",
+        description="Email body template. Use {name}, {email}, {company}, {score} as placeholders."
+    )
+    business_context: str = Field(
+        default="AI Marketing Automation Platform - helping businesses grow with intelligent marketing",
+        description="Context about your business for AI personalization (kind 'ai')"
+    )
+    segment_drafts: bool = Field(
+        default=False,
+        description="Kind 'ai': one AI draft per (score tier, industry), personalized per lead; "
+                    "only high-value leads get their own AI email"
+    )
+    leads_per_prompt: int = Field(
+        default=1,
+        description="Kind 'ai': leads per LLM call for per-lead emails (failed leads are retried on their own)"
+    )
+    max_emails: int = Field(
+        default=500,
+        description="Maximum number of leads in the campaign"
+    )
+    segment: Optional[str] = Field(
+        default=None,
+        description="Only email leads in this saved segment"
+    )
+    segment_definition: Optional[Dict[str, Any]] = Field(
+        default=None,
+        description="Only email leads matching this inline segment definition"
+    )
+
+
+class EmailSchedulerConfigRequest(BaseModel):
+    """Request model for configuring the continuous email scheduler."""
+    enabled: bool = Field(..., description="Email leads automatically on their score-based cadence")
+    subject_template: str = Field(
+        default="Special Offer for {company}!",
+        description="Email subject template. Use {name}, {company}, {score} as placeholders."
+    )
+    body_template: str = Field(
+        default="Hi {name},\n\nWe have an exclusive offer for {company}!\n\nBest regards,\nMarketing Team",
+        description="Email body template. Use {name}, {email}, {company}, {score} as placeholders."
+    )
+    segment: Optional[str] = Field(
+        default=None,
+        description="Only email leads in this saved segment"
+    )
 
 
 class EmailCampaignResult(BaseModel):
@@ -289,3 +387,19 @@ class EmailCampaignResponse(BaseModel):
     dry_run: bool
     results: list[EmailCampaignResult] = []
 
+
+# ============================================
+# Lead Segment Schemas
+# ============================================
+
+class SegmentRequest(BaseModel):
+    """Request model for creating or replacing a saved segment."""
+    name: str = Field(..., description="Segment name (lowercase letters, digits, '-' or '_')")
+    definition: Dict[str, Any] = Field(..., description="Segment definition (see app/segments.py)")
+    description: Optional[str] = Field(None, description="What the segment is for")
+
+
+class SegmentPreviewRequest(BaseModel):
+    """Request model for previewing an unsaved segment definition."""
+    definition: Dict[str, Any] = Field(..., description="Segment definition (see app/segments.py)")
+    limit: int = Field(default=20, description="Number of sample leads to return")
@@ -0,0 +1,330 @@
+"""
+Full-Text Search for AI Marketing Agent.
+Searches generated content, social posts and website analyses with BM25
+ranking, filters and highlighted snippets.
+
+Generated content is stored compressed (see app/content_store.py), so Mongo
+text indexes cannot see it. Instead we maintain our own inverted index,
+updated incrementally on every insert:
+
+- `search_index`: one document per indexed record, holding its unique
+  `terms` (multikey-indexed), term frequencies and filter fields
+- `search_terms`: document frequency per term, for IDF
+- `search_meta`: corpus size and total length, for BM25 length normalization
+"""
+
+import html
+import math
+import re
+from datetime import datetime
+from typing import Optional, List, Dict, Any
+
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+
+
+INDEX_COLLECTION = "search_index"
+TERMS_COLLECTION = "search_terms"
+META_COLLECTION = "search_meta"
+
+# Collections we index, and how to get their searchable text
+SEARCH_SOURCES = ["generations", "social_posts", "website_analyses"]
+
+CANDIDATE_LIMIT = 5000
+SNIPPET_CHARS = 240
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "from", "has", "have",
+    "in", "is", "it", "its", "of", "on", "or", "our", "that", "the", "this", "to", "was",
+    "we", "were", "will", "with", "you", "your",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords and single characters."""
+    return [
+        token for token in _TOKEN_RE.findall(text.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def extract_text(source: str, document: Dict[str, Any]) -> str:
+    """Get the searchable text of an (unpacked) document."""
+    if source == "generations":
+        content = document.get("content") or {}
+        parts = content.values() if isinstance(content, dict) else [content]
+        return "\n\n".join(p for p in parts if isinstance(p, str))
+    if source == "social_posts":
+        content = document.get("content")
+        return content if isinstance(content, str) else ""
+    if source == "website_analyses":
+        return "\n\n".join(
+            p for p in (document.get("title"), document.get("seo_analysis")) if isinstance(p, str)
+        )
+    return ""
+
+
+def _filter_fields(source: str, document: Dict[str, Any]) -> Dict[str, Any]:
+    if source == "generations":
+        type_value = document.get("type")
+    elif source == "social_posts":
+        type_value = document.get("platform")
+    else:
+        type_value = "website_analysis"
+    return {
+        "type": type_value,
+        "business_name": document.get("business_name") or document.get("website_url"),
+        "created_at": document.get("created_at"),
+    }
+
+
+# ============================================
+# Indexing
+# ============================================
+
+async def index_documents(db, source: str, documents: List[Dict[str, Any]], texts: Optional[List[str]] = None) -> int:
+    """
+    Add documents to the search index (idempotent per document).
+
+    Args:
+        texts: Pre-extracted text per document. Pass this when the documents
+               have already been compressed for storage.
+
+    Returns the number of newly indexed documents.
+    """
+    if source not in SEARCH_SOURCES or not documents:
+        return 0
+
+    if texts is None:
+        texts = [extract_text(source, document) for document in documents]
+
+    operations = []
+    entries = []
+    for document, text in zip(documents, texts):
+        tokens = tokenize(text)
+        if not tokens:
+            continue
+        tf: Dict[str, int] = {}
+        for token in tokens:
+            tf[token] = tf.get(token, 0) + 1
+        entry = {
+            "_id": f"{source}:{document['_id']}",
+            "source": source,
+            "doc_id": str(document["_id"]),
+            "terms": list(tf),
+            "tf": tf,
+            "length": len(tokens),
+            **_filter_fields(source, document),
+        }
+        entries.append(entry)
+        operations.append(ReplaceOne({"_id": entry["_id"]}, entry, upsert=True))
+
+    if not operations:
+        return 0
+
+    result = await db[INDEX_COLLECTION].bulk_write(operations, ordered=False)
+
+    # Corpus statistics only change for documents seen for the first time
+    new_entries = [entries[i] for i in result.upserted_ids]
+    if new_entries:
+        df: Dict[str, int] = {}
+        for entry in new_entries:
+            for term in entry["terms"]:
+                df[term] = df.get(term, 0) + 1
+        await db[TERMS_COLLECTION].bulk_write(
+            [UpdateOne({"_id": term}, {"$inc": {"df": n}}, upsert=True) for term, n in df.items()],
+            ordered=False
+        )
+        await db[META_COLLECTION].update_one(
+            {"_id": "corpus"},
+            {"$inc": {"documents": len(new_entries), "total_length": sum(e["length"] for e in new_entries)}},
+            upsert=True
+        )
+
+    return len(new_entries)
+
+
+async def ensure_search_indexes(db) -> None:
+    """Create the indexes that search queries rely on."""
+    await db[INDEX_COLLECTION].create_index([("terms", 1), ("created_at", -1)])
+    await db[INDEX_COLLECTION].create_index([("source", 1), ("type", 1), ("created_at", -1)])
+    await db[INDEX_COLLECTION].create_index([("business_name", 1), ("created_at", -1)])
+
+
+async def rebuild_search_index(db, batch_size: int = 500) -> Dict[str, int]:
+    """
+    Rebuild the whole index from the source collections (backfill/repair),
+    including archived documents, which search results read through to.
+
+    Returns the number of documents indexed per source.
+    """
+    from app import content_store
+    from app.archival import ARCHIVED_COLLECTIONS, iter_archived
+
+    await db[INDEX_COLLECTION].delete_many({})
+    await db[TERMS_COLLECTION].delete_many({})
+    await db[META_COLLECTION].delete_many({})
+
+    counts = {}
+    for source in SEARCH_SOURCES:
+        counts[source] = 0
+        batch = []
+        async for document in db[source].find().batch_size(batch_size):
+            batch.append(document)
+            if len(batch) >= batch_size:
+                await content_store.unpack_documents(db, source, batch)
+                counts[source] += await index_documents(db, source, batch)
+                batch = []
+        if batch:
+            await content_store.unpack_documents(db, source, batch)
+            counts[source] += await index_documents(db, source, batch)
+            batch = []
+
+        # Archived documents are stored as plain text, no unpacking needed
+        if source in ARCHIVED_COLLECTIONS:
+            async for document in iter_archived(source, batch_size=batch_size):
+                batch.append(document)
+                if len(batch) >= batch_size:
+                    counts[source] += await index_documents(db, source, batch)
+                    batch = []
+            if batch:
+                counts[source] += await index_documents(db, source, batch)
+        print(f"[Search] Indexed {counts[source]} {source} documents")
+
+    return counts
+
+
+# ============================================
+# Querying
+# ============================================
+
+def _highlight(text: str, terms: List[str]) -> str:
+    """
+    Pick the snippet window with the most query-term hits, HTML-escape it and
+    wrap hits in <mark>.
+    """
+    if not text:
+        return ""
+
+    term_set = set(terms)
+    hits = [m.start() for m in _TOKEN_RE.finditer(text) if m.group().lower() in term_set]
+
+    start = 0
+    if hits:
+        best = max(hits, key=lambda h: sum(1 for other in hits if h <= other < h + SNIPPET_CHARS))
+        start = max(0, best - SNIPPET_CHARS // 4)
+    window = " ".join(text[start:start + SNIPPET_CHARS].split())
+
+    # Escape the (scraped or generated) text itself; only our <mark> tags are markup.
+    # Escaping piecewise keeps entities like &amp; from being highlighted.
+    parts = []
+    position = 0
+    for match in _TOKEN_RE.finditer(window):
+        if match.group().lower() in term_set:
+            parts.append(html.escape(window[position:match.start()]))
+            parts.append(f"<mark>{html.escape(match.group())}</mark>")
+            position = match.end()
+    parts.append(html.escape(window[position:]))
+    highlighted = "".join(parts)
+    prefix = "..." if start > 0 else ""
+    suffix = "..." if start + SNIPPET_CHARS < len(text) else ""
+    return f"{prefix}{highlighted}{suffix}"
+
+
+async def _load_documents(db, hits: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Fetch and unpack the source documents for hits, batched per source (archive read-through included)."""
+    from app import content_store
+    from app.archival import read_archived
+
+    loaded = {}
+    for source in SEARCH_SOURCES:
+        ids = [ObjectId(h["doc_id"]) for h in hits if h["source"] == source and ObjectId.is_valid(h["doc_id"])]
+        if not ids:
+            continue
+        documents = await db[source].find({"_id": {"$in": ids}}).to_list(len(ids))
+        found = {str(d["_id"]) for d in documents}
+        for missing in ids:
+            if str(missing) not in found:
+                archived = await read_archived(source, str(missing))
+                if archived:
+                    documents.append(archived)
+        await content_store.unpack_documents(db, source, documents)
+        for document in documents:
+            loaded[f"{source}:{document['_id']}"] = document
+    return loaded
+
+
+async def search(
+    db,
+    query: str,
+    sources: Optional[List[str]] = None,
+    content_type: Optional[str] = None,
+    business_name: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = 20,
+    offset: int = 0
+) -> Dict[str, Any]:
+    """
+    Search indexed content with BM25 ranking.
+
+    Candidates are documents containing any query term (multikey index on
+    `terms`), capped at the CANDIDATE_LIMIT most recent, then scored in
+    process using only the query terms' frequencies.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return {"query": query, "terms": [], "total_candidates": 0, "results": []}
+
+    match: Dict[str, Any] = {"terms": {"$in": terms}}
+    if sources:
+        match["source"] = {"$in": sources}
+    if content_type:
+        match["type"] = content_type
+    if business_name:
+        match["business_name"] = business_name
+    if since or until:
+        match["created_at"] = {k: v for k, v in (("$gte", since), ("$lt", until)) if v}
+
+    projection = {"source": 1, "doc_id": 1, "type": 1, "business_name": 1, "created_at": 1, "length": 1}
+    projection.update({f"tf.{term}": 1 for term in terms})
+    candidates = await db[INDEX_COLLECTION].find(match, projection).sort("created_at", -1).limit(CANDIDATE_LIMIT).to_list(CANDIDATE_LIMIT)
+
+    corpus = await db[META_COLLECTION].find_one({"_id": "corpus"}) or {}
+    total_docs = max(corpus.get("documents", 0), 1)
+    avg_length = corpus.get("total_length", 0) / total_docs or 1
+    df = {doc["_id"]: doc["df"] async for doc in db[TERMS_COLLECTION].find({"_id": {"$in": terms}})}
+
+    idf = {term: math.log(1 + (total_docs - df.get(term, 0) + 0.5) / (df.get(term, 0) + 0.5)) for term in terms}
+    for candidate in candidates:
+        tf = candidate.get("tf", {})
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * candidate.get("length", 0) / avg_length)
+        candidate["score"] = sum(
+            idf[term] * tf[term] * (BM25_K1 + 1) / (tf[term] + norm)
+            for term in terms if tf.get(term)
+        )
+
+    candidates.sort(key=lambda c: c["score"], reverse=True)
+    page = candidates[offset:offset + limit]
+    documents = await _load_documents(db, page)
+
+    results = []
+    for hit in page:
+        document = documents.get(hit["_id"])
+        if document is None:
+            continue  # Source document was deleted
+        results.append({
+            "source": hit["source"],
+            "id": hit["doc_id"],
+            "type": hit.get("type"),
+            "business_name": hit.get("business_name"),
+            "created_at": hit["created_at"].isoformat() if hit.get("created_at") else None,
+            "score": round(hit["score"], 4),
+            "snippet": _highlight(extract_text(hit["source"], document), terms),
+        })
+
+    return {"query": query, "terms": terms, "total_candidates": len(candidates), "results": results}
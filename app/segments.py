@@ -0,0 +1,388 @@
+"""
+Lead Segmentation for AI Marketing Agent.
+A small JSON segment language compiled to index-friendly Mongo queries, with
+saved segments and cached counts, so campaigns and lists can target e.g.
+"hot or warm website leads worth 5k+ not emailed this week".
+
+A segment definition is an object; all keys must match (AND):
+
+    {
+        "score": {"min": 70, "max": 100},
+        "status": ["Hot", "Warm"],              # a value or a list of values
+        "source": "Website",
+        "value": {"min": 5000},
+        "last_contact": {"within_days": 30},    # or {"older_than_days": 90}, {"never": true}
+        "last_emailed": {"older_than_days": 7}, # older_than_days includes never emailed
+        "emails_sent": {"max": 3},              # all-time counters kept on the lead
+        "emails_failed": {"max": 0},
+        "email_history": {                      # email history within a window
+            "within_days": 30, "success": true,
+            "subject_contains": "offer", "min": 1
+        },
+        "any": [{...}, {...}],                  # at least one sub-segment matches
+        "not": {...}                            # sub-segment does not match
+    }
+
+Field predicates become equality/`$in`/range conditions on indexed lead
+fields. `email_history` predicates are resolved with one aggregation over
+the (lead_id, sent_at) index and become an `_id` `$in`/`$nin` condition.
+"""
+
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.database import get_database, get_analytics_database
+
+
+SEGMENTS_COLLECTION = "segments"
+SEGMENT_COUNT_TTL_SECONDS = int(os.getenv("SEGMENT_COUNT_TTL_SECONDS") or "300")
+
+_NAME_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+# DSL key -> lead field, by predicate kind
+_SET_FIELDS = {"status": "status", "source": "source"}
+_RANGE_FIELDS = {"score": "score", "value": "value"}
+_COUNTER_FIELDS = {"emails_sent": "emails_sent", "emails_failed": "emails_failed"}
+_WINDOW_FIELDS = {"last_contact": "lastContact", "last_emailed": "last_emailed_at"}
+
+SEGMENT_KEYS = sorted(
+    [*_SET_FIELDS, *_RANGE_FIELDS, *_COUNTER_FIELDS, *_WINDOW_FIELDS, "email_history", "any", "not"]
+)
+
+
+# ============================================
+# Compilation
+# ============================================
+
+def _number(key: str, name: str, value: Any) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"'{key}.{name}' must be a number")
+    return value
+
+
+def _range(key: str, spec: Any) -> Dict[str, Any]:
+    """{"min": a, "max": b} -> {"$gte": a, "$lte": b}."""
+    if not isinstance(spec, dict) or not spec or set(spec) - {"min", "max"}:
+        raise ValueError(f"'{key}' must be an object with 'min' and/or 'max'")
+    condition = {}
+    if spec.get("min") is not None:
+        condition["$gte"] = _number(key, "min", spec["min"])
+    if spec.get("max") is not None:
+        condition["$lte"] = _number(key, "max", spec["max"])
+    return condition
+
+
+def _counter(key: str, spec: Any) -> Optional[Dict[str, Any]]:
+    """
+    Range on a counter that is missing (0) on leads never emailed.
+
+    Ranges that include 0 use `$not: {$gt: max}`, which matches missing
+    fields and still uses the index (as the complement of a range).
+    """
+    condition = _range(key, spec)
+    if condition.get("$gte", 0) > 0:
+        return condition
+    if "$lte" in condition:
+        return {"$not": {"$gt": condition["$lte"]}}
+    return None  # Any count matches
+
+
+def _window(key: str, field: str, spec: Any, now: datetime) -> Dict[str, Any]:
+    """
+    Recency condition on a date field: within_days / older_than_days / never.
+
+    `older_than_days` also matches leads with no date (never emailed or
+    contacted), which are the least recently reached of all.
+    """
+    if not isinstance(spec, dict) or len(spec) != 1 or set(spec) - {"within_days", "older_than_days", "never"}:
+        raise ValueError(f"'{key}' must have exactly one of 'within_days', 'older_than_days', 'never'")
+    if "never" in spec:
+        if spec["never"] is not True:
+            raise ValueError(f"'{key}.never' must be true")
+        return {field: {"$in": [None, ""]}}
+
+    name, days = next(iter(spec.items()))
+    cutoff = now - timedelta(days=_number(key, name, days))
+    # lastContact is stored as a YYYY-MM-DD string, which sorts chronologically
+    bound = cutoff.strftime("%Y-%m-%d") if field == "lastContact" else cutoff
+    if name == "within_days":
+        return {field: {"$gte": bound}}
+    # $lt never matches a missing field; both branches use the field's index
+    return {"$or": [{field: {"$lt": bound}}, {field: {"$in": [None, ""]}}]}
+
+
+async def _history_condition(spec: Any, now: datetime) -> Dict[str, Any]:
+    """
+    Resolve an email_history predicate to an `_id` condition on leads.
+
+    Counts each lead's matching sends in the window with one aggregation.
+    A range that requires at least one send becomes `_id $in` the leads in
+    range; a range that includes 0 (e.g. {"max": 0}) becomes `_id $nin` the
+    leads above it.
+    """
+    allowed = {"within_days", "success", "subject_contains", "min", "max"}
+    if not isinstance(spec, dict) or set(spec) - allowed:
+        raise ValueError(f"'email_history' accepts: {', '.join(sorted(allowed))}")
+    if spec.get("within_days") is None:
+        raise ValueError("'email_history.within_days' is required")
+
+    match: Dict[str, Any] = {
+        "sent_at": {"$gte": now - timedelta(days=_number("email_history", "within_days", spec["within_days"]))}
+    }
+    if spec.get("success") is not None:
+        if not isinstance(spec["success"], bool):
+            raise ValueError("'email_history.success' must be true or false")
+        match["success"] = spec["success"]
+    if spec.get("subject_contains"):
+        match["subject"] = {"$regex": re.escape(str(spec["subject_contains"])), "$options": "i"}
+
+    count_range = _range("email_history", {k: spec[k] for k in ("min", "max") if spec.get(k) is not None} or {"min": 1})
+    includes_zero = count_range.get("$gte", 0) <= 0
+    if includes_zero and "$lte" not in count_range:
+        return {}  # Any count matches
+    # For ranges including 0, find the leads *outside* the range instead
+    having = {"$gt": count_range["$lte"]} if includes_zero else count_range
+
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": "$lead_id", "count": {"$sum": 1}}},
+        {"$match": {"count": having}},
+    ]
+    lead_ids = []
+    async for row in get_analytics_database().email_history.aggregate(pipeline, allowDiskUse=True):
+        if isinstance(row["_id"], str) and ObjectId.is_valid(row["_id"]):
+            lead_ids.append(ObjectId(row["_id"]))
+
+    return {"_id": {"$nin" if includes_zero else "$in": lead_ids}}
+
+
+async def compile_segment(definition: Dict[str, Any], now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Compile a segment definition to a Mongo filter on `leads`.
+
+    Time windows are relative, so compile at query time rather than storing
+    the result. Raises ValueError for invalid definitions.
+    """
+    if not isinstance(definition, dict):
+        raise ValueError("Segment definition must be an object")
+    now = now or datetime.utcnow()
+
+    conditions: List[Dict[str, Any]] = []
+    for key, spec in definition.items():
+        if key in _SET_FIELDS:
+            values = spec if isinstance(spec, list) else [spec]
+            if not values or not all(isinstance(v, str) for v in values):
+                raise ValueError(f"'{key}' must be a string or a list of strings")
+            conditions.append({_SET_FIELDS[key]: values[0] if len(values) == 1 else {"$in": values}})
+        elif key in _RANGE_FIELDS:
+            conditions.append({_RANGE_FIELDS[key]: _range(key, spec)})
+        elif key in _COUNTER_FIELDS:
+            condition = _counter(key, spec)
+            if condition is not None:
+                conditions.append({_COUNTER_FIELDS[key]: condition})
+        elif key in _WINDOW_FIELDS:
+            conditions.append(_window(key, _WINDOW_FIELDS[key], spec, now))
+        elif key == "email_history":
+            conditions.append(await _history_condition(spec, now))
+        elif key == "any":
+            if not isinstance(spec, list) or not spec:
+                raise ValueError("'any' must be a non-empty list of segment definitions")
+            conditions.append({"$or": [await compile_segment(sub, now) for sub in spec]})
+        elif key == "not":
+            conditions.append({"$nor": [await compile_segment(spec, now)]})
+        else:
+            raise ValueError(f"Unknown segment field '{key}'. Use: {', '.join(SEGMENT_KEYS)}")
+
+    conditions = [c for c in conditions if c]
+    if not conditions:
+        return {}
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+
+async def ensure_segment_indexes(db) -> None:
+    """Create the lead and email history indexes that compiled segments rely on."""
+    await db.leads.create_index([("status", 1), ("score", -1)])
+    await db.leads.create_index([("source", 1), ("score", -1)])
+    await db.leads.create_index([("score", -1)])
+    await db.leads.create_index([("value", -1)])
+    await db.leads.create_index([("lastContact", 1)])
+    await db.leads.create_index([("last_emailed_at", 1)])
+    await db.leads.create_index([("emails_sent", 1)])
+    await db.email_history.create_index([("lead_id", 1), ("sent_at", -1)])
+
+
+# ============================================
+# Querying
+# ============================================
+
+async def resolve_segment(
+    segment: Optional[str] = None,
+    definition: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Get the lead filter for a saved segment name or an inline definition.
+
+    Raises LookupError for unknown saved segments, ValueError for invalid
+    definitions.
+    """
+    if segment:
+        saved = await get_segment(segment)
+        if not saved:
+            raise LookupError(f"Segment '{segment}' not found")
+        definition = saved["definition"]
+    return await compile_segment(definition or {})
+
+
+async def find_segment_leads(query: Dict[str, Any], limit: int = 100, skip: int = 0) -> List[Dict[str, Any]]:
+    """Leads matching a compiled segment, highest score first."""
+    cursor = get_database().leads.find(query).sort("score", -1).skip(skip).limit(limit)
+
+    results = []
+    async for doc in cursor:
+        doc["id"] = str(doc.pop("_id"))
+        for field in ("created_at", "updated_at", "last_emailed_at", "scored_at"):
+            if isinstance(doc.get(field), datetime):
+                doc[field] = doc[field].isoformat()
+        results.append(doc)
+    return results
+
+
+async def count_segment_query(query: Dict[str, Any]) -> int:
+    return await get_database().leads.count_documents(query)
+
+
+# ============================================
+# Saved Segments
+# ============================================
+
+def _format_segment(doc: Dict[str, Any]) -> Dict[str, Any]:
+    doc["name"] = doc.pop("_id")
+    for field in ("created_at", "updated_at", "counted_at"):
+        if isinstance(doc.get(field), datetime):
+            doc[field] = doc[field].isoformat()
+    return doc
+
+
+async def save_segment(name: str, definition: Dict[str, Any], description: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Create or replace a saved segment (validated by compiling it).
+
+    The count is computed right away and cached on the segment.
+    """
+    if not _NAME_RE.match(name or ""):
+        raise ValueError("Segment name must be 1-64 lowercase letters, digits, '-' or '_'")
+
+    now = datetime.utcnow()
+    count = await count_segment_query(await compile_segment(definition, now))
+
+    await get_database()[SEGMENTS_COLLECTION].update_one(
+        {"_id": name},
+        {
+            "$set": {
+                "definition": definition,
+                "description": description,
+                "count": count,
+                "counted_at": now,
+                "updated_at": now,
+            },
+            "$setOnInsert": {"created_at": now},
+        },
+        upsert=True
+    )
+    return await get_segment(name)
+
+
+async def get_segment(name: str) -> Optional[Dict[str, Any]]:
+    doc = await get_database()[SEGMENTS_COLLECTION].find_one({"_id": name})
+    return _format_segment(doc) if doc else None
+
+
+async def list_segments() -> List[Dict[str, Any]]:
+    cursor = get_database()[SEGMENTS_COLLECTION].find({}).sort("_id", 1)
+    return [_format_segment(doc) async for doc in cursor]
+
+
+async def delete_segment(name: str) -> bool:
+    result = await get_database()[SEGMENTS_COLLECTION].delete_one({"_id": name})
+    return result.deleted_count > 0
+
+
+async def get_segment_count(name: str, refresh: bool = False) -> Dict[str, Any]:
+    """
+    Count of a saved segment, served from the cache while it is younger
+    than SEGMENT_COUNT_TTL_SECONDS (or recounted when refresh is set).
+    """
+    db = get_database()
+    doc = await db[SEGMENTS_COLLECTION].find_one({"_id": name})
+    if not doc:
+        raise LookupError(f"Segment '{name}' not found")
+
+    now = datetime.utcnow()
+    counted_at = doc.get("counted_at")
+    fresh = counted_at and (now - counted_at).total_seconds() < SEGMENT_COUNT_TTL_SECONDS
+    if fresh and not refresh and doc.get("count") is not None:
+        return {"name": name, "count": doc["count"], "counted_at": counted_at.isoformat(), "cached": True}
+
+    count = await count_segment_query(await compile_segment(doc["definition"], now))
+    await db[SEGMENTS_COLLECTION].update_one({"_id": name}, {"$set": {"count": count, "counted_at": now}})
+    return {"name": name, "count": count, "counted_at": now.isoformat(), "cached": False}
+
+
+async def refresh_segment_counts() -> Dict[str, int]:
+    """Recount every saved segment whose cached count has expired."""
+    counts = {}
+    async for doc in get_database()[SEGMENTS_COLLECTION].find({}, {"_id": 1}):
+        counts[doc["_id"]] = (await get_segment_count(doc["_id"]))["count"]
+    return counts
+
+
+# ============================================
+# Email Counters
+# ============================================
+
+async def backfill_email_counts(batch_size: int = 1000) -> Dict[str, int]:
+    """
+    Recompute the `emails_sent` / `emails_failed` counters on every lead
+    from hot and archived email history.
+
+    `save_email_history_bulk` keeps them up to date afterwards; run this
+    once for history written before the counters existed.
+    """
+    db = get_database()
+    counts: Dict[str, Dict[str, int]] = {}
+    for collection in ("email_history", "email_history_archive"):
+        pipeline = [
+            {"$group": {
+                "_id": "$lead_id",
+                "sent": {"$sum": {"$cond": ["$success", 1, 0]}},
+                "failed": {"$sum": {"$cond": ["$success", 0, 1]}},
+            }}
+        ]
+        async for row in db[collection].aggregate(pipeline, allowDiskUse=True):
+            if isinstance(row["_id"], str) and ObjectId.is_valid(row["_id"]):
+                totals = counts.setdefault(row["_id"], {"sent": 0, "failed": 0})
+                totals["sent"] += row["sent"]
+                totals["failed"] += row["failed"]
+
+    items = list(counts.items())
+    updated = 0
+    for start in range(0, len(items), batch_size):
+        operations = [
+            UpdateOne(
+                {"_id": ObjectId(lead_id)},
+                {"$set": {"emails_sent": totals["sent"], "emails_failed": totals["failed"]}}
+            )
+            for lead_id, totals in items[start:start + batch_size]
+        ]
+        result = await db.leads.bulk_write(operations, ordered=False)
+        updated += result.modified_count
+
+    print(f"[Segments] Backfilled email counters for {updated} leads")
+    return {"leads_with_history": len(counts), "updated": updated}
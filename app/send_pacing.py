@@ -0,0 +1,392 @@
+"""
+Send Pacing for AI Marketing Agent.
+Keeps email delivery inside the sending account's quotas and the receiving
+domains' tolerance, by waiting for capacity instead of failing at the cap:
+
+- Global budgets: EMAIL_DAILY_LIMIT per UTC day and EMAIL_PER_MINUTE_LIMIT
+  per minute, shared by all workers through counters in `send_budget`
+  (reserved a few sends at a time to avoid a round trip per email)
+- A global token bucket that spreads the per-minute budget evenly over the
+  minute, optionally slowed further to spread what is left of the daily
+  budget over the rest of the day (EMAIL_SPREAD_DAILY_BUDGET)
+- Per-recipient-domain token buckets (EMAIL_DOMAIN_RATE_PER_MINUTE, with
+  bursts of EMAIL_DOMAIN_BURST), so one busy domain never stalls the others
+  (waits are computed under the shared lock but slept outside it)
+- Priority: among sendable messages, the lead tier with the shortest email
+  frequency (see `get_email_frequency_hours`) goes first, hot leads first
+
+When the daily budget is spent, the remaining messages are returned as
+deferred rather than attempted.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Tuple
+
+from pymongo import ReturnDocument
+
+from app.database import get_email_frequency_hours
+
+
+EMAIL_DAILY_LIMIT = int(os.getenv("EMAIL_DAILY_LIMIT") or "2000")
+EMAIL_PER_MINUTE_LIMIT = int(os.getenv("EMAIL_PER_MINUTE_LIMIT") or "60")
+EMAIL_DOMAIN_RATE_PER_MINUTE = float(os.getenv("EMAIL_DOMAIN_RATE_PER_MINUTE") or "20")
+EMAIL_DOMAIN_BURST = int(os.getenv("EMAIL_DOMAIN_BURST") or "5")
+EMAIL_SPREAD_DAILY_BUDGET = (os.getenv("EMAIL_SPREAD_DAILY_BUDGET") or "false").lower() == "true"
+
+BUDGET_COLLECTION = "send_budget"
+RESERVATION_SIZE = 10
+
+DAILY_LIMIT_REACHED = "Deferred: daily send limit reached"
+
+
+def next_utc_midnight(now: datetime) -> datetime:
+    return datetime(now.year, now.month, now.day) + timedelta(days=1)
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+
+# ============================================
+# Persisted Budgets
+# ============================================
+
+class _WindowBudget:
+    """
+    A send budget per fixed time window ("day" or "minute"), shared across
+    workers through a counter document per window.
+
+    Sends are reserved from the database RESERVATION_SIZE at a time and
+    handed out locally; without MongoDB the counter is per-process.
+    """
+
+    def __init__(self, window: str, limit: int):
+        self.window = window
+        self.limit = limit
+        self._key: Optional[str] = None
+        self._reserved = 0
+        self._local_counts: Dict[str, int] = {}
+        self.last_count = 0
+
+    def _window_key(self, now: datetime) -> Tuple[str, datetime]:
+        if self.window == "day":
+            return now.strftime("day:%Y-%m-%d"), next_utc_midnight(now)
+        start = now.replace(second=0, microsecond=0)
+        return start.strftime("minute:%Y-%m-%dT%H:%M"), start + timedelta(minutes=1)
+
+    async def _reserve_from_store(self, key: str, window_end: datetime, wanted: int) -> int:
+        from app.storage import is_mongo
+
+        if not is_mongo():
+            used = self._local_counts.get(key, 0)
+            granted = max(0, min(wanted, self.limit - used))
+            self._local_counts = {key: used + granted}
+            self.last_count = used + granted
+            return granted
+
+        from app.database import get_database
+
+        collection = get_database()[BUDGET_COLLECTION]
+        await collection.update_one(
+            {"_id": key},
+            {"$setOnInsert": {"count": 0, "limit": self.limit, "expires_at": window_end + timedelta(days=1)}},
+            upsert=True
+        )
+        # Take as much of the wanted reservation as fits, largest first
+        for size in sorted({wanted, 1}, reverse=True):
+            doc = await collection.find_one_and_update(
+                {"_id": key, "count": {"$lte": self.limit - size}},
+                {"$inc": {"count": size}},
+                return_document=ReturnDocument.AFTER
+            )
+            if doc:
+                self.last_count = doc["count"]
+                return size
+        self.last_count = self.limit
+        return 0
+
+    async def take(self, now: datetime) -> Optional[datetime]:
+        """
+        Use one send from the budget.
+
+        Returns None on success, or the end of the window when it is spent.
+        """
+        key, window_end = self._window_key(now)
+        if key != self._key:
+            self._key = key
+            self._reserved = 0
+        if self._reserved == 0:
+            self._reserved = await self._reserve_from_store(key, window_end, RESERVATION_SIZE)
+            if self._reserved == 0:
+                return window_end
+        self._reserved -= 1
+        return None
+
+    async def release(self) -> None:
+        """Give back this worker's unused reservation (e.g. on shutdown)."""
+        if not self._reserved or not self._key:
+            return
+        unused, self._reserved = self._reserved, 0
+        from app.storage import is_mongo
+        if is_mongo():
+            from app.database import get_database
+            await get_database()[BUDGET_COLLECTION].update_one({"_id": self._key}, {"$inc": {"count": -unused}})
+        elif self._key in self._local_counts:
+            self._local_counts[self._key] -= unused
+
+
+class SendPacer:
+    """Process-wide pacing state: global budgets and bucket, per-domain buckets."""
+
+    def __init__(
+        self,
+        daily_limit: int = EMAIL_DAILY_LIMIT,
+        per_minute_limit: int = EMAIL_PER_MINUTE_LIMIT,
+        domain_rate_per_minute: float = EMAIL_DOMAIN_RATE_PER_MINUTE,
+        domain_burst: int = EMAIL_DOMAIN_BURST,
+        spread_daily: bool = EMAIL_SPREAD_DAILY_BUDGET
+    ):
+        self.daily = _WindowBudget("day", daily_limit)
+        self.minute = _WindowBudget("minute", per_minute_limit)
+        self.per_minute_limit = per_minute_limit
+        self.domain_rate = domain_rate_per_minute / 60
+        self.domain_burst = domain_burst
+        self.spread_daily = spread_daily
+
+        # Small capacity, so the minute's budget is spread rather than burst
+        self.global_bucket = TokenBucket(per_minute_limit / 60, max(1, per_minute_limit // 10))
+        self._domains: Dict[str, TokenBucket] = {}
+        self.lock = asyncio.Lock()
+
+        self.stats = {"sent": 0, "deferred": 0, "waits": 0, "wait_seconds": 0.0, "minute_cap_hits": 0}
+
+    def domain_bucket(self, domain: str) -> TokenBucket:
+        bucket = self._domains.get(domain)
+        if bucket is None:
+            if len(self._domains) > 10000:
+                self._domains.clear()  # Idle buckets are full anyway
+            bucket = self._domains[domain] = TokenBucket(self.domain_rate, self.domain_burst)
+        return bucket
+
+    def _spread_rate(self, now: datetime) -> None:
+        """Slow the global rate so the rest of the daily budget lasts until midnight."""
+        remaining = max(0, self.daily.limit - self.daily.last_count)
+        seconds_left = max(1.0, (next_utc_midnight(now) - now).total_seconds())
+        self.global_bucket.rate = min(self.per_minute_limit / 60, remaining / seconds_left)
+
+    async def take_budget(self) -> Tuple[Optional[datetime], float]:
+        """
+        Use one send from the daily and per-minute budgets.
+
+        Returns (daily reset time, 0) when the daily budget is spent,
+        (None, seconds) when the minute budget is spent and the caller
+        should retry after that long, or (None, 0) on success.
+        """
+        now = datetime.utcnow()
+        daily_reset = await self.daily.take(now)
+        if daily_reset:
+            return daily_reset, 0.0
+        if self.spread_daily:
+            self._spread_rate(now)
+        minute_reset = await self.minute.take(now)
+        if minute_reset is None:
+            return None, 0.0
+        # Minute budget spent by other workers: wait for the next window
+        self.daily._reserved += 1
+        self.stats["minute_cap_hits"] += 1
+        return None, (minute_reset - now).total_seconds()
+
+    async def release(self) -> None:
+        """Give back unused budget reservations (on shutdown)."""
+        async with self.lock:
+            await self.daily.release()
+            await self.minute.release()
+
+    async def _sleep(self, seconds: float) -> None:
+        self.stats["waits"] += 1
+        self.stats["wait_seconds"] += seconds
+        await asyncio.sleep(seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "wait_seconds": round(self.stats["wait_seconds"], 1),
+            "daily_limit": self.daily.limit,
+            "daily_used": self.daily.last_count,
+            "per_minute_limit": self.per_minute_limit,
+            "global_rate_per_minute": round(self.global_bucket.rate * 60, 1),
+            "domain_rate_per_minute": round(self.domain_rate * 60, 1),
+            "domain_burst": self.domain_burst,
+            "tracked_domains": len(self._domains),
+        }
+
+
+_pacer: Optional[SendPacer] = None
+
+
+def get_send_pacer() -> SendPacer:
+    """Get the process-wide pacer shared by all deliveries."""
+    global _pacer
+    if _pacer is None:
+        _pacer = SendPacer()
+    return _pacer
+
+
+async def release_send_budget() -> None:
+    """Return the pacer's unused reservations, so other workers can use them."""
+    if _pacer is not None:
+        await _pacer.release()
+
+
+# ============================================
+# Paced Queue
+# ============================================
+
+def _domain(address: str) -> str:
+    return (address or "").rsplit("@", 1)[-1].strip().lower()
+
+
+class PacedQueue:
+    """
+    The messages of one delivery, handed out in priority order as the
+    pacer allows.
+
+    Each domain keeps its own priority heap. Domains whose bucket has a
+    token sit in a ready heap ordered by their best message; the others
+    wait in a heap ordered by when their next token arrives, so choosing
+    the next message is O(log domains).
+    """
+
+    def __init__(self, emails: List[Dict[str, Any]], pacer: Optional[SendPacer] = None):
+        self.pacer = pacer or get_send_pacer()
+        self._sequence = itertools.count()
+        self._domains: Dict[str, List[Tuple[int, int, Dict[str, Any]]]] = {}
+        for email in emails:
+            rank = get_email_frequency_hours(email.get("score", 50))
+            heapq.heappush(self._domains.setdefault(_domain(email["to"]), []), (rank, next(self._sequence), email))
+        self._ready: List[Tuple[int, int, str]] = [
+            (heap[0][0], heap[0][1], domain) for domain, heap in self._domains.items()
+        ]
+        heapq.heapify(self._ready)
+        self._waiting: List[Tuple[float, str]] = []
+        self._daily_reset: Optional[datetime] = None
+
+    def _pop(self, domain: str) -> Dict[str, Any]:
+        heap = self._domains[domain]
+        _, _, email = heapq.heappop(heap)
+        if not heap:
+            del self._domains[domain]
+        return email
+
+    def _schedule(self, domain: str, now: float) -> None:
+        """Put a domain with messages left back in the ready or waiting heap."""
+        heap = self._domains.get(domain)
+        if not heap:
+            return
+        wait = self.pacer.domain_bucket(domain).wait_time(now)
+        if wait <= 0:
+            heapq.heappush(self._ready, (heap[0][0], heap[0][1], domain))
+        else:
+            heapq.heappush(self._waiting, (now + wait, domain))
+
+    async def next(self) -> Optional[Tuple[Dict[str, Any], Optional[str]]]:
+        """
+        Wait for the next message that may be sent.
+
+        Returns (email, None) to send, (email, reason) for a deferred
+        message, or None when the queue is empty.
+        """
+        while True:
+            async with self.pacer.lock:
+                item, wait = await self._take()
+            if not wait:
+                return item
+            # Sleep outside the lock, so other deliveries' ready domains keep going
+            await self.pacer._sleep(wait)
+
+    async def _take(self) -> Tuple[Optional[Tuple[Dict[str, Any], Optional[str]]], float]:
+        """
+        Take the next message if one may go now (under the pacer lock).
+
+        Returns (item as for `next`, 0), or (None, seconds to wait first).
+        """
+        pacer = self.pacer
+        while True:
+            if not self._ready and not self._waiting:
+                return None, 0.0
+
+            if self._daily_reset:
+                domain = (self._ready or self._waiting)[0][-1]
+                email = self._pop(domain)
+                if domain not in self._domains:
+                    self._ready = [item for item in self._ready if item[-1] != domain]
+                    self._waiting = [item for item in self._waiting if item[-1] != domain]
+                    heapq.heapify(self._ready)
+                    heapq.heapify(self._waiting)
+                pacer.stats["deferred"] += 1
+                return (email, DAILY_LIMIT_REACHED), 0.0
+
+            now = time.monotonic()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, domain = heapq.heappop(self._waiting)
+                self._schedule(domain, now)
+
+            if not self._ready:
+                return None, self._waiting[0][0] - now
+
+            global_wait = pacer.global_bucket.wait_time(now)
+            if global_wait > 0:
+                return None, global_wait
+
+            _, _, domain = heapq.heappop(self._ready)
+            bucket = pacer.domain_bucket(domain)
+            if bucket.wait_time(now) > 0:
+                # Another delivery used this domain's token meanwhile
+                self._schedule(domain, now)
+                continue
+
+            self._daily_reset, minute_wait = await pacer.take_budget()
+            if self._daily_reset or minute_wait > 0:
+                heapq.heappush(self._ready, (self._domains[domain][0][0], self._domains[domain][0][1], domain))
+                if minute_wait > 0:
+                    return None, minute_wait
+                continue
+
+            now = time.monotonic()
+            pacer.global_bucket.take(now)
+            bucket.take(now)
+            email = self._pop(domain)
+            self._schedule(domain, now)
+            pacer.stats["sent"] += 1
+            return (email, None), 0.0
+
+    @property
+    def daily_reset(self) -> Optional[datetime]:
+        """When the daily budget resets, if this queue ran out of it."""
+        return self._daily_reset
@@ -0,0 +1,839 @@
+"""
+SQLite Database Module for AI Marketing Agent.
+Embedded storage backend for single-node deployments, tests and benchmarks,
+implementing the same operations as app/database.py without a separate
+mongod (select it with STORAGE_BACKEND=sqlite, see app/storage.py).
+
+Each table keeps the full document as JSON in `data` (Extended JSON, so
+datetimes round-trip) plus the columns we filter and sort on, which are
+indexed. The database runs in WAL mode so readers never block the writer.
+Calls run in worker threads, each with its own connection.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Callable
+
+from bson import ObjectId, json_util
+from dotenv import load_dotenv
+
+from app.database import (
+    normalize_email, lead_insert_defaults, get_email_frequency_hours, build_email_history_document,
+    pick_default_slot, create_post_calendar_event
+)
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+SQLITE_PATH = os.getenv("SQLITE_PATH") or os.path.join("data", "marketing.db")
+
+_JSON_OPTIONS = json_util.JSONOptions(tz_aware=False)
+
+# Table -> indexed columns extracted from the document (besides id and data)
+TABLE_COLUMNS = {
+    "generations": ["type", "created_at"],
+    "website_analyses": ["created_at"],
+    "social_posts": ["status", "platform", "scheduled_for", "engagement_score", "created_at"],
+    "leads": ["email_normalized", "status", "source", "score", "last_emailed_at", "created_at"],
+    "email_history": ["lead_id", "success", "sent_at"],
+}
+
+# Lead fields stored only in their column, so they can be updated in SQL
+_COLUMN_ONLY = {"leads": {"last_emailed_at"}}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    id TEXT PRIMARY KEY, type TEXT, created_at TEXT NOT NULL, data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_generations_created ON generations (created_at);
+CREATE INDEX IF NOT EXISTS idx_generations_type_created ON generations (type, created_at);
+
+CREATE TABLE IF NOT EXISTS website_analyses (
+    id TEXT PRIMARY KEY, created_at TEXT NOT NULL, data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_website_analyses_created ON website_analyses (created_at);
+
+CREATE TABLE IF NOT EXISTS social_posts (
+    id TEXT PRIMARY KEY, status TEXT, platform TEXT, scheduled_for TEXT,
+    engagement_score REAL, created_at TEXT NOT NULL, data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_social_posts_created ON social_posts (created_at);
+CREATE INDEX IF NOT EXISTS idx_social_posts_status_scheduled ON social_posts (status, scheduled_for);
+CREATE INDEX IF NOT EXISTS idx_social_posts_platform_created ON social_posts (platform, created_at);
+
+CREATE TABLE IF NOT EXISTS leads (
+    id TEXT PRIMARY KEY, email_normalized TEXT UNIQUE, status TEXT, source TEXT,
+    score REAL, last_emailed_at TEXT, created_at TEXT, data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_leads_created ON leads (created_at);
+CREATE INDEX IF NOT EXISTS idx_leads_status_created ON leads (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_leads_source_created ON leads (source, created_at);
+CREATE INDEX IF NOT EXISTS idx_leads_score ON leads (score);
+
+CREATE TABLE IF NOT EXISTS email_history (
+    id TEXT PRIMARY KEY, lead_id TEXT, success INTEGER, sent_at TEXT NOT NULL, data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_email_history_sent ON email_history (sent_at);
+CREATE INDEX IF NOT EXISTS idx_email_history_lead_sent ON email_history (lead_id, sent_at);
+"""
+
+
+# ============================================
+# Connection Handling
+# ============================================
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _connect() -> sqlite3.Connection:
+    """Get this thread's connection, creating the schema on first use."""
+    global _schema_ready
+
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        directory = os.path.dirname(SQLITE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(SQLITE_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-20000")  # ~20MB page cache per connection
+        _local.conn = conn
+
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.executescript(SCHEMA)
+                _schema_ready = True
+
+    return conn
+
+
+async def _run(fn: Callable, *args):
+    """Run a blocking database function in a worker thread."""
+    return await asyncio.to_thread(fn, *args)
+
+
+class _transaction:
+    """`with _transaction() as conn:` runs the block in one write transaction."""
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn = _connect()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+# ============================================
+# Document Encoding
+# ============================================
+
+def _ts(value: Optional[datetime]) -> Optional[str]:
+    """Encode a datetime as a sortable column value."""
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f") if value else None
+
+
+def _column_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return _ts(value)
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float, str)) or value is None:
+        return value
+    return str(value)
+
+
+def _encode(table: str, document: Dict[str, Any]) -> List[Any]:
+    """Row values (id, columns..., data) for a document."""
+    data = {k: v for k, v in document.items() if k != "_id" and k not in _COLUMN_ONLY.get(table, ())}
+    return (
+        [str(document["_id"])]
+        + [_column_value(document.get(column)) for column in TABLE_COLUMNS[table]]
+        + [json_util.dumps(data)]
+    )
+
+
+def _insert_sql(table: str, conflict: str = "OR IGNORE") -> str:
+    columns = ["id"] + TABLE_COLUMNS[table] + ["data"]
+    return f"INSERT {conflict} INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+
+def _decode(row: sqlite3.Row) -> Dict[str, Any]:
+    """Document from a (id, data[, last_emailed_at]) row, with `_id` as string."""
+    document = json_util.loads(row[1], json_options=_JSON_OPTIONS)
+    document["_id"] = row[0]
+    if len(row) > 2:
+        document["last_emailed_at"] = datetime.fromisoformat(row[2]) if row[2] else None
+    return document
+
+
+def _iso(document: Dict[str, Any], *fields: str) -> Dict[str, Any]:
+    for field in fields:
+        if document.get(field):
+            document[field] = document[field].isoformat()
+    return document
+
+
+def _id_to_field(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Expose `_id` as `id` (the shape leads and email history are returned in)."""
+    document["id"] = document.pop("_id")
+    return document
+
+
+# ============================================
+# History Documents
+# ============================================
+
+def _insert_documents_sync(collection_name: str, documents: List[Dict[str, Any]]) -> List[str]:
+    if collection_name not in TABLE_COLUMNS:
+        raise ValueError(f"Unknown collection: {collection_name}")
+
+    for document in documents:
+        document.setdefault("_id", ObjectId())
+
+    with _transaction() as conn:
+        # Duplicate IDs are ignored, so a retried batch is idempotent
+        conn.executemany(_insert_sql(collection_name), [_encode(collection_name, d) for d in documents])
+
+    return [str(document["_id"]) for document in documents]
+
+
+async def insert_documents(
+    collection_name: str,
+    documents: List[Dict[str, Any]],
+    search_texts: Optional[List[str]] = None
+) -> List[str]:
+    """
+    Insert documents in one transaction (`search_texts` is accepted for
+    parity with the mongo backend; there is no search index here).
+
+    Returns list of inserted document IDs.
+    """
+    if not documents:
+        return []
+    return await _run(_insert_documents_sync, collection_name, documents)
+
+
+async def _save_document(collection_name: str, document: Dict[str, Any], background: bool) -> str:
+    """Insert now, or hand off to the write-behind queue and return the pre-assigned ID."""
+    if background:
+        from app.write_behind import get_write_behind_queue
+        document["_id"] = ObjectId()
+        get_write_behind_queue().enqueue(collection_name, document)
+        return str(document["_id"])
+
+    ids = await insert_documents(collection_name, [document])
+    return ids[0]
+
+
+async def save_generation(
+    generation_type: str,
+    business_name: str,
+    product_description: str,
+    target_audience: str,
+    content: Dict[str, Any],
+    image_url: Optional[str] = None,
+    goal: Optional[str] = None,
+    background: bool = False
+) -> str:
+    """Save a content generation. Returns the document ID."""
+    document = {
+        "type": generation_type,
+        "business_name": business_name,
+        "product_description": product_description,
+        "target_audience": target_audience,
+        "goal": goal,
+        "content": content,
+        "image_url": image_url,
+        "created_at": datetime.utcnow()
+    }
+
+    return await _save_document("generations", document, background)
+
+
+async def save_website_analysis(
+    website_url: str,
+    title: Optional[str],
+    description: Optional[str],
+    content_summary: Optional[str],
+    seo_analysis: str,
+    background: bool = False
+) -> str:
+    """Save a website SEO analysis. Returns the document ID."""
+    document = {
+        "website_url": website_url,
+        "title": title,
+        "description": description,
+        "content_summary": content_summary,
+        "seo_analysis": seo_analysis,
+        "created_at": datetime.utcnow()
+    }
+
+    return await _save_document("website_analyses", document, background)
+
+
+def _select_sync(sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
+    return [_decode(row) for row in _connect().execute(sql, params)]
+
+
+async def get_generations(
+    limit: int = 50,
+    generation_type: Optional[str] = None,
+    include_content: bool = True
+) -> List[Dict[str, Any]]:
+    """Retrieve generation history, newest first."""
+    if generation_type:
+        sql = "SELECT id, data FROM generations WHERE type = ? ORDER BY created_at DESC LIMIT ?"
+        params = (generation_type, limit)
+    else:
+        sql = "SELECT id, data FROM generations ORDER BY created_at DESC LIMIT ?"
+        params = (limit,)
+
+    docs = await _run(_select_sync, sql, params)
+    for doc in docs:
+        if not include_content:
+            doc.pop("content", None)
+        _iso(doc, "created_at")
+    return docs
+
+
+async def get_website_analyses(limit: int = 50) -> List[Dict[str, Any]]:
+    """Retrieve website analysis history, newest first."""
+    docs = await _run(
+        _select_sync,
+        "SELECT id, data FROM website_analyses ORDER BY created_at DESC LIMIT ?",
+        (limit,)
+    )
+    return [_iso(doc, "created_at") for doc in docs]
+
+
+async def _get_history_document(table: str, document_id: str) -> Optional[Dict[str, Any]]:
+    docs = await _run(_select_sync, f"SELECT id, data FROM {table} WHERE id = ?", (document_id,))
+    return _iso(docs[0], "created_at") if docs else None
+
+
+async def get_generation_by_id(generation_id: str) -> Optional[Dict[str, Any]]:
+    """Get a specific generation by ID, or None."""
+    return await _get_history_document("generations", generation_id)
+
+
+async def get_website_analysis_by_id(analysis_id: str) -> Optional[Dict[str, Any]]:
+    """Get a specific website analysis by ID, or None."""
+    return await _get_history_document("website_analyses", analysis_id)
+
+
+def _get_stats_sync() -> Dict[str, Any]:
+    conn = _connect()
+    by_type = dict(conn.execute("SELECT type, COUNT(*) FROM generations GROUP BY type").fetchall())
+    analyses = conn.execute("SELECT COUNT(*) FROM website_analyses").fetchone()[0]
+    return {
+        "total_generations": sum(by_type.values()),
+        "total_website_analyses": analyses,
+        "by_type": {str(k): v for k, v in by_type.items()}
+    }
+
+
+async def get_stats() -> Dict[str, Any]:
+    """Get statistics about stored generations (counts served from the type index)."""
+    return await _run(_get_stats_sync)
+
+
+def _get_dashboard_counts_sync(week_ago: datetime) -> Dict[str, Any]:
+    conn = _connect()
+    by_status = dict(conn.execute("SELECT status, COUNT(*) FROM leads GROUP BY status").fetchall())
+    by_source = dict(conn.execute("SELECT source, COUNT(*) FROM leads GROUP BY source").fetchall())
+    pipeline_value = conn.execute("SELECT SUM(json_extract(data, '$.value')) FROM leads").fetchone()[0]
+    leads_this_week = conn.execute(
+        "SELECT COUNT(*) FROM leads WHERE created_at > ?", (_ts(week_ago),)
+    ).fetchone()[0]
+    emails, successful = conn.execute("SELECT COUNT(*), SUM(success) FROM email_history").fetchone()
+    return {
+        "total_leads": sum(by_status.values()),
+        "by_status": {str(k): v for k, v in by_status.items() if k is not None},
+        "by_source": {str(k): v for k, v in by_source.items() if k is not None},
+        "pipeline_value": pipeline_value or 0,
+        "leads_this_week": leads_this_week,
+        "emails_sent": emails,
+        "emails_successful": successful or 0,
+    }
+
+
+async def get_dashboard_counts() -> Dict[str, Any]:
+    """
+    Lead and email counts for the dashboard (the mongo backend serves these
+    from rollup counters; here they come straight from the indexed columns).
+    """
+    return await _run(_get_dashboard_counts_sync, datetime.utcnow() - timedelta(days=7))
+
+
+# ============================================
+# Social Posts & Scheduling
+# ============================================
+
+async def save_social_post(
+    business_name: str,
+    product_description: str,
+    target_audience: str,
+    platform: str,
+    content: str,
+    image_url: Optional[str] = None,
+    scheduled_for: Optional[datetime] = None,
+    status: str = "draft",
+    background: bool = False
+) -> str:
+    """Save a social media post with optional scheduling. Returns the document ID."""
+    document = {
+        "business_name": business_name,
+        "product_description": product_description,
+        "target_audience": target_audience,
+        "platform": platform,
+        "content": content,
+        "image_url": image_url,
+        "scheduled_for": scheduled_for,
+        "status": status,
+        "created_at": datetime.utcnow()
+    }
+
+    return await _save_document("social_posts", document, background)
+
+
+def _format_post(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return _iso(doc, "created_at", "scheduled_for")
+
+
+async def get_social_posts(
+    limit: int = 50,
+    status: Optional[str] = None,
+    platform: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Get social posts with optional filtering, newest first."""
+    conditions, params = [], []
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    if platform:
+        conditions.append("platform = ?")
+        params.append(platform)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    docs = await _run(
+        _select_sync,
+        f"SELECT id, data FROM social_posts {where} ORDER BY created_at DESC LIMIT ?",
+        (*params, limit)
+    )
+    return [_format_post(doc) for doc in docs]
+
+
+async def get_scheduled_posts() -> List[Dict[str, Any]]:
+    """Get all scheduled posts, soonest first."""
+    docs = await _run(
+        _select_sync,
+        "SELECT id, data FROM social_posts WHERE status = 'scheduled' AND scheduled_for IS NOT NULL "
+        "ORDER BY scheduled_for"
+    )
+    return [_format_post(doc) for doc in docs]
+
+
+def _update_post_sync(post_id: str, changes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Apply field changes to a post in one transaction. Returns the post before the change."""
+    with _transaction() as conn:
+        row = conn.execute("SELECT id, data FROM social_posts WHERE id = ?", (post_id,)).fetchone()
+        if row is None:
+            return None
+        before = _decode(row)
+        after = {**before, **changes}
+        conn.execute(_insert_sql("social_posts", "OR REPLACE"), _encode("social_posts", after))
+        return before
+
+
+async def update_post_status(post_id: str, new_status: str) -> bool:
+    """Update a post's status (draft, scheduled, published)."""
+    before = await _run(_update_post_sync, post_id, {"status": new_status})
+    return bool(before) and before.get("status") != new_status
+
+
+async def update_post_schedule(post_id: str, scheduled_for: datetime) -> bool:
+    """Update a post's scheduled time."""
+    before = await _run(_update_post_sync, post_id, {"scheduled_for": scheduled_for, "status": "scheduled"})
+    if not before:
+        return False
+    return before.get("status") != "scheduled" or before.get("scheduled_for") != scheduled_for
+
+
+def _next_available_slot_sync(now: datetime) -> datetime:
+    conn = _connect()
+
+    published_count = conn.execute(
+        "SELECT COUNT(*) FROM social_posts WHERE status = 'published' AND engagement_score IS NOT NULL"
+    ).fetchone()[0]
+
+    if published_count >= 5:
+        # Best average engagement by hour of day
+        best = conn.execute(
+            "SELECT CAST(strftime('%H', scheduled_for) AS INTEGER) AS hour, AVG(engagement_score) AS avg_engagement "
+            "FROM social_posts WHERE status = 'published' AND engagement_score IS NOT NULL AND scheduled_for IS NOT NULL "
+            "GROUP BY hour ORDER BY avg_engagement DESC LIMIT 1"
+        ).fetchone()
+        if best:
+            target = now.replace(hour=best[0], minute=0, second=0, microsecond=0)
+            if target <= now:
+                target = target + timedelta(days=1)
+            taken = conn.execute(
+                "SELECT 1 FROM social_posts WHERE status = 'scheduled' AND scheduled_for = ? LIMIT 1",
+                (_ts(target),)
+            ).fetchone()
+            return target + timedelta(minutes=30) if taken else target
+
+    rows = conn.execute(
+        "SELECT scheduled_for FROM social_posts WHERE status = 'scheduled' AND scheduled_for BETWEEN ? AND ? LIMIT 100",
+        (_ts(now), _ts(now + timedelta(days=7)))
+    ).fetchall()
+    return pick_default_slot(now, [datetime.fromisoformat(row[0]) for row in rows])
+
+
+async def get_next_available_slot() -> datetime:
+    """
+    Calculate the next available posting slot: the best performing hour once
+    5+ published posts have engagement data, otherwise the next free default slot.
+    """
+    return await _run(_next_available_slot_sync, datetime.utcnow())
+
+
+async def record_engagement(post_id: str, engagement_score: int) -> bool:
+    """Record engagement score for a published post."""
+    before = await _run(_update_post_sync, post_id, {"engagement_score": engagement_score})
+    return bool(before) and before.get("engagement_score") != engagement_score
+
+
+async def auto_schedule_post(post_id: str) -> Optional[datetime]:
+    """
+    Automatically schedule a post at the optimal time and create a Google
+    Calendar event for it. Returns the scheduled datetime.
+    """
+    optimal_time = await get_next_available_slot()
+
+    if not await update_post_schedule(post_id, optimal_time):
+        return None
+
+    try:
+        docs = await _run(_select_sync, "SELECT id, data FROM social_posts WHERE id = ?", (post_id,))
+        if docs:
+            event_fields = create_post_calendar_event(docs[0], optimal_time)
+            if event_fields:
+                await _run(_update_post_sync, post_id, event_fields)
+    except Exception as e:
+        print(f"[Calendar] Error creating event: {e}")
+
+    return optimal_time
+
+
+# ============================================
+# Lead Management
+# ============================================
+
+async def ensure_lead_indexes() -> None:
+    """Create the schema (including the unique normalized-email index)."""
+    await _run(_connect)
+
+
+def _upsert_leads_sync(leads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    now = datetime.utcnow()
+
+    merged: Dict[str, Dict[str, Any]] = {}
+    row_keys: List[Optional[str]] = []
+    errors = []
+
+    for index, lead in enumerate(leads):
+        own_key = normalize_email(lead.get("email"))
+        if not own_key:
+            row_keys.append(None)
+            errors.append({"index": index, "error": "Missing email"})
+            continue
+        # Rows resolved as duplicates (app/lead_dedupe.py) update the lead they match
+        key = lead.get("_merge_key") or own_key
+        row_keys.append(key)
+        update = {k: v for k, v in lead.items() if k not in ("_id", "id", "created_at", "_merge_key")}
+        if key != own_key:
+            update.pop("email", None)  # Kept in alternate_emails; the lead keeps its address
+        fields = merged.setdefault(key, {})
+        fields.update(update)
+        fields["email_normalized"] = key
+        if "score" in lead:
+            fields["base_score"] = lead["score"]  # Imported score is the rescoring baseline
+
+    key_ids: Dict[str, str] = {}
+    inserted = 0
+
+    if merged:
+        keys = list(merged)
+        with _transaction() as conn:
+            existing = {}
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT id, data, last_emailed_at FROM leads "
+                    f"WHERE email_normalized IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for row in rows:
+                    doc = _decode(row)
+                    existing[doc["email_normalized"]] = doc
+
+            rows = []
+            for key in keys:
+                old = existing.get(key)
+                if old:
+                    document = {**old, **merged[key], "updated_at": now}
+                else:
+                    document = {
+                        **lead_insert_defaults(merged[key]), **merged[key],
+                        "_id": ObjectId(), "created_at": now, "updated_at": now
+                    }
+                    inserted += 1
+                key_ids[key] = str(document["_id"])
+                rows.append(_encode("leads", document))
+
+            conn.executemany(_insert_sql("leads", "OR REPLACE"), rows)
+
+    ids = [key_ids.get(key) if key else None for key in row_keys]
+    return {
+        "ids": ids,
+        "inserted": inserted,
+        "updated": len(key_ids) - inserted,
+        "errors": errors
+    }
+
+
+async def upsert_leads(leads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Insert or update leads keyed by normalized email, in one transaction.
+
+    Rows in the same batch that share an email are merged (later rows win).
+    Existing leads get only the fields a row supplies; schema defaults
+    apply when a lead is inserted.
+
+    Returns:
+        dict with ids (per input row), inserted, updated and errors
+    """
+    return await _run(_upsert_leads_sync, leads)
+
+
+async def save_lead(lead_data: Dict[str, Any]) -> str:
+    """Save a single lead (updating the existing lead with the same email). Returns its ID."""
+    result = await upsert_leads([lead_data])
+    if result["errors"]:
+        raise ValueError(result["errors"][0]["error"])
+    return result["ids"][0]
+
+
+async def save_leads_bulk(leads: List[Dict[str, Any]]) -> List[str]:
+    """Save multiple leads with an upsert on normalized email. Returns the written IDs."""
+    result = await upsert_leads(leads)
+    return [lead_id for lead_id in result["ids"] if lead_id]
+
+
+def _format_lead(doc: Dict[str, Any]) -> Dict[str, Any]:
+    if doc.get("last_emailed_at") is None:
+        doc.pop("last_emailed_at", None)
+    return _iso(_id_to_field(doc), "created_at", "updated_at")
+
+
+async def get_leads(
+    limit: int = 100,
+    status: Optional[str] = None,
+    source: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Retrieve leads, newest first, with optional filtering."""
+    conditions, params = [], []
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    if source:
+        conditions.append("source = ?")
+        params.append(source)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    docs = await _run(
+        _select_sync,
+        f"SELECT id, data, last_emailed_at FROM leads {where} ORDER BY created_at DESC LIMIT ?",
+        (*params, limit)
+    )
+    return [_format_lead(doc) for doc in docs]
+
+
+async def get_leads_by_ids(lead_ids: List[str]) -> List[Dict[str, Any]]:
+    """Retrieve leads by ID, in the order given (missing leads are left out)."""
+    ids = [lead_id for lead_id in lead_ids if lead_id]
+    if not ids:
+        return []
+    docs = await _run(
+        _select_sync,
+        f"SELECT id, data, last_emailed_at FROM leads WHERE id IN ({', '.join('?' * len(ids))})",
+        tuple(ids)
+    )
+    found = {lead["id"]: lead for lead in (_format_lead(doc) for doc in docs)}
+    return [found[lead_id] for lead_id in ids if lead_id in found]
+
+
+def _delete_all_leads_sync() -> int:
+    with _transaction() as conn:
+        return conn.execute("DELETE FROM leads").rowcount
+
+
+async def delete_all_leads() -> int:
+    """Delete all leads. Returns count of deleted rows."""
+    return await _run(_delete_all_leads_sync)
+
+
+# ============================================
+# Score-Based Email Campaign
+# ============================================
+
+async def save_email_history(
+    lead_id: str,
+    lead_email: str,
+    subject: str,
+    success: bool,
+    message: str = None
+) -> str:
+    """Save email send history (campaigns should prefer app/history_writer.py)."""
+    document = build_email_history_document(lead_id, lead_email, subject, success, message)
+    ids = await save_email_history_bulk([document])
+    return ids[0]
+
+
+def _save_email_history_bulk_sync(documents: List[Dict[str, Any]]) -> List[str]:
+    for document in documents:
+        document.setdefault("_id", ObjectId())
+
+    last_sent: Dict[str, datetime] = {}
+    for document in documents:
+        lead_id = document.get("lead_id")
+        if lead_id:
+            last_sent[lead_id] = max(document["sent_at"], last_sent.get(lead_id, document["sent_at"]))
+
+    counters: Dict[str, Dict[str, int]] = {}
+    for document in documents:
+        lead_id = document.get("lead_id")
+        if lead_id:
+            counts = counters.setdefault(lead_id, {"emails_sent": 0, "emails_failed": 0})
+            counts["emails_sent" if document.get("success") else "emails_failed"] += 1
+    updated_at = json_util.dumps(datetime.utcnow())
+
+    with _transaction() as conn:
+        conn.executemany(_insert_sql("email_history"), [_encode("email_history", d) for d in documents])
+        # MAX() keeps last_emailed_at from moving backwards on out-of-order batches
+        conn.executemany(
+            """
+            UPDATE leads SET
+                last_emailed_at = MAX(COALESCE(last_emailed_at, ''), ?),
+                data = json_set(
+                    data,
+                    '$.emails_sent', COALESCE(json_extract(data, '$.emails_sent'), 0) + ?,
+                    '$.emails_failed', COALESCE(json_extract(data, '$.emails_failed'), 0) + ?,
+                    '$.updated_at', json(?)
+                )
+            WHERE id = ?
+            """,
+            [
+                (_ts(sent_at), counters[lead_id]["emails_sent"], counters[lead_id]["emails_failed"], updated_at, lead_id)
+                for lead_id, sent_at in last_sent.items()
+            ]
+        )
+
+    return [str(document["_id"]) for document in documents]
+
+
+async def save_email_history_bulk(documents: List[Dict[str, Any]]) -> List[str]:
+    """
+    Save many email history rows and update each lead's `last_emailed_at`,
+    `emails_sent` / `emails_failed` counters and `updated_at`, in one
+    transaction.
+
+    Returns list of inserted history IDs.
+    """
+    if not documents:
+        return []
+    return await _run(_save_email_history_bulk_sync, documents)
+
+
+def _get_last_email_time_sync(lead_id: str) -> Optional[datetime]:
+    row = _connect().execute(
+        "SELECT MAX(sent_at) FROM email_history WHERE lead_id = ? AND success = 1", (lead_id,)
+    ).fetchone()
+    return datetime.fromisoformat(row[0]) if row and row[0] else None
+
+
+async def get_last_email_time(lead_id: str) -> Optional[datetime]:
+    """Get the last time an email was sent to this lead."""
+    return await _run(_get_last_email_time_sync, lead_id)
+
+
+def _leads_for_email_campaign_sync(now: datetime) -> List[Dict[str, Any]]:
+    # Each score tier's cutoff, so the frequency check runs in SQL
+    cutoffs = {score: _ts(now - timedelta(hours=get_email_frequency_hours(score))) for score in (90, 70, 50, 30, 0)}
+    rows = _connect().execute(
+        """
+        SELECT id, data, last_emailed_at FROM leads
+        WHERE last_emailed_at IS NULL OR last_emailed_at <= CASE
+            WHEN COALESCE(score, 50) >= 90 THEN ?
+            WHEN COALESCE(score, 50) >= 70 THEN ?
+            WHEN COALESCE(score, 50) >= 50 THEN ?
+            WHEN COALESCE(score, 50) >= 30 THEN ?
+            ELSE ? END
+        ORDER BY score DESC
+        """,
+        tuple(cutoffs.values())
+    ).fetchall()
+
+    eligible_leads = []
+    for row in rows:
+        lead = _decode(row)
+        if not lead.get("email"):
+            continue
+        score = lead.get("score", 50)
+        lead["frequency_hours"] = get_email_frequency_hours(score)
+        lead["priority"] = "hot" if score >= 90 else "warm" if score >= 70 else "medium" if score >= 50 else "cool" if score >= 30 else "cold"
+        eligible_leads.append(_format_lead(_iso(lead, "last_emailed_at")))
+
+    return eligible_leads
+
+
+async def get_leads_for_email_campaign(query: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Get leads eligible for email based on their score and last email time,
+    highest score first.
+    
+    Leads on the suppression list are left out. Segment filters (`query`)
+    are Mongo queries: segments need the mongo backend, and the endpoints
+    reject segment targeting before it reaches this backend.
+    """
+    from app.suppression import is_suppressed
+
+    if query:
+        raise NotImplementedError("Segment targeting requires the mongo storage backend")
+    leads = await _run(_leads_for_email_campaign_sync, datetime.utcnow())
+    return [lead for lead in leads if not is_suppressed(lead.get("email"))]
+
+
+async def get_email_history(lead_id: str = None, limit: int = 50) -> List[Dict[str, Any]]:
+    """Get email history, newest first, optionally filtered by lead ID."""
+    if lead_id:
+        sql = "SELECT id, data FROM email_history WHERE lead_id = ? ORDER BY sent_at DESC LIMIT ?"
+        params = (lead_id, limit)
+    else:
+        sql = "SELECT id, data FROM email_history ORDER BY sent_at DESC LIMIT ?"
+        params = (limit,)
+
+    docs = await _run(_select_sync, sql, params)
+    return [_iso(_id_to_field(doc), "sent_at") for doc in docs]
@@ -0,0 +1,103 @@
+"""
+Storage Backend Selection for AI Marketing Agent.
+Picks the persistence layer from STORAGE_BACKEND and re-exports its
+operations, so callers never depend on a particular backend:
+
+- "mongo" (default): app/database.py (Motor/MongoDB)
+- "sqlite": app/sqlite_database.py (embedded SQLite, WAL mode) for
+  single-node deployments, tests and benchmarks
+
+Both backends implement every operation listed in STORAGE_OPERATIONS.
+Archival, content compression, full-text search, exports, read routing and
+the rollup admin endpoints are built on MongoDB and need the mongo backend.
+"""
+
+import importlib
+import os
+
+from dotenv import load_dotenv
+
+# Pure helpers shared by both backends
+from app.database import normalize_email, get_email_frequency_hours, build_email_history_document
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+STORAGE_BACKEND = (os.getenv("STORAGE_BACKEND") or "mongo").lower()
+
+_BACKEND_MODULES = {
+    "mongo": "app.database",
+    "sqlite": "app.sqlite_database",
+}
+
+if STORAGE_BACKEND not in _BACKEND_MODULES:
+    raise ValueError(f"Invalid STORAGE_BACKEND '{STORAGE_BACKEND}'. Use: {', '.join(_BACKEND_MODULES)}")
+
+backend = importlib.import_module(_BACKEND_MODULES[STORAGE_BACKEND])
+
+STORAGE_OPERATIONS = [
+    # Generations & analyses
+    "insert_documents", "save_generation", "save_website_analysis",
+    "get_generations", "get_website_analyses",
+    "get_generation_by_id", "get_website_analysis_by_id", "get_stats",
+    # Social posts & scheduling
+    "save_social_post", "get_social_posts", "get_scheduled_posts",
+    "update_post_status", "update_post_schedule", "get_next_available_slot",
+    "record_engagement", "auto_schedule_post",
+    # Leads
+    "ensure_lead_indexes", "upsert_leads", "save_lead", "save_leads_bulk",
+    "get_leads", "get_leads_by_ids", "delete_all_leads",
+    # Email history
+    "save_email_history", "save_email_history_bulk", "get_last_email_time",
+    "get_leads_for_email_campaign", "get_email_history",
+]
+
+
+__all__ = [
+    "STORAGE_BACKEND", "is_mongo",
+    "normalize_email", "get_email_frequency_hours", "build_email_history_document",
+]
+__all__ += STORAGE_OPERATIONS
+
+
+def is_mongo() -> bool:
+    """Whether the MongoDB backend (and the Mongo-only features) is in use."""
+    return STORAGE_BACKEND == "mongo"
+
+
+# Generations & analyses
+insert_documents = backend.insert_documents
+save_generation = backend.save_generation
+save_website_analysis = backend.save_website_analysis
+get_generations = backend.get_generations
+get_website_analyses = backend.get_website_analyses
+get_generation_by_id = backend.get_generation_by_id
+get_website_analysis_by_id = backend.get_website_analysis_by_id
+get_stats = backend.get_stats
+
+# Social posts & scheduling
+save_social_post = backend.save_social_post
+get_social_posts = backend.get_social_posts
+get_scheduled_posts = backend.get_scheduled_posts
+update_post_status = backend.update_post_status
+update_post_schedule = backend.update_post_schedule
+get_next_available_slot = backend.get_next_available_slot
+record_engagement = backend.record_engagement
+auto_schedule_post = backend.auto_schedule_post
+
+# Leads
+ensure_lead_indexes = backend.ensure_lead_indexes
+upsert_leads = backend.upsert_leads
+save_lead = backend.save_lead
+save_leads_bulk = backend.save_leads_bulk
+get_leads = backend.get_leads
+get_leads_by_ids = backend.get_leads_by_ids
+delete_all_leads = backend.delete_all_leads
+
+# Email history
+save_email_history = backend.save_email_history
+save_email_history_bulk = backend.save_email_history_bulk
+get_last_email_time = backend.get_last_email_time
+get_leads_for_email_campaign = backend.get_leads_for_email_campaign
+get_email_history = backend.get_email_history
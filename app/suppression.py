@@ -0,0 +1,414 @@
+"""
+Suppression List for AI Marketing Agent.
+Email addresses and WhatsApp numbers that must not be messaged again:
+unsubscribes, hard bounces and spam complaints.
+
+The `suppressions` collection (one document per normalized address) is
+the source of truth. Every process keeps it in memory so the check at
+send time is O(1), with no database lookup per recipient:
+
+- a Bloom filter sized for SUPPRESSION_BLOOM_CAPACITY addresses at a
+  SUPPRESSION_BLOOM_ERROR_RATE false-positive rate, checked first
+- an exact set that confirms the Bloom filter's hits, so a false
+  positive never blocks a legitimate recipient
+
+Suppressions added by other processes are picked up every
+SUPPRESSION_REFRESH_SECONDS, and the whole list is reloaded every
+SUPPRESSION_RELOAD_SECONDS (which also applies removals). Bounces found
+by the synchronous senders are suppressed in memory at once and written
+by the same background task.
+
+The list fails closed: with MongoDB, no message is sent until the first
+load has succeeded; a failed load is retried in the background.
+
+Emails carry a signed one-click unsubscribe link (List-Unsubscribe) when
+tracking is enabled (TRACKING_BASE_URL and a real TRACKING_SECRET).
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import math
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Set, Tuple
+
+from pymongo import UpdateOne
+
+from app.database import normalize_email
+from app.tracking import TRACKING_BASE_URL, TRACKING_SECRET, signing_enabled, tracking_enabled
+
+
+SUPPRESSION_BLOOM_CAPACITY = int(os.getenv("SUPPRESSION_BLOOM_CAPACITY") or "1000000")
+SUPPRESSION_BLOOM_ERROR_RATE = float(os.getenv("SUPPRESSION_BLOOM_ERROR_RATE") or "0.001")
+SUPPRESSION_REFRESH_SECONDS = float(os.getenv("SUPPRESSION_REFRESH_SECONDS") or "30")
+SUPPRESSION_RELOAD_SECONDS = float(os.getenv("SUPPRESSION_RELOAD_SECONDS") or "3600")
+SUPPRESSION_LOAD_RETRY_SECONDS = float(os.getenv("SUPPRESSION_LOAD_RETRY_SECONDS") or "5")
+
+SUPPRESSIONS_COLLECTION = "suppressions"
+SUPPRESSION_REASONS = ["unsubscribe", "bounce", "complaint", "manual"]
+
+NOT_LOADED = "Not sent: the suppression list has not loaded yet"
+
+
+def normalize_address(address: Optional[str]) -> str:
+    """Email addresses lowercased; phone numbers as +digits (any "whatsapp:" prefix dropped)."""
+    address = (address or "").strip()
+    if "@" in address:
+        return normalize_email(address)
+    if address.lower().startswith("whatsapp:"):
+        address = address[len("whatsapp:"):]
+    digits = re.sub(r"\D", "", address)
+    return f"+{digits}" if digits else ""
+
+
+# ============================================
+# In-Memory Index
+# ============================================
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on one BLAKE2b digest)."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + index * second) % self.size for index in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class SuppressionList:
+    """The suppressed addresses of this process, with pending writes."""
+
+    def __init__(self, capacity: int = SUPPRESSION_BLOOM_CAPACITY, error_rate: float = SUPPRESSION_BLOOM_ERROR_RATE):
+        self.error_rate = error_rate
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._exact: Set[str] = set()
+        self._lock = threading.Lock()  # Also checked from synchronous senders in worker threads
+        self._pending: List[Tuple[str, str, str]] = []  # (address, reason, source) not yet written
+        self._watermark: Optional[datetime] = None
+        self._loaded_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self.required = False  # Set when the list is backed by MongoDB: sends wait for the first load
+
+        self.stats = {"checks": 0, "bloom_hits": 0, "suppressed": 0, "false_positives": 0, "rebuilds": 0}
+
+    @property
+    def ready(self) -> bool:
+        """Whether sends may go out: the list has loaded (or there is none to load)."""
+        return self._loaded_at is not None or not self.required
+
+    def is_suppressed(self, address: Optional[str]) -> bool:
+        """Whether an address is suppressed (no I/O)."""
+        key = normalize_address(address)
+        self.stats["checks"] += 1
+        if not key or key not in self._bloom:
+            return False
+        self.stats["bloom_hits"] += 1
+        if key in self._exact:
+            self.stats["suppressed"] += 1
+            return True
+        self.stats["false_positives"] += 1
+        return False
+
+    def _add(self, key: str) -> None:
+        with self._lock:
+            if key in self._exact:
+                return
+            self._exact.add(key)
+            if self._bloom.count >= self._bloom.capacity:
+                # Past capacity the false-positive rate climbs: rebuild twice as large
+                self._bloom = BloomFilter(self._bloom.capacity * 2, self.error_rate)
+                for item in self._exact:
+                    self._bloom.add(item)
+                self.stats["rebuilds"] += 1
+            else:
+                self._bloom.add(key)
+
+    def _discard(self, key: str) -> None:
+        # The Bloom filter keeps the bit; the exact set turns it into a false positive
+        with self._lock:
+            self._exact.discard(key)
+
+    def suppress_later(self, address: str, reason: str, source: str) -> None:
+        """Suppress an address now, in memory, and persist it on the next refresh."""
+        key = normalize_address(address)
+        if key:
+            self._add(key)
+            with self._lock:
+                self._pending.append((key, reason, source))
+
+    async def load(self, db) -> int:
+        """Rebuild the in-memory index from the collection. Returns the count."""
+        started = datetime.utcnow()
+        count = await db[SUPPRESSIONS_COLLECTION].estimated_document_count()
+        bloom = BloomFilter(max(count * 2, SUPPRESSION_BLOOM_CAPACITY), self.error_rate)
+        exact: Set[str] = set()
+        async for doc in db[SUPPRESSIONS_COLLECTION].find({}, {"_id": 1}):
+            bloom.add(doc["_id"])
+            exact.add(doc["_id"])
+        with self._lock:
+            # Keep what was suppressed locally while loading
+            for key, _, _ in self._pending:
+                if key not in exact:
+                    bloom.add(key)
+                    exact.add(key)
+            self._bloom, self._exact = bloom, exact
+        self._watermark = self._loaded_at = started
+        return len(exact)
+
+    async def refresh(self, db) -> Dict[str, int]:
+        """Write pending suppressions and pick up the ones added elsewhere."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        written = 0
+        if pending:
+            try:
+                written = await _upsert(db, pending)
+            except Exception:
+                with self._lock:
+                    self._pending = pending + self._pending
+                raise
+
+        since = self._watermark
+        self._watermark = datetime.utcnow()
+        added = 0
+        if since is not None:
+            async for doc in db[SUPPRESSIONS_COLLECTION].find({"updated_at": {"$gte": since}}, {"_id": 1}):
+                if doc["_id"] not in self._exact:
+                    self._add(doc["_id"])
+                    added += 1
+        return {"written": written, "added": added}
+
+    async def _run(self) -> None:
+        from app.database import get_database
+
+        while True:
+            await asyncio.sleep(SUPPRESSION_REFRESH_SECONDS if self._loaded_at else SUPPRESSION_LOAD_RETRY_SECONDS)
+            try:
+                db = get_database()
+                if self._loaded_at is None:
+                    # Sends are refused until this succeeds
+                    count = await self.load(db)
+                    print(f"[Suppression] Loaded {count} suppressed addresses, sends resumed")
+                elif (datetime.utcnow() - self._loaded_at).total_seconds() >= SUPPRESSION_RELOAD_SECONDS:
+                    await self.refresh(db)
+                    await self.load(db)
+                else:
+                    await self.refresh(db)
+            except Exception as e:
+                print(f"[Suppression] Refresh error: {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the refresher and write pending suppressions."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pending:
+            from app.database import get_database
+            try:
+                await self.refresh(get_database())
+            except Exception as e:
+                print(f"[Suppression] {len(self._pending)} suppressions not written: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "addresses": len(self._exact),
+            "pending_writes": len(self._pending),
+            "bloom": {
+                "capacity": self._bloom.capacity, "bits": self._bloom.size, "hashes": self._bloom.hashes,
+                "memory_kb": round(len(self._bloom.bits) / 1024, 1), "error_rate": self.error_rate,
+            },
+            "loaded_at": self._loaded_at.isoformat() if self._loaded_at else None,
+            "ready": self.ready,
+        }
+
+
+_suppression_list: Optional[SuppressionList] = None
+
+
+def get_suppression_list() -> SuppressionList:
+    """Get the process-wide suppression list."""
+    global _suppression_list
+    if _suppression_list is None:
+        _suppression_list = SuppressionList()
+    return _suppression_list
+
+
+def is_suppressed(address: Optional[str]) -> bool:
+    return get_suppression_list().is_suppressed(address)
+
+
+def suppression_ready() -> bool:
+    return get_suppression_list().ready
+
+
+def not_loaded_result() -> Dict[str, Any]:
+    """Send result while the suppression list has not loaded (nothing was sent)."""
+    return {"success": False, "message": NOT_LOADED}
+
+
+def suppressed_result(address: str) -> Dict[str, Any]:
+    """Send result for a suppressed recipient (nothing was sent)."""
+    return {"success": False, "suppressed": True, "message": f"Not sent: {address} is on the suppression list"}
+
+
+# ============================================
+# Persistence
+# ============================================
+
+async def _upsert(db, entries: List[Tuple[str, str, str]]) -> int:
+    """Upsert (address, reason, source) entries. Returns how many addresses were new."""
+    now = datetime.utcnow()
+    result = await db[SUPPRESSIONS_COLLECTION].bulk_write(
+        [
+            UpdateOne(
+                {"_id": key},
+                {
+                    "$setOnInsert": {"reason": reason, "source": source, "created_at": now},
+                    "$addToSet": {"reasons": reason},
+                    "$set": {"updated_at": now},
+                },
+                upsert=True
+            )
+            for key, reason, source in entries
+        ],
+        ordered=False
+    )
+    return result.upserted_count
+
+
+async def suppress_addresses(db, addresses: List[str], reason: str, source: str = "api") -> Dict[str, Any]:
+    """
+    Suppress addresses (stored and effective in this process at once).
+
+    Raises ValueError for an unknown reason.
+    """
+    if reason not in SUPPRESSION_REASONS:
+        raise ValueError(f"Invalid reason '{reason}'. Use: {', '.join(SUPPRESSION_REASONS)}")
+    normalized = [normalize_address(address) for address in addresses]
+    keys = list(dict.fromkeys(key for key in normalized if key))
+    invalid = normalized.count("")
+    if not keys:
+        return {"suppressed": 0, "already_suppressed": 0, "invalid": invalid}
+    added = await _upsert(db, [(key, reason, source) for key in keys])
+    suppression_list = get_suppression_list()
+    for key in keys:
+        suppression_list._add(key)
+    return {"suppressed": added, "already_suppressed": len(keys) - added, "invalid": invalid}
+
+
+async def remove_suppression(db, address: str) -> bool:
+    """Allow an address again. Other processes apply it at their next reload."""
+    key = normalize_address(address)
+    result = await db[SUPPRESSIONS_COLLECTION].delete_one({"_id": key})
+    get_suppression_list()._discard(key)
+    return result.deleted_count > 0
+
+
+async def list_suppressions(db, reason: Optional[str] = None, limit: int = 50) -> Dict[str, Any]:
+    """Most recent suppressions and counts per reason."""
+    query = {"reason": reason} if reason else {}
+    suppressions = []
+    async for doc in db[SUPPRESSIONS_COLLECTION].find(query).sort("created_at", -1).limit(limit):
+        doc["address"] = doc.pop("_id")
+        for field in ("created_at", "updated_at"):
+            if doc.get(field):
+                doc[field] = doc[field].isoformat()
+        suppressions.append(doc)
+    counts = {
+        row["_id"]: row["count"]
+        async for row in db[SUPPRESSIONS_COLLECTION].aggregate([{"$group": {"_id": "$reason", "count": {"$sum": 1}}}])
+    }
+    return {"suppressions": suppressions, "counts": counts, "total": sum(counts.values())}
+
+
+async def ensure_suppression_indexes(db) -> None:
+    await db[SUPPRESSIONS_COLLECTION].create_index("updated_at")
+    await db[SUPPRESSIONS_COLLECTION].create_index([("reason", 1), ("created_at", -1)])
+
+
+async def start_suppression_list() -> Optional[int]:
+    """
+    Load the suppression list and start its refresher. Returns the count
+    loaded, or None when the load failed.
+
+    The list fails closed: until a load succeeds, sends are refused (see
+    `suppression_ready`) and the refresher keeps retrying the load every
+    SUPPRESSION_LOAD_RETRY_SECONDS.
+    """
+    from app.database import get_database
+
+    suppression_list = get_suppression_list()
+    suppression_list.required = True
+    count = None
+    try:
+        count = await suppression_list.load(get_database())
+        print(f"[Suppression] Loaded {count} suppressed addresses")
+    except Exception as e:
+        print(f"[Suppression] Load failed ({e}), sends are refused until it succeeds")
+    suppression_list.start()
+    return count
+
+
+async def stop_suppression_list() -> None:
+    await get_suppression_list().stop()
+
+
+# ============================================
+# Unsubscribe Links
+# ============================================
+
+def _sign(text: str) -> str:
+    digest = hmac.new(TRACKING_SECRET.encode(), f"unsubscribe|{text}".encode(), hashlib.sha256).digest()[:12]
+    return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+
+def unsubscribe_token(address: str) -> str:
+    payload = base64.urlsafe_b64encode(normalize_address(address).encode()).decode().rstrip("=")
+    return f"{payload}.{_sign(payload)}"
+
+
+def read_unsubscribe_token(token: str) -> Optional[str]:
+    """The address in a valid unsubscribe token, else None."""
+    payload, _, signature = token.partition(".")
+    if not signing_enabled() or not payload or not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        return base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)).decode() or None
+    except ValueError:
+        return None
+
+
+def unsubscribe_link(address: str) -> Optional[str]:
+    """One-click unsubscribe URL for an address (None when tracking is not configured)."""
+    if not tracking_enabled():
+        return None
+    return f"{TRACKING_BASE_URL}/unsubscribe/{unsubscribe_token(address)}"
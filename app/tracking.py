@@ -0,0 +1,396 @@
+"""
+Open and Click Tracking for AI Marketing Agent.
+Adds a tracking pixel and tracked links to the HTML part of campaign
+emails, and ingests the resulting hits without a database write per hit.
+
+- Links: URLs in the email body are rewritten to
+  {TRACKING_BASE_URL}/t/c/{token}?u=<url>&s=<signature>, which records a
+  click and redirects. The signature covers the URL, so the endpoint is not
+  an open redirect.
+- Opens: a 1x1 GIF at {TRACKING_BASE_URL}/t/o/{token}.
+- Tokens carry the lead ID and campaign, signed with TRACKING_SECRET.
+
+Hits (and sends, for the rates) are aggregated in memory per (campaign,
+lead) and flushed every TRACKING_FLUSH_SECONDS as a few bulk `$inc`
+writes:
+
+- `engagement`: one document per campaign and lead (sent/opens/clicks,
+  first and last open/click times)
+- `engagement_campaigns`: counters per campaign, including unique opens
+  and clicks, for open/click rates
+- `leads`: `email_opens`, `email_clicks` and `last_engaged_at`, used by
+  lead scoring
+
+Tracking is off unless TRACKING_BASE_URL (the public URL of this API) is
+set and TRACKING_SECRET is set to a real secret: with no secret (or the
+.env.example placeholder) anyone could forge signatures, so no links are
+signed and no tokens are accepted.
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Tuple
+from urllib.parse import quote
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+
+TRACKING_BASE_URL = (os.getenv("TRACKING_BASE_URL") or "").rstrip("/")
+TRACKING_SECRET = os.getenv("TRACKING_SECRET") or ""
+TRACKING_FLUSH_SECONDS = float(os.getenv("TRACKING_FLUSH_SECONDS") or "2")
+TRACKING_MAX_BUFFER_KEYS = int(os.getenv("TRACKING_MAX_BUFFER_KEYS") or "50000")
+
+ENGAGEMENT_COLLECTION = "engagement"
+CAMPAIGN_ENGAGEMENT_COLLECTION = "engagement_campaigns"
+DIRECT_CAMPAIGN = "direct"
+
+# 1x1 transparent GIF
+PIXEL_GIF = base64.b64decode("R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7")
+
+# Secrets that must never sign links: unset, or the .env.example placeholder
+_PLACEHOLDER_SECRETS = {"", "change-me"}
+
+_URL = re.compile(r"""(?<!["'=>])\bhttps?://[^\s<>"']+""")
+_HREF = re.compile(r"""(href\s*=\s*["'])(https?://[^"']+)(["'])""", re.IGNORECASE)
+
+
+def signing_enabled() -> bool:
+    """Whether TRACKING_SECRET is a real secret (it also signs unsubscribe links)."""
+    return TRACKING_SECRET.strip() not in _PLACEHOLDER_SECRETS
+
+
+def tracking_enabled() -> bool:
+    return bool(TRACKING_BASE_URL) and signing_enabled()
+
+
+if TRACKING_BASE_URL and not signing_enabled():
+    print("[Tracking] TRACKING_SECRET is unset or a placeholder: tracking and unsubscribe links are disabled")
+
+
+# ============================================
+# Tokens and Links
+# ============================================
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(text: str) -> str:
+    return _b64(hmac.new(TRACKING_SECRET.encode(), text.encode(), hashlib.sha256).digest()[:12])
+
+
+def make_token(lead_id: Optional[str], campaign: Optional[str]) -> str:
+    payload = _b64(f"{lead_id or ''}|{campaign or DIRECT_CAMPAIGN}".encode())
+    return f"{payload}.{_sign(payload)}"
+
+
+def read_token(token: str) -> Optional[Tuple[str, str]]:
+    """(lead_id, campaign) from a valid token, else None."""
+    payload, _, signature = token.partition(".")
+    if not signing_enabled() or not payload or not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        lead_id, _, campaign = _unb64(payload).decode().partition("|")
+    except ValueError:
+        return None
+    return lead_id, campaign or DIRECT_CAMPAIGN
+
+
+def click_signature(token: str, url: str) -> str:
+    return _sign(f"{token}|{url}")
+
+
+def valid_click(token: str, url: str, signature: str) -> bool:
+    """Whether a click link was signed by us (never true without a real secret)."""
+    return signing_enabled() and hmac.compare_digest(signature, click_signature(token, url))
+
+
+def tracked_link(token: str, url: str) -> str:
+    return f"{TRACKING_BASE_URL}/t/c/{token}?u={quote(url, safe='')}&s={click_signature(token, url)}"
+
+
+def _link_tag(token: str, text: str) -> str:
+    url = text.rstrip(".,;:!?)")  # Sentence punctuation after a URL is not part of it
+    return f'<a href="{tracked_link(token, url)}">{url}</a>{text[len(url):]}'
+
+
+def tracked_html(body: str, lead_id: Optional[str], campaign: Optional[str]) -> str:
+    """
+    The HTML version of a body with its links rewritten through the click
+    endpoint and the open pixel appended.
+    """
+    token = make_token(lead_id, campaign)
+    html = _HREF.sub(lambda m: f"{m.group(1)}{tracked_link(token, m.group(2))}{m.group(3)}", body)
+    html = _URL.sub(lambda m: _link_tag(token, m.group(0)), html)
+    pixel = f'<img src="{TRACKING_BASE_URL}/t/o/{token}" width="1" height="1" alt="" style="display:none">'
+    return f"<html><body><pre>{html}</pre>{pixel}</body></html>"
+
+
+# ============================================
+# Event Pipeline
+# ============================================
+
+class EngagementTracker:
+    """Aggregates sends, opens and clicks in memory and flushes them in bulk."""
+
+    def __init__(self, flush_interval: float = TRACKING_FLUSH_SECONDS, max_buffer_keys: int = TRACKING_MAX_BUFFER_KEYS):
+        self.flush_interval = flush_interval
+        self.max_buffer_keys = max_buffer_keys
+
+        # (campaign, lead_id) -> {"sent", "opens", "clicks", "last_open_at", "last_click_at"}
+        self._buffer: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()  # `record` is also called from synchronous senders
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.stats = {"events": 0, "flushes": 0, "written": 0, "failed_flushes": 0, "dropped": 0}
+
+    def record(self, event: str, lead_id: Optional[str], campaign: Optional[str]) -> None:
+        """Count one "sent", "open" or "click" event (no I/O)."""
+        now = datetime.utcnow()
+        key = (campaign or DIRECT_CAMPAIGN, lead_id or "")
+        with self._lock:
+            counters = self._buffer.get(key)
+            if counters is None:
+                if len(self._buffer) >= self.max_buffer_keys:
+                    self.stats["dropped"] += 1
+                    return
+                counters = self._buffer[key] = {"sent": 0, "opens": 0, "clicks": 0}
+            if event == "sent":
+                counters["sent"] += 1
+            elif event == "open":
+                counters["opens"] += 1
+                counters["last_open_at"] = now
+            elif event == "click":
+                counters["clicks"] += 1
+                counters["last_click_at"] = now
+            self.stats["events"] += 1
+
+    def _take(self) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        with self._lock:
+            buffer, self._buffer = self._buffer, {}
+        return buffer
+
+    def _restore(self, buffer: Dict[Tuple[str, str], Dict[str, Any]]) -> None:
+        """Merge a failed flush back into the buffer."""
+        with self._lock:
+            for key, counters in buffer.items():
+                current = self._buffer.get(key)
+                if current is None:
+                    if len(self._buffer) >= self.max_buffer_keys:
+                        self.stats["dropped"] += 1
+                        continue
+                    self._buffer[key] = counters
+                    continue
+                for field in ("sent", "opens", "clicks"):
+                    current[field] += counters[field]
+                for field in ("last_open_at", "last_click_at"):
+                    if counters.get(field) and (not current.get(field) or counters[field] > current[field]):
+                        current[field] = counters[field]
+
+    async def _write(self, db, buffer: Dict[Tuple[str, str], Dict[str, Any]]) -> None:
+        now = datetime.utcnow()
+        engagement = db[ENGAGEMENT_COLLECTION]
+
+        operations = []
+        for (campaign, lead_id), counters in buffer.items():
+            update: Dict[str, Any] = {
+                "$inc": {field: counters[field] for field in ("sent", "opens", "clicks") if counters[field]},
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"campaign": campaign, "lead_id": lead_id, "created_at": now},
+            }
+            latest = {field: counters[field] for field in ("last_open_at", "last_click_at") if counters.get(field)}
+            if latest:
+                update["$max"] = latest
+            operations.append(UpdateOne({"_id": f"{campaign}|{lead_id}"}, update, upsert=True))
+        await engagement.bulk_write(operations, ordered=False)
+
+        # First opens/clicks per lead: the documents still without a first time
+        campaigns: Dict[str, Dict[str, int]] = {}
+        for (campaign, _), counters in buffer.items():
+            totals = campaigns.setdefault(campaign, {"sent": 0, "opens": 0, "clicks": 0, "unique_opens": 0, "unique_clicks": 0})
+            for field in ("sent", "opens", "clicks"):
+                totals[field] += counters[field]
+        for event, first_field, unique_field in (("opens", "first_open_at", "unique_opens"), ("clicks", "first_click_at", "unique_clicks")):
+            keys: Dict[str, List[str]] = {}
+            for (campaign, lead_id), counters in buffer.items():
+                if counters[event]:
+                    keys.setdefault(campaign, []).append(f"{campaign}|{lead_id}")
+            for campaign, ids in keys.items():
+                result = await engagement.update_many(
+                    {"_id": {"$in": ids}, first_field: None},
+                    {"$set": {first_field: now}}
+                )
+                campaigns[campaign][unique_field] += result.modified_count
+
+        await db[CAMPAIGN_ENGAGEMENT_COLLECTION].bulk_write(
+            [
+                UpdateOne(
+                    {"_id": campaign},
+                    {"$inc": totals, "$set": {"updated_at": now}, "$setOnInsert": {"created_at": now}},
+                    upsert=True
+                )
+                for campaign, totals in campaigns.items()
+            ],
+            ordered=False
+        )
+
+        # Engagement counters on the leads, for scoring
+        lead_updates: Dict[str, Dict[str, Any]] = {}
+        for (_, lead_id), counters in buffer.items():
+            if not (counters["opens"] or counters["clicks"]) or not ObjectId.is_valid(lead_id):
+                continue
+            lead = lead_updates.setdefault(lead_id, {"email_opens": 0, "email_clicks": 0, "last_engaged_at": None})
+            lead["email_opens"] += counters["opens"]
+            lead["email_clicks"] += counters["clicks"]
+            latest = max(filter(None, (counters.get("last_open_at"), counters.get("last_click_at"))))
+            lead["last_engaged_at"] = max(filter(None, (lead["last_engaged_at"], latest)))
+        if lead_updates:
+            await db.leads.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": ObjectId(lead_id)},
+                        {
+                            "$inc": {"email_opens": update["email_opens"], "email_clicks": update["email_clicks"]},
+                            "$max": {"last_engaged_at": update["last_engaged_at"]},
+                        }
+                    )
+                    for lead_id, update in lead_updates.items()
+                ],
+                ordered=False
+            )
+
+    async def flush(self) -> int:
+        """Write the buffered counters. Returns how many (campaign, lead) keys were written."""
+        from app.storage import is_mongo
+
+        async with self._flush_lock:
+            buffer = self._take()
+            if not buffer:
+                return 0
+            if not is_mongo():
+                return 0  # Tracking is stored in MongoDB only
+
+            from app.database import get_database
+            try:
+                await self._write(get_database(), buffer)
+            except Exception as e:
+                # A partly applied flush can count some hits twice; never lose them
+                self.stats["failed_flushes"] += 1
+                self._restore(buffer)
+                print(f"[Tracking] Flush failed, {len(buffer)} keys pending: {e}")
+                return 0
+
+            self.stats["flushes"] += 1
+            self.stats["written"] += len(buffer)
+            return len(buffer)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[Tracking] Background flush error: {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background task and write what is still buffered."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "pending_keys": len(self._buffer), "enabled": tracking_enabled()}
+
+
+_tracker: Optional[EngagementTracker] = None
+
+
+def get_engagement_tracker() -> EngagementTracker:
+    """Get the process-wide engagement tracker."""
+    global _tracker
+    if _tracker is None:
+        _tracker = EngagementTracker()
+    return _tracker
+
+
+def record_sent(lead_id: Optional[str], campaign: Optional[str]) -> None:
+    """Count a delivered tracked email (the denominator of open/click rates)."""
+    if tracking_enabled() and lead_id:
+        get_engagement_tracker().record("sent", lead_id, campaign)
+
+
+# ============================================
+# Reporting
+# ============================================
+
+def _rates(doc: Dict[str, Any]) -> Dict[str, Any]:
+    sent = doc.get("sent", 0)
+    return {
+        "campaign": doc.get("_id"),
+        "sent": sent,
+        "opens": doc.get("opens", 0),
+        "clicks": doc.get("clicks", 0),
+        "unique_opens": doc.get("unique_opens", 0),
+        "unique_clicks": doc.get("unique_clicks", 0),
+        "open_rate": round(100 * doc.get("unique_opens", 0) / sent, 1) if sent else 0.0,
+        "click_rate": round(100 * doc.get("unique_clicks", 0) / sent, 1) if sent else 0.0,
+        "updated_at": doc["updated_at"].isoformat() if doc.get("updated_at") else None,
+    }
+
+
+async def get_campaign_engagement(db, campaign: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    """Open/click counters and rates per campaign (most recently active first)."""
+    query = {"_id": campaign} if campaign else {}
+    cursor = db[CAMPAIGN_ENGAGEMENT_COLLECTION].find(query).sort("updated_at", -1).limit(limit)
+    return [_rates(doc) async for doc in cursor]
+
+
+async def get_engagement_totals(db) -> Dict[str, Any]:
+    """Counters and rates over all campaigns."""
+    pipeline = [{"$group": {
+        "_id": None,
+        **{field: {"$sum": f"${field}"} for field in ("sent", "opens", "clicks", "unique_opens", "unique_clicks")}
+    }}]
+    rows = await db[CAMPAIGN_ENGAGEMENT_COLLECTION].aggregate(pipeline).to_list(1)
+    totals = _rates(rows[0] if rows else {})
+    totals.pop("campaign")
+    totals.pop("updated_at")
+    return totals
+
+
+async def get_lead_engagement(db, lead_id: str) -> List[Dict[str, Any]]:
+    """Per-campaign engagement of one lead."""
+    results = []
+    async for doc in db[ENGAGEMENT_COLLECTION].find({"lead_id": lead_id}).sort("updated_at", -1):
+        doc.pop("_id")
+        for field in ("first_open_at", "last_open_at", "first_click_at", "last_click_at", "created_at", "updated_at"):
+            if doc.get(field):
+                doc[field] = doc[field].isoformat()
+        results.append(doc)
+    return results
+
+
+async def ensure_tracking_indexes(db) -> None:
+    await db[ENGAGEMENT_COLLECTION].create_index("lead_id")
+    await db[CAMPAIGN_ENGAGEMENT_COLLECTION].create_index("updated_at")
@@ -0,0 +1,160 @@
+"""
+Write-Behind Queue for AI Marketing Agent.
+Takes history persistence (generations, analyses, social posts) off the
+request path: endpoints enqueue documents and a background flusher inserts
+them in batches.
+
+The queue is bounded. When it is full, new writes are dropped and counted
+rather than blocking the request.
+"""
+
+import asyncio
+import os
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Tuple
+
+
+class WriteBehindQueue:
+    """Bounded in-process queue with a batching background flusher."""
+
+    def __init__(self, max_size: int = 10000, batch_size: int = 200, flush_interval: float = 0.5, max_retries: int = 3):
+        """
+        Args:
+            max_size: Maximum queued documents before writes are dropped
+            batch_size: Maximum documents per flush
+            flush_interval: Seconds to wait for a batch to fill before flushing
+            max_retries: Attempts per batch before it is counted as failed
+        """
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.metrics = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "failed": 0,
+            "batches": 0,
+            "last_error": None,
+            "last_flush_at": None,
+        }
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+        return self._queue
+
+    def enqueue(self, collection_name: str, document: Dict[str, Any]) -> bool:
+        """Queue a document for insertion. Returns False if it was dropped."""
+        try:
+            self.queue.put_nowait((collection_name, document))
+        except asyncio.QueueFull:
+            self.metrics["dropped"] += 1
+            print(f"[WriteBehind] Queue full, dropped {collection_name} write")
+            return False
+
+        self.metrics["enqueued"] += 1
+        if self._task is None or self._task.done():
+            self.start()
+        return True
+
+    async def _next_batch(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Wait for one item, then collect more until the batch fills or the interval passes."""
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write_batch(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        from app.storage import insert_documents
+        from app.search import SEARCH_SOURCES, extract_text
+
+        by_collection: Dict[str, List[Dict[str, Any]]] = {}
+        for collection_name, document in batch:
+            by_collection.setdefault(collection_name, []).append(document)
+
+        for collection_name, documents in by_collection.items():
+            # Extracted before the first attempt: insert_documents packs content in place
+            search_texts = None
+            if collection_name in SEARCH_SOURCES:
+                search_texts = [extract_text(collection_name, document) for document in documents]
+            for attempt in range(1, self.max_retries + 1):
+                try:
+                    await insert_documents(collection_name, documents, search_texts)
+                    self.metrics["written"] += len(documents)
+                    break
+                except Exception as e:
+                    self.metrics["last_error"] = f"{collection_name}: {e}"
+                    if attempt == self.max_retries:
+                        self.metrics["failed"] += len(documents)
+                        print(f"[WriteBehind] Gave up on {len(documents)} {collection_name} writes: {e}")
+                    else:
+                        await asyncio.sleep(0.5 * attempt)
+
+        self.metrics["batches"] += 1
+        self.metrics["last_flush_at"] = datetime.utcnow().isoformat()
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def start(self) -> None:
+        """Start the background flusher (call from within the event loop)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Drain the queue (up to `timeout` seconds), then stop the flusher."""
+        if self._task and not self._task.done():
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                print(f"[WriteBehind] Shutdown with {self.queue.qsize()} writes still queued")
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            **self.metrics,
+            "queue_depth": self.queue.qsize(),
+            "max_size": self.max_size,
+            "running": self._task is not None and not self._task.done(),
+        }
+
+
+# Singleton instance
+_queue_instance = None
+
+
+def get_write_behind_queue() -> WriteBehindQueue:
+    """Get or create the write-behind queue singleton."""
+    global _queue_instance
+    if _queue_instance is None:
+        _queue_instance = WriteBehindQueue(
+            max_size=int(os.getenv("WRITE_BEHIND_MAX_SIZE", "10000")),
+            batch_size=int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200")),
+            flush_interval=float(os.getenv("WRITE_BEHIND_FLUSH_SECONDS", "0.5"))
+        )
+    return _queue_instance
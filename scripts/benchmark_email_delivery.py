@@ -0,0 +1,178 @@
+"""
+Email Delivery Benchmark for AI Marketing Agent.
+Compares the ways campaigns can send mail against a local SMTP sink that
+accepts everything and discards it:
+
+- per-message: connect + login + send + quit for every email (the old
+  `send_email` behaviour)
+- pooled: the synchronous connection pool, one email at a time
+- async: the async delivery engine (app/email_delivery.py)
+
+The sink can add latency to every SMTP reply and to the greeting/login, to
+model the round trips and TLS handshake of a real server like Gmail.
+
+Usage (from the repository root):
+    python -m scripts.benchmark_email_delivery --emails 2000 --concurrency 20 --latency-ms 20 --connect-ms 300
+"""
+
+import argparse
+import asyncio
+import smtplib
+import threading
+import time
+
+from app.integrations.email_sender import SMTPConnectionPool, build_message
+from app.email_delivery import AsyncEmailDelivery
+
+
+SENDER = "benchmark@example.com"
+PASSWORD = "benchmark"
+
+
+# ============================================
+# SMTP Sink
+# ============================================
+
+class SMTPSink:
+    """Minimal SMTP server on its own thread and event loop (no TLS, any login accepted)."""
+
+    def __init__(self, latency_ms: float = 0.0, connect_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.connect_delay = connect_ms / 1000
+        self.connections = 0
+        self.messages = 0
+        self.port = None
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+
+    async def _reply(self, writer: asyncio.StreamWriter, *lines: str) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        writer.write("".join(f"{line}\r\n" for line in lines).encode())
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            await asyncio.sleep(self.connect_delay / 2)
+            await self._reply(writer, "220 sink ESMTP")
+            in_data = False
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                if in_data:
+                    if line in (b".\r\n", b".\n"):
+                        in_data = False
+                        self.messages += 1
+                        await self._reply(writer, "250 OK queued")
+                    continue
+                command = line[:4].decode(errors="replace").upper()
+                if command in ("EHLO", "HELO"):
+                    await self._reply(writer, "250-sink", "250-8BITMIME", "250 AUTH PLAIN")
+                elif command == "AUTH":
+                    await asyncio.sleep(self.connect_delay / 2)
+                    await self._reply(writer, "235 Authentication successful")
+                elif command == "DATA":
+                    in_data = True
+                    await self._reply(writer, "354 End data with <CR><LF>.<CR><LF>")
+                elif command == "QUIT":
+                    await self._reply(writer, "221 Bye")
+                    return
+                else:
+                    await self._reply(writer, "250 OK")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _serve(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(asyncio.start_server(self._handle, "127.0.0.1", 0))
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    def start(self) -> "SMTPSink":
+        threading.Thread(target=self._serve, daemon=True).start()
+        self._ready.wait()
+        return self
+
+
+# ============================================
+# Benchmarks
+# ============================================
+
+def _emails(count: int):
+    return [
+        {"key": i, "to": f"lead{i}@example.com", "subject": f"Special offer #{i}", "body": f"Hi Lead {i},\n\nOffer inside."}
+        for i in range(count)
+    ]
+
+
+def run_per_message(sink: SMTPSink, emails) -> int:
+    sent = 0
+    for email in emails:
+        msg = build_message(SENDER, email["to"], email["subject"], email["body"])
+        with smtplib.SMTP("127.0.0.1", sink.port) as server:
+            server.login(SENDER, PASSWORD)
+            server.sendmail(SENDER, email["to"], msg.as_string())
+        sent += 1
+    return sent
+
+
+def run_pooled(sink: SMTPSink, emails) -> int:
+    pool = SMTPConnectionPool(SENDER, PASSWORD, host="127.0.0.1", port=sink.port, use_ssl=False, starttls=False)
+    for email in emails:
+        msg = build_message(SENDER, email["to"], email["subject"], email["body"])
+        pool.send(SENDER, email["to"], msg.as_string())
+    pool.close_all()
+    return len(emails)
+
+
+async def run_async(sink: SMTPSink, emails, concurrency: int) -> int:
+    delivery = AsyncEmailDelivery(
+        SENDER, PASSWORD, concurrency=concurrency,
+        host="127.0.0.1", port=sink.port, use_ssl=False, starttls=False,
+        paced=False  # Measure raw throughput, not the configured send limits
+    )
+    sent = 0
+    async for result in delivery.deliver(emails):
+        sent += result["success"]
+    return sent
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=1000, help="Emails per mode")
+    parser.add_argument("--concurrency", type=int, default=20, help="Async engine connections")
+    parser.add_argument("--latency-ms", type=float, default=10.0, help="Delay before every SMTP reply")
+    parser.add_argument("--connect-ms", type=float, default=200.0, help="Extra delay for greeting + login")
+    parser.add_argument("--modes", default="per-message,pooled,async", help="Comma-separated modes to run")
+    parser.add_argument("--per-message-limit", type=int, default=200, help="Cap for the slow per-message mode")
+    args = parser.parse_args()
+
+    print(f"Sink: {args.latency_ms:g}ms per reply, {args.connect_ms:g}ms connect + login\n")
+    print(f"{'mode':<14}{'emails':>8}{'sent':>8}{'seconds':>10}{'emails/min':>12}{'connections':>13}")
+
+    for mode in args.modes.split(","):
+        sink = SMTPSink(args.latency_ms, args.connect_ms).start()
+        count = min(args.emails, args.per_message_limit) if mode == "per-message" else args.emails
+        emails = _emails(count)
+
+        started = time.perf_counter()
+        if mode == "per-message":
+            sent = run_per_message(sink, emails)
+        elif mode == "pooled":
+            sent = run_pooled(sink, emails)
+        elif mode == "async":
+            sent = asyncio.run(run_async(sink, emails, args.concurrency))
+        else:
+            raise SystemExit(f"Unknown mode '{mode}'")
+        elapsed = time.perf_counter() - started
+
+        print(f"{mode:<14}{count:>8}{sent:>8}{elapsed:>10.2f}{count / elapsed * 60:>12.0f}{sink.connections:>13}")
+
+
+if __name__ == "__main__":
+    main()